@@ -0,0 +1,663 @@
+"""
+This file contains the static analysis of productions, i.e. what a
+production requires of a host graph to be matched, and the
+bookkeeping which builds upon it during a run of a grammar.
+"""
+
+import ast
+import itertools
+from typing import Dict, List, Iterable, Tuple, Any, FrozenSet, Set, Union
+
+from model_gen.graph import GraphElement, Vertex, Edge
+from model_gen.productions import Production
+from model_gen.utils import get_logger
+
+log = get_logger('model_gen.' + __name__)
+
+
+class ElementRequirement:
+    """
+    The requirements a single element of a mother graph poses on the
+    host element it is matched to, as far as they can be determined
+    without evaluating any attribute.
+
+    These are the type of the element, the attributes which must be
+    present and, for attributes compared against constants, the set
+    of values they may take.
+    """
+
+    def __init__(self, kind: type, keys: FrozenSet[str],
+                 values: Dict[str, Tuple[Any, ...]],
+                 predicates: Dict[str, str] = None):
+        self.kind: type = kind
+        self.keys: FrozenSet[str] = keys
+        self.values: Dict[str, Tuple[Any, ...]] = values
+        if predicates is None:
+            predicates = {}
+        self.predicates: Dict[str, str] = predicates
+
+    def admits(self, element: GraphElement) -> bool:
+        """
+        Test whether the element could possibly be matched against the
+        mother element this requirement was derived from.
+
+        :param element: The host element to test.
+        :return: False if the element can never be matched, True
+            otherwise.
+        """
+        if not isinstance(element, self.kind):
+            return False
+        attr = element.attr
+        for key in self.keys:
+            if key not in attr:
+                return False
+        for key, allowed in self.values.items():
+            value = attr[key]
+            if not any(value == allowed_value for allowed_value in allowed):
+                return False
+        return True
+
+    def __repr__(self):
+        return (f'ElementRequirement({self.kind.__name__}, '
+                f'keys={sorted(self.keys)}, values={self.values})')
+
+
+def get_constant_values(predicate: str) -> Union[Tuple[Any, ...], None]:
+    """
+    Return the constants an attribute is compared against by a match
+    predicate, if the predicate consists only of such a comparison.
+
+    Recognised are predicates of the form `attr == <constant>`,
+    `<constant> == attr` and `attr in <constant collection>`.
+
+    :param predicate: The predicate of a mother graph element.
+    :return: A tuple of all values the attribute may take for the
+        predicate to be true or None if this cannot be determined.
+    """
+    if not isinstance(predicate, str):
+        return None
+    try:
+        tree = ast.parse(predicate.strip(), mode='eval')
+    except SyntaxError:
+        return None
+    node = tree.body
+    if (not isinstance(node, ast.Compare) or len(node.ops) != 1
+            or len(node.comparators) != 1):
+        return None
+    left = node.left
+    right = node.comparators[0]
+    operator = node.ops[0]
+    try:
+        if isinstance(operator, ast.Eq):
+            if isinstance(left, ast.Name) and left.id == 'attr':
+                return ast.literal_eval(right),
+            if isinstance(right, ast.Name) and right.id == 'attr':
+                return ast.literal_eval(left),
+        elif (isinstance(operator, ast.In) and isinstance(left, ast.Name)
+              and left.id == 'attr'):
+            values = ast.literal_eval(right)
+            if isinstance(values, (tuple, list, set, frozenset)):
+                return tuple(values)
+    except ValueError:
+        pass
+    return None
+
+
+def get_element_requirement(element: GraphElement) -> ElementRequirement:
+    """
+    Derive the requirements of a mother graph element.
+
+    :param element: An element of a mother graph.
+    :return: The requirements the element poses on host elements.
+    """
+    keys = set()
+    values = {}
+    predicates = {}
+    for key, predicate in element.attr.items():
+        if key in ('x', 'y') or key.startswith('.'):
+            continue
+        keys.add(key)
+        predicates[key] = predicate
+        constants = get_constant_values(predicate)
+        if constants is not None:
+            values[key] = constants
+    kind = Vertex if isinstance(element, Vertex) else Edge
+    return ElementRequirement(kind, frozenset(keys), values, predicates)
+
+
+def get_production_requirements(production: Production
+                                ) -> List[ElementRequirement]:
+    """
+    Return the requirements of all elements of the mother graph of a
+    production.
+
+    :param production: The production to analyse.
+    :return: A list containing one requirement per mother element.
+    """
+    return [get_element_requirement(element) for element
+            in production.mother_graph.element_list('vef')
+            if isinstance(element, (Vertex, Edge))]
+
+
+def is_deterministic(production: Production) -> bool:
+    """
+    Test if matching the production against an unchanged host graph
+    always yields the same result.
+
+    This is the case unless the geometric ordering condition of the
+    production is an expression which could change between
+    evaluations.
+
+    :param production: The production to test.
+    :return: True if the result of matching is deterministic.
+    """
+    condition = production.conditions.get('.geometric_ordering', None)
+    if condition is None or isinstance(condition, bool):
+        return True
+    try:
+        ast.literal_eval(str(condition))
+    except (ValueError, SyntaxError):
+        return False
+    return True
+
+
+class SearchPlan:
+    """
+    Determines where the search for matches of the mother graph of a
+    production starts.
+
+    The search starts at the vertex whose requirement is the most
+    selective, i.e. which compares the most attributes against
+    constants. Host elements which cannot satisfy that requirement are
+    skipped before any predicate is evaluated.
+    """
+
+    def __init__(self, production: Production):
+        """
+        :param production: The production to plan the search for.
+        """
+        mother_graph = production.mother_graph
+        candidates = list(mother_graph.vertices)
+        if len(candidates) == 0:
+            candidates = list(mother_graph.edges)
+        self.start_element: Union[GraphElement, None] = None
+        self.start_requirement: Union[ElementRequirement, None] = None
+        best_score = None
+        for element in candidates:
+            requirement = get_element_requirement(element)
+            score = (len(requirement.values), len(requirement.keys),
+                     len(element.neighbours()))
+            if best_score is None or score > best_score:
+                best_score = score
+                self.start_element = element
+                self.start_requirement = requirement
+
+    def admits(self, element: GraphElement) -> bool:
+        """
+        Test whether a host element could be matched against the start
+        element.
+
+        :param element: The host element to test.
+        :return: False if the element can never be matched against the
+            start element, True otherwise.
+        """
+        return self.start_requirement.admits(element)
+
+    def __repr__(self):
+        return f'SearchPlan(start={self.start_requirement!r})'
+
+
+class NegativeMatchCache:
+    """
+    Remembers which productions failed to match the host graph, so that
+    they are not matched again until the host graph changes in a way
+    relevant to them.
+
+    A match which did not exist in the previous host graph must contain
+    at least one element that was added or changed by the last
+    derivation step. A production which failed to match therefore can
+    only match again once such an element satisfies the requirements
+    of one of the elements of its mother graph.
+
+    If a dependency graph of the productions is given, only the
+    successors of the production applied last are considered for
+    revival.
+    """
+
+    def __init__(self, productions: Iterable[Production],
+                 dependencies: 'DependencyGraph' = None):
+        self.dead: Set[Production] = set()
+        self.excluded: Set[Production] = set()
+        self.dependencies: Union['DependencyGraph', None] = dependencies
+        self._volatile: Set[Production] = set()
+        self._by_value: Dict[Tuple[type, str, Any],
+                             List[Tuple[Production, ElementRequirement]]] = {}
+        self._by_key: Dict[Tuple[type, str],
+                           List[Tuple[Production, ElementRequirement]]] = {}
+        self._by_kind: Dict[type,
+                            List[Tuple[Production, ElementRequirement]]] = {}
+        for production in productions:
+            if not is_deterministic(production):
+                self._volatile.add(production)
+                continue
+            for requirement in get_production_requirements(production):
+                self._index(production, requirement)
+
+    def _index(self, production: Production,
+               requirement: ElementRequirement) -> None:
+        """
+        Add a requirement to the index under its most selective key.
+        """
+        entry = (production, requirement)
+        for key, allowed in requirement.values.items():
+            try:
+                for value in allowed:
+                    self._by_value.setdefault(
+                        (requirement.kind, key, value), []
+                    ).append(entry)
+                return
+            except TypeError:
+                # Unhashable constants can't be indexed by value.
+                continue
+        for key in requirement.keys:
+            self._by_key.setdefault((requirement.kind, key), []).append(entry)
+            return
+        self._by_kind.setdefault(requirement.kind, []).append(entry)
+
+    def is_dead(self, production: Production) -> bool:
+        """
+        Test if the production is known to not match the host graph.
+
+        :param production: The production to test.
+        :return: True if matching the production can be skipped.
+        """
+        return production in self.dead or production in self.excluded
+
+    def exclude(self, production: Production) -> None:
+        """
+        Permanently skip a production, e.g. because it was found to be
+        unreachable from the host graph.
+
+        :param production: The production to skip.
+        """
+        self.excluded.add(production)
+
+    def mark_failed(self, production: Production) -> None:
+        """
+        Record that the production did not match the current host graph.
+
+        :param production: The production which failed to match.
+        """
+        if production not in self._volatile:
+            self.dead.add(production)
+
+    def update(self, elements: Iterable[GraphElement],
+               producer: str = None) -> None:
+        """
+        Revive all dead productions for which at least one of the
+        added or changed elements is relevant.
+
+        :param elements: The elements added or changed by the last
+            derivation step.
+        :param producer: The name of the production applied in the last
+            derivation step. Only used together with a dependency graph.
+        """
+        if len(self.dead) == 0:
+            return
+        revivable = self.dead
+        if self.dependencies is not None and producer is not None:
+            revivable = {self.dependencies.productions[name] for name
+                         in self.dependencies.successors[producer]}
+            revivable &= self.dead
+            if len(revivable) == 0:
+                return
+        for element in elements:
+            kind = Vertex if isinstance(element, Vertex) else Edge
+            candidates = list(self._by_kind.get(kind, ()))
+            for key, value in element.attr.items():
+                candidates.extend(self._by_key.get((kind, key), ()))
+                try:
+                    candidates.extend(self._by_value.get((kind, key, value),
+                                                         ()))
+                except TypeError:
+                    continue
+            for production, requirement in candidates:
+                if production in revivable and requirement.admits(element):
+                    self.dead.discard(production)
+                    revivable.discard(production)
+            if len(revivable) == 0:
+                return
+
+
+ANY_VALUE = object()
+"""Placeholder for an attribute value which can't be determined statically."""
+
+
+class ElementWrite:
+    """
+    Describes statically what the attributes of an element look like
+    after a production option added or changed it.
+
+    `values` maps attribute names to a tuple of the values the attribute
+    may take or to `ANY_VALUE` if the value is unknown. If the element
+    is `open`, attributes not contained in `values` may be present with
+    any value, which is the case for elements which existed before
+    and keep all attributes not overwritten by the production.
+    """
+
+    def __init__(self, kind: type,
+                 values: Dict[str, Union[Tuple[Any, ...], object]],
+                 open_: bool):
+        self.kind: type = kind
+        self.values: Dict[str, Union[Tuple[Any, ...], object]] = values
+        self.open: bool = open_
+
+    def may_satisfy(self, requirement: ElementRequirement) -> bool:
+        """
+        Test if the element could satisfy the requirement after it was
+        written.
+
+        :param requirement: The requirement of a mother element.
+        :return: False if the written element can never satisfy the
+            requirement, True otherwise.
+        """
+        if self.kind is not requirement.kind:
+            return False
+        for key in requirement.keys:
+            if key not in self.values:
+                if not self.open:
+                    return False
+                continue
+            possible = self.values[key]
+            if possible is ANY_VALUE:
+                continue
+            allowed = requirement.values.get(key, None)
+            if allowed is None:
+                if not _may_accept(requirement.predicates.get(key, None),
+                                   possible):
+                    return False
+                continue
+            if not any(value == allowed_value for value in possible
+                       for allowed_value in allowed):
+                return False
+        return True
+
+    def __repr__(self):
+        return (f'ElementWrite({self.kind.__name__}, values={self.values}, '
+                f'open={self.open})')
+
+
+def _may_accept(predicate: Union[str, None],
+                possible: Tuple[Any, ...]) -> bool:
+    """
+    Test if a match predicate could accept any of the possible values.
+
+    The predicate is evaluated with each of the values. If it depends
+    on anything else, e.g. other attributes or variables, it is
+    assumed to possibly accept them.
+    """
+    if not isinstance(predicate, str):
+        return True
+    for value in possible:
+        try:
+            if eval(predicate, {'attr': value, 'attrs': {}}):
+                return True
+        except Exception:
+            return True
+    return False
+
+
+def get_written_value(expression: Any) -> Union[Tuple[Any], object]:
+    """
+    Return the value a daughter attribute expression evaluates to, if
+    it is a literal.
+
+    :param expression: The attribute expression of a daughter element.
+    :return: A tuple containing the value or `ANY_VALUE`.
+    """
+    if not isinstance(expression, str):
+        return ANY_VALUE
+    try:
+        return ast.literal_eval(expression.strip()),
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return ANY_VALUE
+
+
+def get_production_writes(production: Production) -> List[ElementWrite]:
+    """
+    Return the writes of all elements added or changed by any option
+    of a production.
+
+    :param production: The production to analyse.
+    :return: A list of element writes.
+    """
+    result = []
+    for option in production.production_options:
+        mother_of = option.mapping.inverse
+        for element in itertools.chain(option.to_add, option.to_change):
+            if not isinstance(element, (Vertex, Edge)):
+                continue
+            values = {}
+            mother_element = mother_of.get(element, None)
+            if mother_element is not None:
+                # Attributes not written by the production keep the value
+                # they had in the host, which satisfied the mother graph.
+                requirement = get_element_requirement(mother_element)
+                for key in requirement.keys:
+                    values[key] = requirement.values.get(key, ANY_VALUE)
+            for key, expression in element.attr.items():
+                if key in ('x', 'y', 'new_x', 'new_y') or key.startswith('.'):
+                    continue
+                values[key] = get_written_value(expression)
+            kind = Vertex if isinstance(element, Vertex) else Edge
+            result.append(ElementWrite(kind, values,
+                                       mother_element is not None))
+    return result
+
+
+class DependencyGraph:
+    """
+    The static producer/consumer graph of a set of productions.
+
+    There is an edge from production `p` to production `q` if an element
+    added or changed by `p` could satisfy the requirements of an element
+    of the mother graph of `q`. Only then can applying `p` create a new
+    match for `q`.
+    """
+
+    def __init__(self, productions: Dict[str, Production]):
+        self.productions: Dict[str, Production] = dict(productions)
+        self.requirements: Dict[str, List[ElementRequirement]] = {
+            name: get_production_requirements(production)
+            for name, production in self.productions.items()
+        }
+        self.writes: Dict[str, List[ElementWrite]] = {
+            name: get_production_writes(production)
+            for name, production in self.productions.items()
+        }
+        self.successors: Dict[str, Set[str]] = {
+            name: set() for name in self.productions
+        }
+        self.predecessors: Dict[str, Set[str]] = {
+            name: set() for name in self.productions
+        }
+        for producer, writes in self.writes.items():
+            for consumer, requirements in self.requirements.items():
+                if any(write.may_satisfy(requirement) for write in writes
+                       for requirement in requirements):
+                    self.successors[producer].add(consumer)
+                    self.predecessors[consumer].add(producer)
+
+    def reachable(self, host_graph: Iterable[GraphElement]) -> Set[str]:
+        """
+        Return the names of all productions which could possibly be
+        applied during a derivation starting at the host graph.
+
+        A production is reachable if every element of its mother graph
+        can be satisfied by an element of the host graph or by an
+        element written by another reachable production.
+
+        :param host_graph: The graph the derivation starts with.
+        :return: The set of names of reachable productions.
+        """
+        host_elements = [element for element in host_graph
+                         if isinstance(element, (Vertex, Edge))]
+        satisfied = {
+            name: [any(requirement.admits(element)
+                       for element in host_elements)
+                   for requirement in requirements]
+            for name, requirements in self.requirements.items()
+        }
+        result = set()
+        changed = True
+        while changed:
+            changed = False
+            for name, requirements in self.requirements.items():
+                if name in result:
+                    continue
+                for index, requirement in enumerate(requirements):
+                    if satisfied[name][index]:
+                        continue
+                    satisfied[name][index] = any(
+                        write.may_satisfy(requirement)
+                        for producer in self.predecessors[name]
+                        if producer in result
+                        for write in self.writes[producer]
+                    )
+                if all(satisfied[name]):
+                    result.add(name)
+                    changed = True
+        return result
+
+    def terminal_productions(self) -> Set[str]:
+        """
+        Return the names of all productions whose application can not
+        create a new match for any production.
+
+        :return: A set of production names.
+        """
+        return {name for name, successors in self.successors.items()
+                if len(successors) == 0}
+
+    def terminal_values(self) -> Set[Tuple[str, str, Any]]:
+        """
+        Return the constant attribute values written by the productions
+        which no production requires, e.g. the terminal symbols of the
+        grammar.
+
+        :return: A set of tuples of element type name, attribute name
+            and value.
+        """
+        result = set()
+        for name, writes in self.writes.items():
+            for write in writes:
+                for key, possible in write.values.items():
+                    if possible is ANY_VALUE:
+                        continue
+                    for value in possible:
+                        consumed = any(
+                            requirement.kind is write.kind
+                            and key in requirement.keys
+                            and (key not in requirement.values
+                                 or value in requirement.values[key])
+                            for requirements in self.requirements.values()
+                            for requirement in requirements
+                        )
+                        if not consumed:
+                            try:
+                                result.add((write.kind.__name__, key, value))
+                            except TypeError:
+                                continue
+        return result
+
+    def topological_order(self) -> List[List[str]]:
+        """
+        Return the productions grouped into strongly connected
+        components in topological order, i.e. productions can only
+        enable productions in the same or a later group.
+
+        :return: A list of groups of production names.
+        """
+        index_of = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = itertools.count()
+        for root in self.productions:
+            if root in index_of:
+                continue
+            # Iterative version of Tarjan's algorithm.
+            work = [(root, iter(sorted(self.successors[root])))]
+            index_of[root] = lowlink[root] = next(counter)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, successors = work[-1]
+                advanced = False
+                for successor in successors:
+                    if successor not in index_of:
+                        index_of[successor] = lowlink[successor] = \
+                            next(counter)
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor,
+                                     iter(sorted(self.successors[successor]))))
+                        advanced = True
+                        break
+                    elif successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index_of[successor])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+        components.reverse()
+        return components
+
+
+class GrammarAnalysis:
+    """
+    The result of analysing the productions of a grammar against a
+    host graph.
+    """
+
+    def __init__(self, dependencies: DependencyGraph,
+                 host_graph: Iterable[GraphElement] = None):
+        self.dependencies: DependencyGraph = dependencies
+        names = set(dependencies.productions)
+        if host_graph is not None:
+            self.reachable: Set[str] = dependencies.reachable(host_graph)
+        else:
+            self.reachable: Set[str] = names
+        self.unreachable: Set[str] = names - self.reachable
+        self.terminal_productions: Set[str] = \
+            dependencies.terminal_productions()
+        self.terminal_values: Set[Tuple[str, str, Any]] = \
+            dependencies.terminal_values()
+        self.order: List[List[str]] = dependencies.topological_order()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the analysis as a dict, e.g. for display or export.
+
+        :return: A dict containing the results of the analysis.
+        """
+        return {
+            'order': self.order,
+            'successors': {name: sorted(successors) for name, successors
+                           in self.dependencies.successors.items()},
+            'unreachable': sorted(self.unreachable),
+            'terminal_productions': sorted(self.terminal_productions),
+            'terminal_values': sorted(self.terminal_values, key=repr),
+        }
@@ -0,0 +1,232 @@
+"""
+This file contains the batch export of graphs, which renders many
+graphs concurrently in a pool of processes.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from timeit import default_timer as timer
+from typing import Dict, List, Any, Tuple, Mapping, Iterable
+
+from model_gen.graph import Graph
+from model_gen.binary import to_binary, from_binary
+from model_gen.exports import export_graph_to_svg, export_graph_to_TIKZ, \
+    export_graph_to_png
+from model_gen.utils import get_logger
+from model_gen.exceptions import ModelGenArgumentError
+
+log = get_logger('model_gen.' + __name__)
+
+EXPORT_FORMATS = {
+    'svg': '.svg',
+    'tikz': '.tex',
+    'binary': '.npz',
+    'png': '.png',
+}
+"""The supported export formats and the extensions of their files."""
+
+_worker_options: Dict[str, Any] = {}
+"""The options of the export, set once in every worker process."""
+
+
+class BatchReport:
+    """
+    The outcome of a batch export.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, str] = {}
+        """The exported files by the name of their graph."""
+        self.failures: Dict[str, str] = {}
+        """The error messages of graphs which could not be exported."""
+        self.elements: int = 0
+        """The number of elements of all exported graphs."""
+        self.seconds: float = 0.0
+        """The wall-clock time of the export."""
+
+    @property
+    def graphs_per_second(self) -> float:
+        return len(self.files) / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def elements_per_second(self) -> float:
+        return self.elements / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f'Exported {len(self.files)} graphs with {self.elements} '
+                f'elements in {self.seconds:.2f} seconds '
+                f'({self.graphs_per_second:.1f} graphs/s, '
+                f'{self.elements_per_second:.0f} elements/s), '
+                f'{len(self.failures)} failed.')
+
+
+def graph_file_names(names: Iterable[str], export_format: str
+                     ) -> Dict[str, str]:
+    """
+    Return the names of the files graphs are exported to.
+
+    Characters not allowed in file names are replaced, so different
+    graph names may result in the same file name, e.g. `Result 0` and
+    `Result_0`. Such file names, also those only differing in case, get
+    a suffix `_2`, `_3`, ... for all but the first graph, so no file is
+    overwritten.
+
+    :param names: The names of the graphs.
+    :param export_format: One of `EXPORT_FORMATS`.
+    :return: The file names by the name of their graph.
+    """
+    extension = EXPORT_FORMATS[export_format]
+    result = {}
+    taken = set()
+    for name in names:
+        stem = re.sub(r'[^\w.-]+', '_', name)
+        file_name = stem + extension
+        index = 1
+        while file_name.lower() in taken:
+            index += 1
+            file_name = f'{stem}_{index}{extension}'
+        if index > 1:
+            log.warning(f'The file name of the graph {name} is already '
+                        f'used, exporting it into »{file_name}«.')
+        taken.add(file_name.lower())
+        result[name] = file_name
+    return result
+
+
+def _init_worker(export_format: str, output_dir: str,
+                 preamble: Dict) -> None:
+    """
+    Set the options shared by all exports of a worker process.
+    """
+    _worker_options['format'] = export_format
+    _worker_options['output_dir'] = output_dir
+    _worker_options['preamble'] = preamble
+
+
+def _export_graph(file_name: str, data: bytes) -> str:
+    """
+    Export a single graph in a worker process.
+
+    Graphs are sent to the workers in the binary format, which is much
+    smaller and faster to create than a pickle of the graph. For the
+    binary export the data is written as it is.
+
+    :return: The path to the file of the graph.
+    """
+    export_format = _worker_options['format']
+    path = os.path.join(_worker_options['output_dir'], file_name)
+    if export_format == 'binary':
+        try:
+            with open(path, 'wb') as stream:
+                stream.write(data)
+        except IOError as e:
+            log.error(f'Cannot write the binary file »{path}«.')
+            raise e
+        return path
+    graph = from_binary(data)
+    if export_format == 'svg':
+        export_graph_to_svg(graph, path, _worker_options['preamble'])
+    elif export_format == 'tikz':
+        export_graph_to_TIKZ(graph, path)
+    else:
+        export_graph_to_png(graph, path)
+    return path
+
+
+def _serialise_graph(graphs: Mapping[str, Graph], name: str
+                     ) -> Tuple[bytes, int]:
+    """
+    Return the binary data of a graph and its number of elements.
+    """
+    graph = graphs[name]
+    return to_binary(graph), len(graph.vertices) + len(graph.edges)
+
+
+def export_graphs(graphs: Mapping[str, Graph], output_dir: str,
+                  export_format: str = 'svg', preamble: Dict = None,
+                  workers: int = None) -> BatchReport:
+    """
+    Export many graphs into files, one per graph, concurrently.
+
+    The options of the export, including the svg preamble, are sent to
+    every worker process once when it starts. Graphs which can not be
+    exported are logged and reported, but do not stop the export of
+    the others. The files are named by `graph_file_names`.
+
+    :param graphs: The graphs to export by name. Lazily loaded graphs
+        are loaded one at a time while they are sent to the workers, and
+        at most two graphs per worker wait to be exported at any time.
+    :param output_dir: The directory the files are written to. Created
+        if it does not exist.
+    :param export_format: One of `EXPORT_FORMATS`.
+    :param preamble: The svg preamble of the grammar.
+    :param workers: The number of worker processes, defaults to the
+        number of processors. With 1 all graphs are exported in this
+        process.
+    :return: The report of the export.
+    """
+    if export_format not in EXPORT_FORMATS:
+        log.error(f'Unknown export format {export_format}, expected one of '
+                  f'{", ".join(EXPORT_FORMATS)}.')
+        raise ModelGenArgumentError
+    if preamble is None:
+        preamble = {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    file_names = graph_file_names(graphs, export_format)
+    report = BatchReport()
+    start_time = timer()
+    log.info(f'Exporting {len(graphs)} graphs as {export_format} into '
+             f'»{output_dir}« with {workers} workers.')
+    init_args = (export_format, output_dir, preamble)
+    if workers == 1:
+        _init_worker(*init_args)
+        for name in graphs:
+            try:
+                data, elements = _serialise_graph(graphs, name)
+                path = _export_graph(file_names[name], data)
+            except Exception as e:
+                _record_failure(report, name, e)
+                continue
+            report.files[name] = path
+            report.elements += elements
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=init_args) as executor:
+            names = iter(graphs)
+            pending: Dict[Any, Tuple[str, int]] = {}
+            while True:
+                for name in names:
+                    try:
+                        data, elements = _serialise_graph(graphs, name)
+                    except Exception as e:
+                        _record_failure(report, name, e)
+                        continue
+                    future = executor.submit(_export_graph,
+                                             file_names[name], data)
+                    pending[future] = (name, elements)
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, elements = pending.pop(future)
+                    try:
+                        path = future.result()
+                    except Exception as e:
+                        _record_failure(report, name, e)
+                        continue
+                    report.files[name] = path
+                    report.elements += elements
+    report.seconds = timer() - start_time
+    log.info(str(report))
+    return report
+
+
+def _record_failure(report: BatchReport, name: str, error: Exception) -> None:
+    log.error(f'Cannot export the graph {name}: {error!r}.')
+    report.failures[name] = repr(error)
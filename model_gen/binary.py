@@ -0,0 +1,565 @@
+"""
+This file contains a compact binary format for graphs, productions and
+grammar infos, which is much faster to read and write than yaml.
+
+The data is saved as a NumPy `.npz` archive of flat arrays:
+
+* `vertex_xy` holds the coordinates of all vertices whose `x` and `y`
+  attributes are floats, `edge_vertices` the indices of the vertices
+  connected by every edge or -1 if an edge is not connected.
+* All attributes are saved as rows of an attribute table, with the keys
+  and string values referring to a table of unique strings.
+* The graphs list the indices of their vertices and edges, so elements
+  contained in several graphs are only saved once.
+* Everything else, e.g. the structure of productions, is saved as yaml
+  in the `meta` array, referring to elements by `2 * index` for
+  vertices and `2 * index + 1` for edges.
+"""
+
+import gc
+import io
+from contextlib import contextmanager
+from functools import singledispatch, partial
+from typing import Dict, List, Any, Union, Tuple
+
+import numpy as np
+import yaml
+
+from model_gen.graph import Graph, GraphElement, Vertex, Edge
+from model_gen.productions import Production, ProductionOption
+from model_gen.grammar import GrammarInfo, LazyGraphMapping
+from model_gen.utils import Mapping, get_logger, YamlLoader, YamlDumper
+from model_gen.exceptions import ModelGenInvalidValueError
+
+log = get_logger('model_gen.' + __name__)
+
+BINARY_FORMAT = 'model_gen-binary'
+BINARY_VERSION = 1
+BINARY_EXTENSION = '.npz'
+
+_NONE = 0
+_BOOL = 1
+_INT = 2
+_FLOAT = 3
+_STR = 4
+_YAML = 5
+_COORD = 6
+"""The x- or y-coordinate of a vertex saved in `vertex_xy`."""
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+class _BinaryWriter:
+    """
+    Collects the graphs to be saved and converts them to arrays.
+    """
+
+    def __init__(self):
+        self._strings: Dict[str, int] = {}
+        self._vertex_index: Dict[int, int] = {}
+        self._edge_index: Dict[int, int] = {}
+        self._graph_index: Dict[int, int] = {}
+        self._vertices: List[Vertex] = []
+        self._edges: List[Edge] = []
+        self._graph_vertices: List[int] = []
+        self._graph_vertex_offsets: List[int] = [0]
+        self._graph_edges: List[int] = []
+        self._graph_edge_offsets: List[int] = [0]
+
+    def string(self, text: str) -> int:
+        index = self._strings.get(text, None)
+        if index is None:
+            index = len(self._strings)
+            self._strings[text] = index
+        return index
+
+    def add_graph(self, graph: Graph) -> int:
+        """
+        Add a graph and all of its elements.
+
+        :return: The index of the graph.
+        """
+        index = self._graph_index.get(id(graph), None)
+        if index is not None:
+            return index
+        for vertex in graph.vertices:
+            vertex_index = self._vertex_index.get(id(vertex), None)
+            if vertex_index is None:
+                vertex_index = len(self._vertices)
+                self._vertex_index[id(vertex)] = vertex_index
+                self._vertices.append(vertex)
+            self._graph_vertices.append(vertex_index)
+        for edge in graph.edges:
+            edge_index = self._edge_index.get(id(edge), None)
+            if edge_index is None:
+                edge_index = len(self._edges)
+                self._edge_index[id(edge)] = edge_index
+                self._edges.append(edge)
+            self._graph_edges.append(edge_index)
+        self._graph_vertex_offsets.append(len(self._graph_vertices))
+        self._graph_edge_offsets.append(len(self._graph_edges))
+        index = len(self._graph_index)
+        self._graph_index[id(graph)] = index
+        return index
+
+    def ref(self, element: GraphElement) -> int:
+        """
+        Return the reference to an element of an added graph.
+        """
+        if isinstance(element, Vertex):
+            return 2 * self._vertex_index[id(element)]
+        return 2 * self._edge_index[id(element)] + 1
+
+    def arrays(self, meta: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Convert all added graphs to arrays.
+
+        :param meta: The data saved alongside the graphs.
+        :return: A dict of array names and arrays.
+        """
+        vertex_xy = np.zeros((len(self._vertices), 2), dtype=np.float64)
+        attr_offsets = [0]
+        attr_keys = []
+        attr_types = []
+        int_values = []
+        float_values = []
+        for index, vertex in enumerate(self._vertices):
+            attr = vertex.attr
+            x = attr.get('x', None)
+            y = attr.get('y', None)
+            in_xy = type(x) is float and type(y) is float
+            if in_xy:
+                vertex_xy[index, 0] = x
+                vertex_xy[index, 1] = y
+            for key, value in attr.items():
+                attr_keys.append(self.string(key))
+                if in_xy and (key == 'x' or key == 'y'):
+                    attr_types.append(_COORD)
+                    int_values.append(0)
+                else:
+                    self._encode(value, attr_types, int_values, float_values)
+            attr_offsets.append(len(attr_keys))
+        edge_vertices = np.full((len(self._edges), 2), -1, dtype=np.int32)
+        for index, edge in enumerate(self._edges):
+            if edge.vertex1 is not None:
+                edge_vertices[index, 0] = self._vertex_index[id(edge.vertex1)]
+            if edge.vertex2 is not None:
+                edge_vertices[index, 1] = self._vertex_index[id(edge.vertex2)]
+            for key, value in edge.attr.items():
+                attr_keys.append(self.string(key))
+                self._encode(value, attr_types, int_values, float_values)
+            attr_offsets.append(len(attr_keys))
+        types = np.array(attr_types, dtype=np.int8)
+        values = np.zeros(len(types), dtype=np.int64)
+        is_float = types == _FLOAT
+        values[~is_float] = int_values
+        values[is_float] = np.array(float_values,
+                                    dtype=np.float64).view(np.int64)
+        meta = {'format': BINARY_FORMAT, 'version': BINARY_VERSION, **meta}
+        encoded = [text.encode('utf-8') for text in self._strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=string_offsets[1:])
+        return {
+            'meta': _to_bytes_array(yaml.dump(meta, Dumper=YamlDumper)
+                                    .encode('utf-8')),
+            'string_data': _to_bytes_array(b''.join(encoded)),
+            'string_offsets': string_offsets,
+            'vertex_xy': vertex_xy,
+            'edge_vertices': edge_vertices,
+            'attr_offsets': np.array(attr_offsets, dtype=np.int64),
+            'attr_keys': np.array(attr_keys, dtype=np.int32),
+            'attr_types': types,
+            'attr_values': values,
+            'graph_vertices': np.array(self._graph_vertices, dtype=np.int32),
+            'graph_vertex_offsets': np.array(self._graph_vertex_offsets,
+                                             dtype=np.int64),
+            'graph_edges': np.array(self._graph_edges, dtype=np.int32),
+            'graph_edge_offsets': np.array(self._graph_edge_offsets,
+                                           dtype=np.int64),
+        }
+
+    def _encode(self, value: Any, types: List[int], int_values: List[int],
+                float_values: List[float]) -> None:
+        value_type = type(value)
+        if value_type is float:
+            types.append(_FLOAT)
+            float_values.append(value)
+            return
+        if value is None:
+            types.append(_NONE)
+            int_values.append(0)
+        elif value_type is bool:
+            types.append(_BOOL)
+            int_values.append(int(value))
+        elif value_type is int and _INT64_MIN <= value <= _INT64_MAX:
+            types.append(_INT)
+            int_values.append(value)
+        elif value_type is str:
+            types.append(_STR)
+            int_values.append(self.string(value))
+        else:
+            types.append(_YAML)
+            int_values.append(self.string(yaml.dump(value,
+                                                    Dumper=YamlDumper)))
+
+
+class _BinaryReader:
+    """
+    Recreates the graphs saved in the arrays of a binary file.
+
+    Elements and graphs are only created once they are requested.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.meta: Dict[str, Any] = yaml.load(
+            arrays['meta'].tobytes().decode('utf-8'), Loader=YamlLoader
+        )
+        if (not isinstance(self.meta, dict)
+                or self.meta.get('format', None) != BINARY_FORMAT):
+            log.error('The data is not in the binary format of model_gen.')
+            raise ModelGenInvalidValueError
+        if self.meta.get('version', None) != BINARY_VERSION:
+            log.error(f'The binary format version '
+                      f'{self.meta.get("version", None)} is not supported.')
+            raise ModelGenInvalidValueError
+        string_data = arrays['string_data'].tobytes()
+        offsets = arrays['string_offsets'].tolist()
+        strings = np.array([string_data[start:end].decode('utf-8')
+                            for start, end in zip(offsets, offsets[1:])]
+                           + [''], dtype=object)
+        self._vertex_xy = arrays['vertex_xy']
+        self._edge_vertices = arrays['edge_vertices'].tolist()
+        self._attr_offsets = arrays['attr_offsets'].tolist()
+        keys = arrays['attr_keys']
+        types = arrays['attr_types']
+        payload = arrays['attr_values']
+        values = np.empty(len(types), dtype=object)
+        is_type = types == _BOOL
+        values[is_type] = (payload[is_type] != 0).tolist()
+        is_type = types == _INT
+        values[is_type] = payload[is_type].tolist()
+        is_type = types == _FLOAT
+        values[is_type] = payload[is_type].view(np.float64).tolist()
+        is_type = types == _STR
+        values[is_type] = strings[payload[is_type]]
+        is_type = types == _COORD
+        if is_type.any():
+            num_vertices = len(self._vertex_xy)
+            owners = np.repeat(np.arange(len(self._attr_offsets) - 1),
+                               np.diff(arrays['attr_offsets']))[is_type]
+            if len(owners) > 0 and owners.max() >= num_vertices:
+                log.error('The binary data contains coordinates of edges.')
+                raise ModelGenInvalidValueError
+            is_y = (strings[keys[is_type]] == 'y').astype(np.intp)
+            values[is_type] = self._vertex_xy[owners, is_y].tolist()
+        for row in np.flatnonzero(types == _YAML).tolist():
+            values[row] = yaml.load(strings[payload[row]], Loader=YamlLoader)
+        self._keys: List[str] = strings[keys].tolist()
+        self._values: List[Any] = values.tolist()
+        self._graph_vertices = arrays['graph_vertices'].tolist()
+        self._graph_vertex_offsets = arrays['graph_vertex_offsets'].tolist()
+        self._graph_edges = arrays['graph_edges'].tolist()
+        self._graph_edge_offsets = arrays['graph_edge_offsets'].tolist()
+        self._vertices: List[Union[Vertex, None]] = [None] * len(
+            self._vertex_xy
+        )
+        self._edges: List[Union[Edge, None]] = [None] * len(
+            self._edge_vertices
+        )
+        self._graphs: Dict[int, Graph] = {}
+
+    def _attr(self, row: int) -> Dict[str, Any]:
+        start = self._attr_offsets[row]
+        end = self._attr_offsets[row + 1]
+        return dict(zip(self._keys[start:end], self._values[start:end]))
+
+    def vertex(self, index: int) -> Vertex:
+        vertex = self._vertices[index]
+        if vertex is None:
+            vertex = Vertex()
+            vertex.attr = self._attr(index)
+            self._vertices[index] = vertex
+        return vertex
+
+    def edge(self, index: int) -> Edge:
+        edge = self._edges[index]
+        if edge is None:
+            vertex1, vertex2 = self._edge_vertices[index]
+            edge = Edge(self.vertex(vertex1) if vertex1 >= 0 else None,
+                        self.vertex(vertex2) if vertex2 >= 0 else None)
+            edge.attr = self._attr(len(self._vertices) + index)
+            self._edges[index] = edge
+        return edge
+
+    def element(self, ref: int) -> GraphElement:
+        if ref % 2 == 0:
+            return self.vertex(ref // 2)
+        return self.edge(ref // 2)
+
+    def graph(self, index: int) -> Graph:
+        graph = self._graphs.get(index, None)
+        if graph is not None:
+            return graph
+        with _gc_paused():
+            graph = self._create_graph(index)
+        self._graphs[index] = graph
+        return graph
+
+    def _create_graph(self, index: int) -> Graph:
+        vertices = [self.vertex(vertex_index) for vertex_index in
+                    self._graph_vertices[self._graph_vertex_offsets[index]:
+                                         self._graph_vertex_offsets[index + 1]]]
+        edges = [self.edge(edge_index) for edge_index in
+                 self._graph_edges[self._graph_edge_offsets[index]:
+                                   self._graph_edge_offsets[index + 1]]]
+        return Graph.from_elements(vertices, edges, validate=False)
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Disable the cyclic garbage collector, which is triggered over and
+    over without ever freeing anything while creating many elements.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _to_bytes_array(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+@singledispatch
+def _add_to_writer(object_, writer: _BinaryWriter) -> Dict[str, Any]:
+    """
+    Add an object to the writer and return the data describing it.
+    """
+    log.error(f'Objects of type {type(object_).__name__} can not be saved '
+              f'in the binary format.')
+    raise NotImplementedError
+
+
+@_add_to_writer.register(Graph)
+def _(graph: Graph, writer: _BinaryWriter) -> Dict[str, Any]:
+    return {'kind': 'graph', 'graph': writer.add_graph(graph)}
+
+
+def _production_meta(production: Production,
+                     writer: _BinaryWriter) -> Dict[str, Any]:
+    meta = {
+        'mother_graph': writer.add_graph(production.mother_graph),
+        'priority': production.priority,
+        'conditions': production.conditions,
+        'vectors': {
+            name: writer.ref(vec_info) if isinstance(vec_info, GraphElement)
+            else [writer.ref(vec_info[0]), writer.ref(vec_info[1])]
+            for name, vec_info in production.vectors.items()
+        },
+        'options': [],
+    }
+    for option in production.production_options:
+        mother_graph = writer.add_graph(option.mother_graph)
+        daughter_graph = writer.add_graph(option.daughter_graph)
+        meta['options'].append({
+            'mother_graph': mother_graph,
+            'daughter_graph': daughter_graph,
+            'weight': option.weight,
+            'conditions': option.conditions,
+            'mapping': [[writer.ref(mother_element),
+                         writer.ref(daughter_element)]
+                        for mother_element, daughter_element
+                        in option.mapping.items()],
+            'attr_requirements': [
+                ['all' if element == 'all' else writer.ref(element),
+                 {name: writer.ref(mother_element) for name, mother_element
+                  in requirements.items()}]
+                for element, requirements
+                in option.attr_requirements.items()
+            ],
+            'var_calc_instructions': [
+                list(instruction) for instruction
+                in option.var_calc_instructions
+            ],
+        })
+    return meta
+
+
+@_add_to_writer.register(Production)
+def _(production: Production, writer: _BinaryWriter) -> Dict[str, Any]:
+    return {'kind': 'production',
+            'production': _production_meta(production, writer)}
+
+
+@_add_to_writer.register(GrammarInfo)
+def _(grammar_info: GrammarInfo, writer: _BinaryWriter) -> Dict[str, Any]:
+    return {
+        'kind': 'grammar_info',
+        'host_graphs': {name: writer.add_graph(graph) for name, graph
+                        in grammar_info.host_graphs.items()},
+        'productions': {name: _production_meta(production, writer)
+                        for name, production
+                        in grammar_info.productions.items()},
+        'result_graphs': {name: writer.add_graph(graph) for name, graph
+                          in grammar_info.result_graphs.items()},
+        'global_vars': grammar_info.global_vars,
+        'subgrammars': grammar_info.subgrammars,
+        'options': grammar_info.options,
+        'extra': grammar_info.extra,
+        'svg': {'preamble': grammar_info.svg_preamble},
+    }
+
+
+def _read_production(meta: Dict[str, Any],
+                     reader: _BinaryReader) -> Production:
+    options = []
+    for option_meta in meta['options']:
+        attr_requirements = {
+            key if key == 'all' else reader.element(key): {
+                name: reader.element(ref) for name, ref
+                in requirements.items()
+            }
+            for key, requirements in option_meta['attr_requirements']
+        }
+        options.append(ProductionOption(
+            reader.graph(option_meta['mother_graph']),
+            Mapping({reader.element(mother_ref): reader.element(daughter_ref)
+                     for mother_ref, daughter_ref in option_meta['mapping']}),
+            reader.graph(option_meta['daughter_graph']),
+            option_meta['weight'],
+            attr_requirements=attr_requirements,
+            conditions=option_meta['conditions'],
+            var_calc_instructions=option_meta['var_calc_instructions']
+        ))
+    vectors = {
+        name: reader.element(ref) if isinstance(ref, int)
+        else (reader.element(ref[0]), reader.element(ref[1]))
+        for name, ref in meta['vectors'].items()
+    }
+    return Production(reader.graph(meta['mother_graph']), options, vectors,
+                      int(meta['priority']), meta['conditions'])
+
+
+def _read(reader: _BinaryReader,
+          result_graphs: Union[bool, Any] = True
+          ) -> Union[Graph, Production, GrammarInfo]:
+    meta = reader.meta
+    kind = meta.get('kind', None)
+    if kind == 'graph':
+        return reader.graph(meta['graph'])
+    if kind == 'production':
+        return _read_production(meta['production'], reader)
+    if kind != 'grammar_info':
+        log.error(f'Unknown kind of binary data {kind}.')
+        raise ModelGenInvalidValueError
+    if result_graphs is True:
+        wanted = set(meta['result_graphs'])
+    elif result_graphs is False:
+        wanted = set()
+    else:
+        wanted = set(result_graphs)
+    result = GrammarInfo()
+    result.host_graphs = LazyGraphMapping({
+        name: partial(reader.graph, index)
+        for name, index in meta['host_graphs'].items()
+    })
+    result.productions = {name: _read_production(production_meta, reader)
+                          for name, production_meta
+                          in meta['productions'].items()}
+    result.result_graphs = LazyGraphMapping({
+        name: partial(reader.graph, index)
+        for name, index in meta['result_graphs'].items() if name in wanted
+    })
+    result.global_vars = meta.get('global_vars', {})
+    result.subgrammars = meta.get('subgrammars', []) or []
+    result.options = meta.get('options', {})
+    result.extra = meta.get('extra', {})
+    result.svg_preamble = meta.get('svg', {}).get('preamble', {})
+    return result
+
+
+def to_binary(object_: Union[Graph, Production, GrammarInfo],
+              compress: bool = False) -> bytes:
+    """
+    Serialise a graph, production or grammar info into the binary
+    format.
+
+    :param object_: The object to serialise.
+    :param compress: Whether to compress the arrays, which makes the
+        data smaller but slower to write.
+    :return: The binary data.
+    """
+    writer = _BinaryWriter()
+    meta = _add_to_writer(object_, writer)
+    stream = io.BytesIO()
+    if compress:
+        np.savez_compressed(stream, **writer.arrays(meta))
+    else:
+        np.savez(stream, **writer.arrays(meta))
+    return stream.getvalue()
+
+
+def from_binary(data: bytes, result_graphs: Union[bool, Any] = True
+                ) -> Union[Graph, Production, GrammarInfo]:
+    """
+    Deserialise a graph, production or grammar info from binary data.
+
+    :param data: The binary data created by `to_binary`.
+    :param result_graphs: For a grammar info, which result graphs to
+        load. True to load all of them, False to load none or the names
+        of those to load.
+    :return: The deserialised object.
+    """
+    return _load(io.BytesIO(data), result_graphs)
+
+
+def save_binary(object_: Union[Graph, Production, GrammarInfo],
+                file_path: str, compress: bool = False) -> None:
+    """
+    Write a graph, production or grammar info into a binary file.
+
+    :param object_: The object to save.
+    :param file_path: Path to the file.
+    :param compress: See `to_binary`.
+    """
+    data = to_binary(object_, compress)
+    try:
+        with open(file_path, 'wb') as stream:
+            stream.write(data)
+    except IOError as e:
+        log.error(f'Cannot write the binary file »{file_path}«.')
+        raise e
+
+
+def load_binary(file_path: str, result_graphs: Union[bool, Any] = True
+                ) -> Union[Graph, Production, GrammarInfo]:
+    """
+    Read a graph, production or grammar info from a binary file.
+
+    :param file_path: Path to the file.
+    :param result_graphs: See `from_binary`.
+    :return: The object saved in the file.
+    """
+    try:
+        with open(file_path, 'rb') as stream:
+            return _load(stream, result_graphs)
+    except IOError as e:
+        log.error(f'Cannot read the binary file »{file_path}«.')
+        raise e
+
+
+def _load(stream, result_graphs: Union[bool, Any]
+          ) -> Union[Graph, Production, GrammarInfo]:
+    try:
+        with np.load(stream, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+    except (ValueError, OSError) as e:
+        log.error('The data is not a valid binary archive.')
+        raise ModelGenInvalidValueError from e
+    with _gc_paused():
+        return _read(_BinaryReader(arrays), result_graphs)
@@ -0,0 +1,124 @@
+"""
+This file contains the budgets which limit the resources a single run
+of a grammar may use.
+"""
+
+import sys
+from enum import Enum
+from typing import Union
+
+from model_gen.graph import Graph
+from model_gen.utils import get_logger
+from model_gen.exceptions import ModelGenArgumentError
+
+log = get_logger('model_gen.' + __name__)
+
+
+class StopReason(Enum):
+    """
+    The reason a run of a grammar stopped.
+    """
+    NO_MATCH = 'no_match'
+    """No production matched the host graph anymore."""
+    MAX_STEPS = 'max_steps'
+    """The maximum number of derivation steps was reached."""
+    DEADLINE = 'deadline'
+    """The wall-clock time of the run was used up."""
+    MAX_ELEMENTS = 'max_elements'
+    """The result graph grew too large."""
+    MAX_MEMORY = 'max_memory'
+    """The derivation used up the memory budget."""
+
+
+def estimate_graph_memory(graph: Graph, samples: int = 64) -> int:
+    """
+    Estimate the memory used by a graph in bytes.
+
+    Only a sample of the elements is measured, the estimate is their
+    average size times the number of elements in the graph.
+
+    :param graph: The graph to estimate.
+    :param samples: The maximum number of elements measured.
+    :return: The estimated size of the graph in bytes.
+    """
+    result = (sys.getsizeof(graph) + sys.getsizeof(graph.vertices)
+              + sys.getsizeof(graph.edges) + sys.getsizeof(graph.faces))
+    elements = graph.element_list('vef')
+    if len(elements) == 0:
+        return result
+    stride = max(1, len(elements) // samples)
+    sampled = elements[::stride]
+    sampled_size = 0
+    for element in sampled:
+        sampled_size += sys.getsizeof(element)
+        for value in element.__dict__.values():
+            if isinstance(value, (list, set, dict, tuple)):
+                sampled_size += sys.getsizeof(value)
+        for value in element.attr.values():
+            sampled_size += sys.getsizeof(value)
+    return result + sampled_size * len(elements) // len(sampled)
+
+
+class RunBudget:
+    """
+    Limits the resources a single run of a grammar may use.
+
+    Every limit is optional. When one of them is exceeded the run stops
+    after the current derivation step and the partial derivation is
+    returned along with the reason.
+
+    The memory used is estimated from the sizes of the result graphs
+    retained in the derivation, see `estimate_graph_memory`.
+
+    A budget only holds the limits, the resources used so far are kept
+    in the `RunContext` of every run. So one budget may be shared by
+    several runs, even at the same time.
+    """
+
+    def __init__(self, deadline: float = None, max_elements: int = None,
+                 max_memory: int = None, max_matches: int = None):
+        """
+        :param deadline: The maximum wall-clock time of the run in
+            seconds.
+        :param max_elements: The maximum number of elements of a
+            result graph.
+        :param max_memory: The maximum estimated memory in bytes used
+            by all result graphs of the derivation.
+        :param max_matches: The maximum number of matches enumerated
+            per derivation step. Once reached the search for further
+            matches is aborted and the match is selected from the ones
+            found so far.
+        """
+        for name, value in (('deadline', deadline),
+                            ('max_elements', max_elements),
+                            ('max_memory', max_memory),
+                            ('max_matches', max_matches)):
+            if value is not None and value <= 0:
+                log.error(f'The budget {name} must be positive, but is '
+                          f'{value}.')
+                raise ModelGenArgumentError(f'The budget {name} must be '
+                                            f'positive.')
+        self.deadline: Union[float, None] = deadline
+        self.max_elements: Union[int, None] = max_elements
+        self.max_memory: Union[int, None] = max_memory
+        self.max_matches: Union[int, None] = max_matches
+
+    def check(self, graph: Graph, elapsed: float,
+              memory: int) -> Union[StopReason, None]:
+        """
+        Test if a run has used up any part of its budget.
+
+        :param graph: The current host graph.
+        :param elapsed: The wall-clock time since the start of the run
+            in seconds.
+        :param memory: The estimated memory used by the result graphs
+            of the run in bytes.
+        :return: The reason to stop the run or None if it may continue.
+        """
+        if self.deadline is not None and elapsed >= self.deadline:
+            return StopReason.DEADLINE
+        if self.max_elements is not None and len(graph) > self.max_elements:
+            return StopReason.MAX_ELEMENTS
+        if self.max_memory is not None and memory > self.max_memory:
+            return StopReason.MAX_MEMORY
+        return None
@@ -0,0 +1,287 @@
+"""
+This file contains an on-disk cache of grammar files, which allows to
+load a grammar file that did not change since it was last loaded
+without parsing and compiling it again.
+"""
+
+import copy
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+from functools import lru_cache, partial
+from typing import Dict, List, MutableMapping, Union
+
+from model_gen.graph import Graph
+from model_gen.grammar import GrammarInfo, LazyGraphMapping
+from model_gen.compilation import CompiledGrammar, add_compiled_grammar
+from model_gen.binary import BINARY_EXTENSION, to_binary, from_binary
+from model_gen.serialisation import load_grammar_info
+from model_gen.opts import Opts
+from model_gen.utils import get_logger
+from model_gen.exceptions import ModelGenArgumentError
+
+opts = Opts()
+log = get_logger('model_gen.' + __name__)
+
+CACHE_VERSION = 2
+CACHE_EXTENSION = '.cache'
+DEFAULT_MAX_FILES = 64
+"""The number of cached files kept if the option `cache_max_files` is
+not set."""
+
+
+def get_cache_dir() -> str:
+    """
+    Return the directory of the cache, which is the `cache_dir` option
+    if set, and `model_gen` in the XDG cache directory otherwise.
+
+    :return: Path to the directory.
+    """
+    cache_dir = opts.get('cache_dir', None)
+    if cache_dir:
+        return os.path.expanduser(cache_dir)
+    base_dir = os.environ.get('XDG_CACHE_HOME', None)
+    if not base_dir:
+        base_dir = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, 'model_gen')
+
+
+def cache_key(content: bytes) -> str:
+    """
+    Calculate the key of the content of a grammar file.
+
+    Besides the content the key depends on the source code of
+    `model_gen` and the version of Python, so cached files are never
+    read by code which might not understand them.
+
+    :param content: The content of the file.
+    :return: The hex digest of a sha256 hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{_source_digest()}|{sys.version}|'
+                  f'{CACHE_VERSION}|'.encode('utf-8'))
+    digest.update(content)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _source_digest() -> str:
+    """
+    Return a hash of all Python modules of `model_gen`, which changes
+    whenever a pickled class might have changed.
+    """
+    digest = hashlib.sha256()
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(source_dir, '*.py'))):
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as stream:
+            digest.update(stream.read())
+    return digest.hexdigest()
+
+
+def load_grammar_info_cached(file_path: str, cache_dir: str = None
+                             ) -> GrammarInfo:
+    """
+    Read a grammar info from a file like `load_grammar_info`, using
+    the cache if the content of the file was loaded before.
+
+    The cache holds the grammar info without its graphs in the binary
+    format along with the compiled grammars of all of its stages, which
+    are made available to `compile_grammar`. The host and result graphs
+    stay lazy, the cache only keeps how to load each of them from the
+    content of the file, e.g. the yaml document of a result graph. If
+    the file is not cached yet it is loaded, compiled and added to the
+    cache without creating any graphs.
+
+    :param file_path: Path to the file.
+    :param cache_dir: The directory of the cache, see `get_cache_dir`
+        for the default.
+    :return: The grammar info saved in the file.
+    """
+    try:
+        with open(file_path, 'rb') as stream:
+            content = stream.read()
+    except IOError as e:
+        log.error(f'Cannot read the grammar file »{file_path}«.')
+        raise e
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    cache_path = os.path.join(cache_dir, cache_key(content) + CACHE_EXTENSION)
+    binary = file_path.endswith(BINARY_EXTENSION)
+    result = _read_cache(cache_path, content, binary)
+    if result is not None:
+        log.info(f'Loaded the grammar file »{file_path}« from the cache.')
+        return result
+    result = load_grammar_info(file_path)
+    try:
+        compiled = [stage.compile()
+                    for stage in result.create_grammar().stages()]
+    except ModelGenArgumentError:
+        # The error is raised again if a grammar is created.
+        compiled = []
+    _write_cache(cache_path, result, compiled, binary)
+    return result
+
+
+def _read_cache(cache_path: str, content: bytes, binary: bool
+                ) -> Union[GrammarInfo, None]:
+    """
+    Read a grammar info from the cache and add its compiled grammars.
+
+    :param cache_path: Path to the cached file.
+    :param content: The content of the grammar file.
+    :param binary: Whether the grammar file is in the binary format.
+    :return: The grammar info, None if it is not cached or the cached
+        file can not be read.
+    """
+    try:
+        with open(cache_path, 'rb') as stream:
+            data = pickle.load(stream)
+        if binary:
+            # Binary files already create their graphs lazily.
+            grammar_info = from_binary(content)
+        else:
+            grammar_info = from_binary(data['grammar_info'])
+            grammar_info.host_graphs = _cached_graphs(data['host_graphs'])
+            grammar_info.result_graphs = _cached_graphs(
+                data['result_graphs'])
+        compiled = data['compiled']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Whatever is wrong with the file, the grammar file is parsed.
+        log.warning(f'Ignoring the invalid cache file »{cache_path}«: '
+                    f'{e!r}.')
+        return None
+    try:
+        # The modification time orders the files for pruning.
+        os.utime(cache_path)
+    except OSError:
+        pass
+    for compiled_grammar in compiled:
+        add_compiled_grammar(compiled_grammar)
+    return grammar_info
+
+
+def _write_cache(cache_path: str, grammar_info: GrammarInfo,
+                 compiled: List[CompiledGrammar], binary: bool) -> None:
+    """
+    Add a grammar info to the cache.
+
+    Failing to write the cache is logged, but not an error. Every file
+    is written into a temporary file first, so processes reading the
+    cache never see a partially written file. Afterwards the cache is
+    pruned, see `prune_cache`.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if binary:
+            data = {'compiled': compiled}
+        else:
+            header = copy.copy(grammar_info)
+            header.host_graphs = {}
+            header.result_graphs = {}
+            data = {
+                'grammar_info': to_binary(header),
+                'host_graphs': _graph_loaders(grammar_info.host_graphs),
+                'result_graphs': _graph_loaders(grammar_info.result_graphs),
+                'compiled': compiled
+            }
+        os.makedirs(cache_dir, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=cache_dir,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as stream:
+                pickle.dump(data, stream, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except (IOError, pickle.PicklingError) as e:
+        log.warning(f'Cannot write the cache file »{cache_path}«: {e!r}.')
+        return
+    log.debug(f'Wrote the cache file »{cache_path}«.')
+    prune_cache(cache_dir)
+
+
+def _graph_loaders(graphs: MutableMapping[str, Graph]) -> Dict[str, bytes]:
+    """
+    Pickle a loader for every graph, without creating the graphs which
+    were not accessed yet.
+
+    :param graphs: The graphs by name.
+    :return: The pickled loaders by name.
+    """
+    result = {}
+    for name in graphs:
+        loader = None
+        if isinstance(graphs, LazyGraphMapping):
+            loader = graphs.loader(name)
+        if loader is None:
+            loader = partial(from_binary, to_binary(graphs[name]))
+        result[name] = pickle.dumps(loader, pickle.HIGHEST_PROTOCOL)
+    return result
+
+
+def _cached_graphs(loaders: Dict[str, bytes]) -> LazyGraphMapping:
+    """
+    Create the graphs of pickled loaders once they are accessed.
+    """
+    return LazyGraphMapping({name: partial(_load_graph, loader)
+                             for name, loader in loaders.items()})
+
+
+def _load_graph(loader: bytes) -> Graph:
+    return pickle.loads(loader)()
+
+
+def prune_cache(cache_dir: str = None, max_files: int = None) -> None:
+    """
+    Remove the least recently used cached grammar files, which are
+    those with the oldest modification time.
+
+    :param cache_dir: The directory of the cache, see `get_cache_dir`
+        for the default.
+    :param max_files: The number of files to keep, defaults to the
+        option `cache_max_files`.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if max_files is None:
+        max_files = opts.get('cache_max_files', DEFAULT_MAX_FILES)
+    cache_paths = []
+    for cache_path in glob.glob(os.path.join(cache_dir,
+                                             '*' + CACHE_EXTENSION)):
+        try:
+            cache_paths.append((os.path.getmtime(cache_path), cache_path))
+        except OSError:
+            # Removed by another process in the meantime.
+            continue
+    cache_paths.sort(reverse=True)
+    for _, cache_path in cache_paths[max_files:]:
+        try:
+            os.remove(cache_path)
+        except OSError as e:
+            log.warning(f'Cannot remove the cache file »{cache_path}«: '
+                        f'{e!r}.')
+
+
+def clear_cache(cache_dir: str = None) -> None:
+    """
+    Remove all cached grammar files.
+
+    :param cache_dir: The directory of the cache, see `get_cache_dir`
+        for the default.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    for cache_path in glob.glob(os.path.join(cache_dir,
+                                             '*' + CACHE_EXTENSION)):
+        try:
+            os.remove(cache_path)
+        except OSError as e:
+            log.warning(f'Cannot remove the cache file »{cache_path}«: '
+                        f'{e!r}.')
@@ -0,0 +1,160 @@
+"""
+This file contains the checkpoints written during runs of a grammar,
+which allow to resume a run after the process was terminated.
+"""
+
+import os
+import pickle
+import zlib
+from typing import Dict, List, Any, Union
+
+from model_gen.graph import Graph
+from model_gen.utils import get_logger
+from model_gen.exceptions import ModelGenArgumentError
+
+log = get_logger('model_gen.' + __name__)
+
+CHECKPOINT_VERSION = 2
+
+
+class Checkpoint:
+    """
+    The complete state of a run of a grammar between two derivation
+    steps.
+
+    Continuing a run from a checkpoint yields the same derivation steps
+    the run would have performed had it not been interrupted.
+    """
+
+    def __init__(self, graph: Graph, step_counts: Dict[Any, int],
+                 max_steps: Dict[Any, int],
+                 weights: Dict[str, Any],
+                 global_vars: Dict[str, Any],
+                 option_vars: Dict[str, List[Dict[str, Any]]],
+                 random_state: tuple = None,
+                 dead: List[str] = None,
+                 stage: int = 0,
+                 first_step: int = 0,
+                 run_max_steps: Dict[Any, int] = None):
+        """
+        :param graph: The current host graph.
+        :param step_counts: The number of performed derivation steps,
+            categorised by priority.
+        :param max_steps: The maximum number of derivation steps of the
+            current stage, see `Grammar._stage_max_steps`.
+        :param weights: The weights overriding those of the
+            production options.
+        :param global_vars: The evaluated global variables.
+        :param option_vars: The evaluated per-run variables of every
+            production option, keyed by the name of the production.
+        :param random_state: The state of the random number generator
+            of the run.
+        :param dead: The names of all productions known not to match
+            the current host graph.
+        :param stage: The index of the stage of the grammar the run is
+            in, see `Grammar.stages`.
+        :param first_step: The number of derivation steps performed by
+            the previous stages.
+        :param run_max_steps: The maximum number of derivation steps of
+            the whole run, defaults to `max_steps`.
+        """
+        self.graph: Graph = graph
+        self.step_counts: Dict[Any, int] = step_counts
+        self.max_steps: Dict[Any, int] = max_steps
+        self.weights: Dict[str, Any] = weights
+        self.global_vars: Dict[str, Any] = global_vars
+        self.option_vars: Dict[str, List[Dict[str, Any]]] = option_vars
+        self.random_state: Union[tuple, None] = random_state
+        if dead is None:
+            dead = []
+        self.dead: List[str] = dead
+        self.stage: int = stage
+        self.first_step: int = first_step
+        if run_max_steps is None:
+            run_max_steps = max_steps
+        self.run_max_steps: Dict[Any, int] = run_max_steps
+
+    def save(self, file_path: str) -> None:
+        """
+        Write the checkpoint into a file.
+
+        The graph is saved in the binary format, see `to_binary`. The
+        checkpoint is first written into a temporary file which then
+        replaces the target file, so an interrupted write never destroys
+        the previous checkpoint.
+
+        :param file_path: Path to the file.
+        """
+        # Imported here, as the binary format depends on the grammar,
+        # which depends on this module.
+        from model_gen.binary import to_binary
+        data = {
+            'version': CHECKPOINT_VERSION,
+            'graph': to_binary(self.graph),
+            'step_counts': self.step_counts,
+            'max_steps': self.max_steps,
+            'weights': self.weights,
+            'global_vars': self.global_vars,
+            'option_vars': self.option_vars,
+            'random_state': self.random_state,
+            'dead': self.dead,
+            'stage': self.stage,
+            'first_step': self.first_step,
+            'run_max_steps': self.run_max_steps,
+        }
+        try:
+            payload = zlib.compress(
+                pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 1
+            )
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            log.error(f'Cannot serialise the state of the run for the '
+                      f'checkpoint »{file_path}«.')
+            raise ModelGenArgumentError from e
+        temp_path = file_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as stream:
+                stream.write(payload)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(temp_path, file_path)
+        except IOError as e:
+            log.error(f'Cannot write the checkpoint »{file_path}«.')
+            raise e
+        log.debug(f'Wrote checkpoint »{file_path}« at step '
+                  f'{self.step_counts["all"]}.')
+
+    @staticmethod
+    def load(file_path: str) -> 'Checkpoint':
+        """
+        Read a checkpoint from a file.
+
+        :param file_path: Path to the file.
+        :return: The checkpoint saved in the file.
+        """
+        from model_gen.binary import from_binary
+        try:
+            with open(file_path, 'rb') as stream:
+                data = pickle.loads(zlib.decompress(stream.read()))
+        except IOError as e:
+            log.error(f'Cannot read the checkpoint »{file_path}«.')
+            raise e
+        except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+            log.error(f'The file »{file_path}« is not a valid checkpoint.')
+            raise ModelGenArgumentError from e
+        if data.get('version', None) != CHECKPOINT_VERSION:
+            log.error(f'The checkpoint »{file_path}« has the unsupported '
+                      f'version {data.get("version", None)}.')
+            raise ModelGenArgumentError
+        return Checkpoint(
+            graph=from_binary(data['graph']),
+            step_counts=data['step_counts'],
+            max_steps=data['max_steps'],
+            weights=data['weights'],
+            global_vars=data['global_vars'],
+            option_vars=data['option_vars'],
+            random_state=data['random_state'],
+            dead=data['dead'],
+            stage=data.get('stage', 0),
+            first_step=data.get('first_step', 0),
+            run_max_steps=data.get('run_max_steps', None),
+        )
@@ -0,0 +1,147 @@
+"""
+This file contains the command line interface of Model Gen.
+"""
+
+import argparse
+import random
+import sys
+from typing import List
+
+from model_gen.batch import EXPORT_FORMATS, export_graphs
+from model_gen.cache import load_grammar_info_cached
+from model_gen.exports import export_derivation_to_svg
+from model_gen.grammar import LazyGraphMapping
+from model_gen.opts import Opts
+from model_gen.utils import get_logger
+
+log = get_logger('model_gen.' + __name__)
+
+opts = Opts()
+
+
+def export_command(args: argparse.Namespace) -> int:
+    """
+    Export the graphs of a grammar file, one file per graph.
+
+    :param args: The parsed command line arguments.
+    :return: The exit status.
+    """
+    grammar_info = load_grammar_info_cached(args.grammar_file)
+    sources = []
+    if args.graphs in ('host', 'all'):
+        sources.append(('host', grammar_info.host_graphs))
+    if args.graphs in ('result', 'all'):
+        sources.append(('result', grammar_info.result_graphs))
+    source_names = [set(source) for _, source in sources]
+    if args.names:
+        unknown = set(args.names).difference(*source_names)
+        if unknown:
+            log.error(f'The grammar file has no graphs named '
+                      f'{", ".join(sorted(unknown))}.')
+            return 1
+    # A host and a result graph may have the same name, those are
+    # exported as `host_<name>` and `result_<name>`.
+    clashes = set.intersection(*source_names)
+    if len(sources) == 1:
+        clashes = set()
+    if clashes:
+        log.warning(f'There are host and result graphs named '
+                    f'{", ".join(sorted(clashes))}, their names get the '
+                    f'prefix host_ or result_.')
+    graphs = LazyGraphMapping()
+    for prefix, source in sources:
+        for name in source:
+            if args.names and name not in args.names:
+                continue
+            base_key = f'{prefix}_{name}' if name in clashes else name
+            key = base_key
+            index = 1
+            while key in graphs:
+                index += 1
+                key = f'{base_key}_{index}'
+            graphs.set_loader(key, lambda source=source, name=name:
+                              source[name])
+    report = export_graphs(graphs, args.output_dir, args.format,
+                           grammar_info.svg_preamble, args.workers)
+    print(report)
+    return 1 if report.failures else 0
+
+
+def animate_command(args: argparse.Namespace) -> int:
+    """
+    Apply the grammar of a grammar file to one of its host graphs and
+    export the derivation into an animated svg file.
+
+    :param args: The parsed command line arguments.
+    :return: The exit status.
+    """
+    grammar_info = load_grammar_info_cached(args.grammar_file)
+    host_name = args.host
+    if host_name is None:
+        host_name = next(iter(grammar_info.host_graphs), None)
+    if host_name not in grammar_info.host_graphs:
+        log.error(f'The grammar file has no host graph named {host_name}.')
+        return 1
+    host_graph = grammar_info.host_graphs[host_name]
+    options = grammar_info.options or {}
+    max_steps = dict(options.get('max_derivations', None) or {})
+    if args.steps is not None:
+        max_steps['all'] = args.steps
+    max_steps.setdefault('all', opts['max_derivations'])
+    rng = None if args.seed is None else random.Random(args.seed)
+    steps = grammar_info.create_grammar().iter_apply(host_graph, max_steps,
+                                                     rng=rng)
+    export_derivation_to_svg(host_graph, (step.delta for step in steps),
+                             args.output_file,
+                             grammar_info.svg_preamble or {},
+                             args.frame_duration)
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='model_gen', description='Work with graph grammars.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser(
+        'export', help='Export the graphs of a grammar file.'
+    )
+    export.add_argument('grammar_file', help='The grammar file.')
+    export.add_argument('output_dir',
+                        help='The directory to write the files into.')
+    export.add_argument('-f', '--format', choices=list(EXPORT_FORMATS),
+                        default='svg', help='The export format.')
+    export.add_argument('-g', '--graphs', choices=['result', 'host', 'all'],
+                        default='result', help='Which graphs to export.')
+    export.add_argument('-n', '--names', nargs='+',
+                        help='Only export the graphs with these names.')
+    export.add_argument('-w', '--workers', type=int, default=None,
+                        help='The number of worker processes, defaults '
+                             'to the number of processors.')
+    export.set_defaults(function=export_command)
+    animate = commands.add_parser(
+        'animate', help='Export a derivation into an animated svg file.'
+    )
+    animate.add_argument('grammar_file', help='The grammar file.')
+    animate.add_argument('output_file', help='The svg file to write.')
+    animate.add_argument('--host', default=None,
+                         help='The name of the host graph, defaults to the '
+                              'first one.')
+    animate.add_argument('-s', '--steps', type=int, default=None,
+                         help='The maximum number of derivation steps, '
+                              'defaults to the maximum of the grammar.')
+    animate.add_argument('--seed', type=int, default=None,
+                         help='The seed of the random number generator.')
+    animate.add_argument('-d', '--frame-duration', type=float, default=0.5,
+                         help='The time every step is shown in seconds.')
+    animate.set_defaults(function=animate_command)
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = get_parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+This file contains the compilation of grammars, which does all work
+that does not depend on the host graph once, so it can be shared by
+all runs of a grammar.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Union
+
+from model_gen.utils import UniqueBidict, get_logger, compile_expression
+from model_gen.graph import Graph, Vertex, Edge, copy_without_meta_elements
+from model_gen.productions import Production, OptionGeometry
+from model_gen.analysis import DependencyGraph, SearchPlan
+
+log = get_logger('model_gen.' + __name__)
+
+COMPILED_GRAMMAR_CACHE_SIZE = 16
+"""The number of compiled grammars kept by `compile_grammar`."""
+
+_compiled_grammars: 'OrderedDict[str, CompiledGrammar]' = OrderedDict()
+_compiled_grammars_lock = threading.Lock()
+
+
+class CompiledGrammar:
+    """
+    The result of compiling the productions of a grammar.
+
+    It holds the productions stripped of their meta elements, the
+    search plans of the mother graphs, the geometry of the production
+    options and the dependency graph of the productions. None of these
+    change during a run, so a compiled grammar can be shared by any
+    number of runs, including runs in other processes, as it can be
+    pickled.
+
+    The expressions of the grammar are compiled when it is created.
+    The code is not kept by the compiled grammar but shared through
+    the cache of `compile_expression`, which is where the evaluation
+    takes it from. In other processes the expressions are compiled on
+    their first evaluation.
+    """
+
+    def __init__(self, productions: Dict[str, Production],
+                 global_vars: Dict[str, str] = None, key: str = None):
+        """
+        :param productions: The productions of the grammar by name.
+        :param global_vars: The global variables of the grammar.
+        :param key: The fingerprint of the productions and global
+            variables. Calculated if not given.
+        """
+        if global_vars is None:
+            global_vars = {}
+        if key is None:
+            key = grammar_fingerprint(productions, global_vars)
+        self.key: str = key
+        """The fingerprint of the content of the grammar."""
+        self.global_vars: Dict[str, str] = dict(global_vars)
+        self.productions: UniqueBidict = UniqueBidict({
+            name: copy_without_meta_elements(production)
+            for name, production in productions.items()
+        })
+        self.grouped_productions: Dict[int, List[Production]] = {}
+        for production in self.productions.values():
+            self.grouped_productions.setdefault(
+                production.priority, []
+            ).append(production)
+            production.search_plan = SearchPlan(production)
+            for option in production.production_options:
+                if not any(isinstance(element, Vertex)
+                           for element in option.to_add):
+                    continue
+                try:
+                    option.geometry = OptionGeometry(option)
+                except (KeyError, ValueError, TypeError) as e:
+                    # The error is raised again if the option is applied.
+                    log.debug(f'Cannot calculate the geometry of an option '
+                              f'of {self.productions.inverse[production]}: '
+                              f'{e!r}.')
+        self._compile_expressions()
+        self.dependencies: DependencyGraph = DependencyGraph(self.productions)
+
+    def _compile_expressions(self) -> None:
+        """
+        Compile all expressions evaluated during a run up front, which
+        adds them to the cache of `compile_expression`.
+        """
+        expressions = list(self.global_vars.values())
+        for production in self.productions.values():
+            expressions.append(
+                production.conditions.get('.geometric_ordering', None)
+            )
+            for element in production.mother_graph:
+                expressions.extend(
+                    value for key, value in element.attr.items()
+                    if key not in ('x', 'y') and not key.startswith('.')
+                )
+            for option in production.production_options:
+                for element in option.daughter_graph:
+                    expressions.extend(
+                        value for key, value in element.attr.items()
+                        if key not in ('x', 'y')
+                        and (not key.startswith('.') or key == '.new_pos'
+                             or key.startswith(('.svg_', '.svgx_')))
+                    )
+        for expression in expressions:
+            if not isinstance(expression, str):
+                continue
+            try:
+                compile_expression(expression)
+            except SyntaxError as e:
+                # The error is raised again if the expression is evaluated.
+                log.debug(f'Cannot compile the expression »{expression}«: '
+                          f'{e!r}.')
+
+    def __repr__(self):
+        return (f'CompiledGrammar({self.key[:12]}, '
+                f'{len(self.productions)} productions)')
+
+
+def _describe_graph(graph: Graph, index: Dict[int, str],
+                    prefix: str) -> List[Any]:
+    """
+    Describe a graph without referring to the identity of any object.
+
+    The elements are numbered in the order of their type and attributes
+    and their numbers are added to the index, so that other parts of
+    the description can refer to them.
+    """
+    elements = sorted(
+        graph.element_list('vef'),
+        key=lambda element: (type(element).__name__,
+                             _describe_attr(element.attr))
+    )
+    for number, element in enumerate(elements):
+        index[id(element)] = f'{prefix}{number}'
+    description = []
+    for element in elements:
+        if isinstance(element, Edge):
+            neighbours = [index.get(id(element.vertex1), None),
+                          index.get(id(element.vertex2), None)]
+        elif isinstance(element, Vertex):
+            neighbours = []
+        else:
+            neighbours = sorted(str(index.get(id(neighbour), None))
+                                for neighbour in element.neighbours())
+        description.append((type(element).__name__,
+                            _describe_attr(element.attr), neighbours))
+    return description
+
+
+def _describe_attr(attr: Dict[str, Any]) -> str:
+    return repr(sorted((str(key), repr(value)) for key, value in attr.items()))
+
+
+def grammar_fingerprint(productions: Dict[str, Production],
+                        global_vars: Dict[str, str]) -> str:
+    """
+    Calculate a fingerprint of the content of a grammar.
+
+    Grammars with the same productions and global variables have the
+    same fingerprint, even if they consist of different objects.
+
+    :param productions: The productions of the grammar by name.
+    :param global_vars: The global variables of the grammar.
+    :return: The hex digest of a sha256 hash of the grammar.
+    """
+    description = [list(global_vars.items())]
+    for name, production in productions.items():
+        index = {}
+        production_description = [
+            name, production.priority, _describe_attr(production.conditions),
+            _describe_graph(production.mother_graph, index, 'M')
+        ]
+        production_description.append(sorted(
+            (vec_name, index.get(id(vec_info), None))
+            if isinstance(vec_info, Vertex) else
+            (vec_name, tuple(index.get(id(vertex), None)
+                             for vertex in vec_info))
+            for vec_name, vec_info in production.vectors.items()
+        ))
+        for number, option in enumerate(production.production_options):
+            production_description.append([
+                _describe_graph(option.daughter_graph, index, f'D{number}.'),
+                repr(option.weight), _describe_attr(option.conditions),
+                sorted((str(index.get(id(mother_element), None)),
+                        str(index.get(id(daughter_element), None)))
+                       for mother_element, daughter_element
+                       in option.mapping.items()),
+                sorted((str(index.get(id(element), element)),
+                        sorted((name, str(index.get(id(mother_element),
+                                                    None)))
+                               for name, mother_element
+                               in requirements.items()))
+                       for element, requirements
+                       in option.attr_requirements.items()),
+                repr(option.var_calc_instructions),
+            ])
+        description.append(production_description)
+    return hashlib.sha256(repr(description).encode('utf-8')).hexdigest()
+
+
+def compile_grammar(productions: Dict[str, Production],
+                    global_vars: Dict[str, str] = None) -> CompiledGrammar:
+    """
+    Compile the productions of a grammar, reusing the result of an
+    earlier compilation of a grammar with the same content.
+
+    :param productions: The productions of the grammar by name.
+    :param global_vars: The global variables of the grammar.
+    :return: The compiled grammar.
+    """
+    if global_vars is None:
+        global_vars = {}
+    key = grammar_fingerprint(productions, global_vars)
+    with _compiled_grammars_lock:
+        compiled = _compiled_grammars.get(key, None)
+        if compiled is not None:
+            _compiled_grammars.move_to_end(key)
+            log.debug(f'Reusing the compiled grammar {compiled}.')
+            return compiled
+    compiled = CompiledGrammar(productions, global_vars, key)
+    log.info(f'Compiled the grammar {compiled}.')
+    add_compiled_grammar(compiled)
+    return compiled
+
+
+def add_compiled_grammar(compiled: CompiledGrammar) -> None:
+    """
+    Make a compiled grammar available to `compile_grammar`, e.g. one
+    compiled by a different process, so grammars with the same content
+    are not compiled again.
+
+    :param compiled: The compiled grammar.
+    """
+    with _compiled_grammars_lock:
+        _compiled_grammars[compiled.key] = compiled
+        _compiled_grammars.move_to_end(compiled.key)
+        while len(_compiled_grammars) > COMPILED_GRAMMAR_CACHE_SIZE:
+            _compiled_grammars.popitem(last=False)
@@ -0,0 +1,122 @@
+"""
+This file contains the context of a single run of a grammar, which
+holds all state that changes during the run.
+"""
+
+import random
+from timeit import default_timer as timer
+from typing import Dict, Any, Union, TYPE_CHECKING
+
+from model_gen.graph import Graph
+from model_gen.utils import AliasTable, get_logger
+from model_gen.profiling import RunProfiler
+from model_gen.budget import RunBudget, StopReason, estimate_graph_memory
+
+if TYPE_CHECKING:
+    from model_gen.analysis import NegativeMatchCache
+    from model_gen.productions import Production, ProductionOption
+
+log = get_logger('model_gen.' + __name__)
+
+
+class RunContext:
+    """
+    All mutable state of a single run of a grammar.
+
+    Productions and grammars are not changed while they are applied,
+    everything a run needs to remember is kept in its context instead.
+    This allows several runs of the same grammar at the same time, e.g.
+    in different threads.
+
+    Expressions evaluated during the run see the random number
+    generator of the context under the name `random`, so runs do not
+    share the state of the `random` module.
+
+    The context also keeps the resources used by the run so far, which
+    are tested against its budget.
+    """
+
+    def __init__(self, rng: Union[random.Random, Any] = None,
+                 global_vars: Dict[str, Any] = None,
+                 option_vars: Dict['ProductionOption', Dict[str, Any]] = None,
+                 option_tables: Dict['Production', AliasTable] = None,
+                 match_cache: 'NegativeMatchCache' = None,
+                 profiler: RunProfiler = None,
+                 budget: RunBudget = None):
+        """
+        :param rng: The random number generator of the run. Defaults to
+            the `random` module, which is shared by all runs.
+        :param global_vars: The evaluated global variables.
+        :param option_vars: The evaluated per-run variables of the
+            production options, including the global variables.
+        :param option_tables: Alias tables overriding the weights of the
+            options of some productions.
+        :param match_cache: Remembers the productions which can not
+            match the current host graph.
+        :param profiler: If set, the run is recorded in this profiler.
+        :param budget: The resource limits of the run.
+        """
+        if rng is None:
+            rng = random
+        self.rng = rng
+        if global_vars is None:
+            global_vars = {}
+        self.global_vars: Dict[str, Any] = global_vars
+        if option_vars is None:
+            option_vars = {}
+        self.option_vars: Dict['ProductionOption', Dict[str, Any]] = \
+            option_vars
+        if option_tables is None:
+            option_tables = {}
+        self.option_tables: Dict['Production', AliasTable] = option_tables
+        self.match_cache: Union['NegativeMatchCache', None] = match_cache
+        self.profiler: Union[RunProfiler, None] = profiler
+        if budget is None:
+            budget = RunBudget()
+        self.budget: RunBudget = budget
+        self.start_time: float = timer()
+        """The start of the run, for the deadline of the budget."""
+        self.memory: int = 0
+        """The estimated memory used by the result graphs in bytes."""
+
+    def add_graph(self, graph: Graph, retained: bool = True) -> None:
+        """
+        Account for a new result graph of the derivation.
+
+        :param graph: The new result graph.
+        :param retained: Whether the previous result graphs are kept.
+            If not, only the new graph counts towards the budget.
+        """
+        if self.budget.max_memory is None:
+            return
+        if retained:
+            self.memory += estimate_graph_memory(graph)
+        else:
+            self.memory = estimate_graph_memory(graph)
+
+    def check_budget(self, graph: Graph) -> Union[StopReason, None]:
+        """
+        Test if the run has used up any part of its budget.
+
+        :param graph: The current host graph.
+        :return: The reason to stop the run or None if it may continue.
+        """
+        return self.budget.check(graph, timer() - self.start_time,
+                                 self.memory)
+
+    def eval_vars(self) -> Dict[str, Any]:
+        """
+        Return the variables available to match predicates.
+
+        :return: A new dict of variable names and values.
+        """
+        return {**self.global_vars, 'random': self.rng}
+
+    def get_option_vars(self, option: 'ProductionOption') -> Dict[str, Any]:
+        """
+        Return the evaluated per-run variables of a production option.
+
+        :param option: The production option.
+        :return: A dict of variable names and values.
+        """
+        return self.option_vars.get(option, self.global_vars)
@@ -2,14 +2,22 @@
 Contains export functions for graphs.
 """
 
+import io
+import itertools
+import shutil
+import struct
+import tempfile
+import zlib
+import numpy as np
 import svgwrite
 from svgwrite import cm
 from svgwrite.filters import Filter
 from functools import singledispatch
-from typing import List, Tuple, Union, Dict
+from itertools import chain
+from typing import List, Tuple, Union, Dict, Any, Iterable, TextIO
 from model_gen.graph import Graph, GraphElement, Vertex, Edge, \
     get_min_max_points, get_positions
-from model_gen.productions import Production
+from model_gen.productions import Production, GraphDelta
 
 
 mult = 35.43307
@@ -94,7 +102,275 @@ def add_graphelement_to_svg_drawing(element: GraphElement,
         raise ValueError
 
 
-def export_graph_to_svg(graph: Graph, filename: str, preamble: Dict) -> None:
+SVG_NAMESPACES = (
+    ('xmlns', 'http://www.w3.org/2000/svg'),
+    ('xmlns:ev', 'http://www.w3.org/2001/xml-events'),
+    ('xmlns:xlink', 'http://www.w3.org/1999/xlink'),
+)
+
+MERGEABLE_EDGE_ARGS = frozenset({
+    'stroke', 'stroke_width', 'stroke_linecap', 'stroke_linejoin',
+    'stroke_miterlimit', 'stroke_dasharray', 'stroke_dashoffset'
+})
+"""The attributes of plain edges which do not prevent drawing them as
+part of a single path."""
+
+_ATTRIBUTE_ESCAPES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;',
+                      '\t': '&#09;'}
+
+
+class SVGWriter:
+    """
+    Writes graphs into an svg file without building a document tree.
+
+    Every element is written as soon as it is visited, producing the
+    same markup as `add_graphelement_to_svg_drawing` would. Consecutive
+    plain edges, i.e. those without an `.svg_tag`, with the same style
+    are drawn as a single path, so edges keep their order relative to
+    edges of other styles. The path is written before the next element
+    which could be drawn over by its edges, i.e. anything but plain
+    edges and unfilled plain vertices. The only difference to drawing
+    every edge on its own is therefore that these edges are drawn over
+    unfilled plain vertices that follow them.
+
+    Validation of the attributes by svgwrite is optional, as it takes
+    longer than writing the file.
+    """
+
+    def __init__(self, stream: TextIO, view_box: Union[str, None],
+                 size: Union[Tuple[float, float], None], preamble: Dict,
+                 validate: bool = False, merge_edges: bool = True):
+        """
+        :param stream: The stream to write to.
+        :param view_box: The view box of the svg document. If None the
+            start of the document is not written, see `write_header`.
+        :param size: The width and height of the document.
+        :param preamble: The svg preamble of the grammar, which may
+            define filters.
+        :param validate: Whether to validate all attributes.
+        :param merge_edges: Whether to draw plain edges with the same
+            style as a single path.
+        """
+        self.stream: TextIO = stream
+        self.merge_edges: bool = merge_edges
+        # Filters and uncommon tags are still created by svgwrite.
+        self._drawing = svgwrite.Drawing(debug=validate, profile='full')
+        self._validator = self._drawing.validator if validate else None
+        self._filters: Dict[str, Filter] = {}
+        for filter_name, filter_def in preamble.get('filter', {}).items():
+            new_filter = self._drawing.defs.add(
+                self._drawing.filter(id=filter_name)
+            )
+            for effect_name, effect_args in filter_def.items():
+                getattr(new_filter, effect_name)(**effect_args)
+            self._filters[filter_name] = new_filter
+        self._path_style: Union[Tuple, None] = None
+        self._path_segments: List[str] = []
+        if view_box is not None:
+            self.write_header(view_box, size)
+
+    def write_header(self, view_box: str, size: Tuple[float, float]) -> None:
+        """
+        Write the start of the document, including the definitions of
+        the filters.
+
+        :param view_box: The view box of the svg document.
+        :param size: The width and height of the document.
+        """
+        self._write_start('svg', [
+            ('baseProfile', 'full'), ('height', size[1]),
+            ('preserveAspectRatio', 'xMidYMid meet'), ('version', '1.1'),
+            ('viewBox', view_box), ('width', size[0]), *SVG_NAMESPACES
+        ])
+        self.stream.write(self._drawing.defs.tostring())
+
+    def write_graph(self, graph: Graph) -> None:
+        """
+        Write all elements of a graph.
+
+        :param graph: The graph to write.
+        """
+        for element in graph:
+            self.write_element(element)
+
+    def write_element(self, element: GraphElement) -> None:
+        """
+        Write a single graph element.
+
+        :param element: The element to write.
+        """
+        attr = element.attr
+        args = {}
+        for name, value in attr.items():
+            if name.startswith('.svg_') and not name.startswith('.svg_tag'):
+                name = name[5:]
+                if name == 'filter':
+                    args[name] = self._filters[value].get_funciri()
+                else:
+                    args[name] = value
+        if '.svg_tag' in attr:
+            tag = attr['.svg_tag']
+            if tag == 'None' or tag is None:
+                return
+            self._flush_paths()
+            if tag == 'rect':
+                width = float(attr.get('.svg_width', 0.1))
+                height = float(attr.get('.svg_height', 0.1))
+                x = float(attr['x']) - width / 2
+                y = -float(attr['y']) - height / 2
+                self._write_shape('rect', args, [
+                    ('x', x * mult), ('y', y * mult),
+                    ('width', width * mult), ('height', height * mult)
+                ])
+            elif tag == 'path':
+                self._write_shape('path', args, [('d', args.pop('d', None))])
+            elif tag == 'circle':
+                x = float(attr['x'])
+                y = -float(attr['y'])
+                args.setdefault('r', '1cm')
+                args.setdefault('stroke_width', '0.1mm')
+                args.setdefault('stroke', 'black')
+                args.setdefault('fill', 'none')
+                self._write_shape('circle', args, [
+                    ('cx', x * mult), ('cy', y * mult), ('r', args.pop('r'))
+                ])
+            elif tag == 'image':
+                width = float(attr.get('.svg_width', 5))
+                height = float(attr.get('.svg_height', 5))
+                x = float(attr['x']) - width / 2
+                y = -float(attr['y']) - height / 2
+                center = ((x + width / 2), (y + height / 2))
+                if '.svgx_rotate' in attr:
+                    rotation = float(attr['.svgx_rotate'])
+                    args.setdefault(
+                        'transform',
+                        f'translate({center[0]*mult}, {center[1]*mult}) '
+                        f'rotate({-rotation}) '
+                        f'translate({-center[0]*mult}, {-center[1]*mult})'
+                    )
+                insert = args.pop('insert', (x * mult, y * mult))
+                size = args.pop('size', (width * mult, height * mult))
+                self._write_shape('image', args, [
+                    ('xlink:href', args.pop('href', None)),
+                    ('x', insert[0]), ('y', insert[1]),
+                    ('width', size[0]), ('height', size[1])
+                ])
+            else:
+                self.stream.write(getattr(self._drawing, tag)(**args)
+                                  .tostring())
+        elif isinstance(element, Vertex):
+            if attr.get('.helper_node', False):
+                return
+            x = float(attr['x'])
+            y = -float(attr['y'])
+            args.setdefault('r', '0.4cm')
+            args.setdefault('stroke_width', '1mm')
+            args.setdefault('stroke', 'black')
+            args.setdefault('fill', 'none')
+            if args['fill'] != 'none':
+                self._flush_paths()
+            self._write_shape('circle', args, [
+                ('cx', x * mult), ('cy', y * mult), ('r', args.pop('r'))
+            ])
+        elif isinstance(element, Edge):
+            x1 = float(element.vertex1.attr['x']) * mult
+            y1 = -float(element.vertex1.attr['y']) * mult
+            x2 = float(element.vertex2.attr['x']) * mult
+            y2 = -float(element.vertex2.attr['y']) * mult
+            args.setdefault('stroke_width', '1mm')
+            args.setdefault('stroke', 'black')
+            if self.merge_edges and MERGEABLE_EDGE_ARGS.issuperset(args):
+                style = tuple(sorted(args.items()))
+                if style != self._path_style:
+                    self._flush_paths()
+                    self._path_style = style
+                self._path_segments.append(f'M {x1} {y1} L {x2} {y2}')
+            else:
+                self._flush_paths()
+                self._write_shape('line', args, [
+                    ('x1', x1), ('y1', y1), ('x2', x2), ('y2', y2)
+                ])
+        else:
+            raise ValueError
+
+    def close(self) -> None:
+        """
+        Write the end of the document.
+        """
+        self._flush_paths()
+        self.stream.write('</svg>')
+
+    def _flush_paths(self) -> None:
+        """
+        Write the path of the plain edges waiting to be written.
+        """
+        if self._path_segments:
+            self._write_shape('path', dict(self._path_style), [
+                ('d', ' '.join(self._path_segments)), ('fill', 'none')
+            ])
+        self._path_style = None
+        self._path_segments = []
+
+    def _write_shape(self, tag: str, args: Dict[str, Any],
+                     positional: List[Tuple[str, Any]]) -> None:
+        """
+        Write an element with its attributes given as svgwrite keyword
+        arguments and the attributes set by its positional arguments,
+        which take precedence.
+        """
+        attributes = {name.rstrip('_').replace('_', '-'): value
+                      for name, value in args.items()}
+        attributes.update(positional)
+        if self._validator is not None:
+            self._validator.check_all_svg_attribute_values(
+                tag, {name: value for name, value in attributes.items()
+                      if value is not None}
+            )
+        self._write_start(tag, sorted(attributes.items()), True)
+
+    def _write_start(self, tag: str, attributes: Iterable[Tuple[str, Any]],
+                     empty: bool = False) -> None:
+        parts = [f'<{tag}']
+        for name, value in attributes:
+            if value is None:
+                continue
+            if type(value) is float or type(value) is int:
+                parts.append(f' {name}="{value}"')
+                continue
+            value = str(value)
+            if value:
+                parts.append(f' {name}="{_escape_attribute(value)}"')
+        parts.append(' />' if empty else '>')
+        self.stream.write(''.join(parts))
+
+
+def _escape_attribute(value: str) -> str:
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    for character, escaped in _ATTRIBUTE_ESCAPES.items():
+        if character in value:
+            value = value.replace(character, escaped)
+    return value
+
+
+def export_graph_to_svg(graph: Graph, filename: str, preamble: Dict,
+                        validate: bool = False,
+                        merge_edges: bool = True) -> None:
+    """
+    Export a graph into an svg file.
+
+    :param graph: The graph to export.
+    :param filename: Path to the file.
+    :param preamble: The svg preamble of the grammar.
+    :param validate: Whether to validate all attributes, see
+        `SVGWriter`.
+    :param merge_edges: Whether to draw plain edges with the same style
+        as a single path.
+    """
     min_point, max_point = get_min_max_points(get_positions(
         [x for x in graph.vertices if not x.attr.get('.helper_node', False)]
     ))
@@ -102,25 +378,336 @@ def export_graph_to_svg(graph: Graph, filename: str, preamble: Dict) -> None:
     view_box = f'{min_point[0]*mult} {-max_point[1]*mult} ' \
                f'{size[0]*mult} {size[1]*mult}'
     size = size[0] * mult, size[1] * mult
-    drawing = svgwrite.Drawing(filename=filename, debug=True,
-                               profile='full', size=size, viewBox=view_box,
-                               preserveAspectRatio='xMidYMid meet')
-    filters: Dict[str, Filter] = {}
-    for filter_name, filter_def in preamble.get('filter', {}).items():
-        new_filter = drawing.defs.add(drawing.filter(id=filter_name))
-        for effect_name, effect_args in filter_def.items():
-            getattr(new_filter, effect_name)(**effect_args)
-        filters[filter_name] = new_filter
-    for element in graph:
-        add_graphelement_to_svg_drawing(element, drawing, filters)
-    drawing.save()
+    with open(filename, 'w', encoding='utf-8', buffering=1 << 20) as stream:
+        stream.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+        writer = SVGWriter(stream, view_box, size, preamble, validate,
+                           merge_edges)
+        writer.write_graph(graph)
+        writer.close()
+
+
+class SVGAnimationWriter:
+    """
+    Writes a derivation into a single svg file which shows one step
+    after the other using SMIL animations.
+
+    The first frame shows the host graph. Every further frame only
+    contains the elements added or changed by its step, which become
+    visible when the frame starts, and hides the elements removed or
+    changed by it. Edges are redrawn when one of their vertices is
+    moved. The size of the file is thus proportional to the total
+    change of the derivation rather than to the number of steps times
+    the size of the graph.
+
+    Elements are tracked from one step to the next through the
+    `host_to_result` mapping of the steps, so only the current graph is
+    kept. The frames are written into a temporary file until the view
+    box, which contains the graphs of all steps, is known.
+    """
+
+    def __init__(self, host_graph: Graph, preamble: Dict,
+                 frame_duration: float = 0.5):
+        """
+        :param host_graph: The graph the derivation starts with.
+        :param preamble: The svg preamble of the grammar.
+        :param frame_duration: The time every frame is shown in seconds.
+        """
+        self.frame_duration: float = frame_duration
+        self.frames: int = 1
+        """The number of frames written so far."""
+        self._body: TextIO = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self._writer = SVGWriter(self._body, None, None, preamble,
+                                 merge_edges=False)
+        self._ids: Dict[GraphElement, str] = {}
+        self._next_id: int = 0
+        self._min: List[float] = [float('inf'), float('inf')]
+        self._max: List[float] = [float('-inf'), float('-inf')]
+        for element in host_graph:
+            self._write_element(element)
+
+    def add_step(self, delta: GraphDelta) -> None:
+        """
+        Write the frame of a derivation step.
+
+        :param delta: The changes made by the step, e.g. the `delta` of
+            a `DerivationStep` yielded by `Grammar.iter_apply`.
+        """
+        removed = []
+        for element in delta.removed:
+            removed.append(element)
+            if isinstance(element, Vertex):
+                removed.extend(element.edges)
+        to_hide = [self._ids.pop(element) for element in removed
+                   if element in self._ids]
+        host_to_result = delta.host_to_result
+        self._ids = {host_to_result[element]: svg_id
+                     for element, svg_id in self._ids.items()
+                     if element in host_to_result}
+        result_to_host = host_to_result.inverse
+        to_write = {}
+        for element in itertools.chain(delta.added, delta.changed):
+            to_write[element] = None
+            if isinstance(element, Vertex) and \
+                    self._has_moved(element, result_to_host.get(element)):
+                to_write.update(dict.fromkeys(element.edges))
+        to_hide.extend(self._ids.pop(element) for element in to_write
+                       if element in self._ids)
+        begin = f'{self.frames * self.frame_duration}s'
+        stream = self._body
+        stream.write('<g visibility="hidden">')
+        stream.write(f'<set attributeName="visibility" begin="{begin}" '
+                     f'fill="freeze" to="visible" />')
+        for svg_id in to_hide:
+            stream.write(f'<set attributeName="visibility" begin="{begin}" '
+                         f'fill="freeze" to="hidden" '
+                         f'xlink:href="#{svg_id}" />')
+        for element in to_write:
+            self._write_element(element)
+        stream.write('</g>')
+        self.frames += 1
+
+    def write(self, stream: TextIO) -> None:
+        """
+        Write the complete document into a stream.
+
+        :param stream: The stream to write to.
+        """
+        if self._min[0] > self._max[0]:
+            self._min = [0.0, 0.0]
+            self._max = [0.0, 0.0]
+        size = (self._max[0] - self._min[0], self._max[1] - self._min[1])
+        view_box = f'{self._min[0]*mult} {-self._max[1]*mult} ' \
+                   f'{size[0]*mult} {size[1]*mult}'
+        self._writer.stream = stream
+        self._writer.write_header(view_box, (size[0] * mult, size[1] * mult))
+        self._body.seek(0)
+        shutil.copyfileobj(self._body, stream)
+        self._writer.close()
+        self._writer.stream = self._body
+
+    def close(self) -> None:
+        """
+        Remove the temporary file of the frames.
+        """
+        self._body.close()
+
+    @staticmethod
+    def _has_moved(vertex: Vertex, host_vertex: Union[Vertex, None]) -> bool:
+        if host_vertex is None:
+            return True
+        return (vertex.attr.get('x') != host_vertex.attr.get('x')
+                or vertex.attr.get('y') != host_vertex.attr.get('y'))
+
+    def _write_element(self, element: GraphElement) -> None:
+        """
+        Write an element inside a group, which can be hidden in later
+        frames.
+        """
+        attr = element.attr
+        if isinstance(element, Vertex):
+            if not attr.get('.helper_node', False):
+                x = float(attr['x'])
+                y = float(attr['y'])
+                self._min = [min(self._min[0], x), min(self._min[1], y)]
+                self._max = [max(self._max[0], x), max(self._max[1], y)]
+            elif '.svg_tag' not in attr:
+                return
+        if attr.get('.svg_tag', '') in ('None', None):
+            return
+        svg_id = f'e{self._next_id}'
+        self._next_id += 1
+        self._ids[element] = svg_id
+        self._body.write(f'<g id="{svg_id}">')
+        self._writer.write_element(element)
+        self._body.write('</g>')
 
 
+def export_derivation_to_svg(host_graph: Graph, deltas: Iterable[GraphDelta],
+                             filename: str, preamble: Dict,
+                             frame_duration: float = 0.5) -> None:
+    """
+    Export a derivation into an animated svg file, see
+    `SVGAnimationWriter`.
 
+    :param host_graph: The graph the derivation starts with.
+    :param deltas: The changes made by every step of the derivation.
+    :param filename: Path to the file.
+    :param preamble: The svg preamble of the grammar.
+    :param frame_duration: The time every frame is shown in seconds.
+    """
+    writer = SVGAnimationWriter(host_graph, preamble, frame_duration)
+    try:
+        for delta in deltas:
+            writer.add_step(delta)
+        with open(filename, 'w', encoding='utf-8',
+                  buffering=1 << 20) as stream:
+            stream.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+            writer.write(stream)
+    finally:
+        writer.close()
 
 
+RASTER_CHUNK_SIZE = 1 << 16
+"""The number of pixels of lines `rasterize_graph` samples at once."""
 
 
+def rasterize_graph(graph: Graph, width: int = 256, height: int = 256,
+                    margin: int = 4, point_size: int = 3, line_width: int = 1,
+                    color: Tuple[int, int, int] = (0, 0, 0),
+                    background: Tuple[int, int, int] = (255, 255, 255)
+                    ) -> np.ndarray:
+    """
+    Draw the vertices of a graph as points and its edges as lines into
+    an image.
+
+    The graph is fitted into the image the same way `export_graph_to_svg`
+    fits it into the view box of the svg file, i.e. the bounding box of
+    all vertices, except for helper nodes, is scaled uniformly and
+    centred. Helper nodes, as well as elements with the `.svg_tag`
+    `None`, are not drawn. The elements are drawn with NumPy, the lines
+    of edges in chunks of up to `RASTER_CHUNK_SIZE` pixels.
+
+    :param graph: The graph to draw.
+    :param width: The width of the image in pixels.
+    :param height: The height of the image in pixels.
+    :param margin: The number of pixels left empty around the graph.
+    :param point_size: The width and height of the points of vertices in
+        pixels.
+    :param line_width: The width of the lines of edges in pixels.
+    :param color: The RGB colour of the graph.
+    :param background: The RGB colour of the background.
+    :return: The image as an array of shape (height, width, 3).
+    """
+    image = np.empty((height, width, 3), np.uint8)
+    image[...] = background
+    vertices = [x for x in graph.vertices
+                if not x.attr.get('.helper_node', False)]
+    if len(vertices) == 0:
+        return image
+    min_point, max_point = get_min_max_points(get_positions(vertices))
+    size = (max_point[0] - min_point[0], max_point[1] - min_point[1])
+    # the distances between the centres of the outermost pixels
+    inner = (max(width - 1 - 2 * margin, 1), max(height - 1 - 2 * margin, 1))
+    scales = [inner[i] / size[i] for i in range(2) if size[i] > 0]
+    scale = min(scales) if len(scales) > 0 else 1.0
+    offset_x = (width - 1 - size[0] * scale) / 2 - min_point[0] * scale
+    offset_y = (height - 1 - size[1] * scale) / 2 + max_point[1] * scale
+
+    def to_pixels(coordinates: np.ndarray) -> np.ndarray:
+        pixels = np.empty_like(coordinates)
+        pixels[..., 0] = coordinates[..., 0] * scale + offset_x
+        pixels[..., 1] = offset_y - coordinates[..., 1] * scale
+        return pixels
+
+    edges = [edge for edge in graph.edges if _is_drawn(edge)]
+    if len(edges) > 0:
+        ends = to_pixels(np.array(
+            [(float(edge.vertex1.attr['x']), float(edge.vertex1.attr['y']),
+              float(edge.vertex2.attr['x']), float(edge.vertex2.attr['y']))
+             for edge in edges]
+        ).reshape(-1, 2, 2))
+        starts = ends[:, 0]
+        deltas = ends[:, 1] - starts
+        # one sample per pixel along the longer axis of every line
+        counts = np.ceil(np.abs(deltas).max(axis=1)).astype(np.int64) + 1
+        ends_of_lines = np.cumsum(counts)
+        first = 0
+        while first < len(edges):
+            limit = ends_of_lines[first] - counts[first] + RASTER_CHUNK_SIZE
+            last = max(int(np.searchsorted(ends_of_lines, limit, 'right')),
+                       first + 1)
+            _stamp(image, _sample_lines(starts[first:last],
+                                        deltas[first:last],
+                                        counts[first:last]),
+                   line_width, color)
+            first = last
+    vertices = [vertex for vertex in vertices if _is_drawn(vertex)]
+    if len(vertices) > 0:
+        points = to_pixels(np.array(
+            [(float(vertex.attr['x']), float(vertex.attr['y']))
+             for vertex in vertices]
+        ))
+        _stamp(image, points, point_size, color)
+    return image
+
+
+def _sample_lines(starts: np.ndarray, deltas: np.ndarray,
+                  counts: np.ndarray) -> np.ndarray:
+    """
+    Return evenly spaced points along lines, including their ends.
+
+    :param starts: The start points of the lines, of shape (n, 2).
+    :param deltas: The vectors from the start to the end points.
+    :param counts: The number of points of every line.
+    :return: The points of all lines, of shape (sum(counts), 2).
+    """
+    first_samples = np.cumsum(counts) - counts
+    steps = np.arange(counts.sum()) - np.repeat(first_samples, counts)
+    fractions = steps / np.repeat(np.maximum(counts - 1, 1), counts)
+    return np.repeat(starts, counts, axis=0) + \
+        np.repeat(deltas, counts, axis=0) * fractions[:, np.newaxis]
+
+
+def _is_drawn(element: GraphElement) -> bool:
+    tag = element.attr.get('.svg_tag', '')
+    return tag != 'None' and tag is not None
+
+
+def _stamp(image: np.ndarray, pixels: np.ndarray, size: int,
+           color: Tuple[int, int, int]) -> None:
+    """
+    Set squares of pixels, centred at the given positions, to a colour.
+    """
+    height, width = image.shape[:2]
+    centres = np.rint(pixels).astype(np.int64)
+    offsets = np.arange(size) - (size - 1) // 2
+    x = (centres[:, 0, np.newaxis, np.newaxis] +
+         offsets[np.newaxis, np.newaxis, :]).repeat(size, axis=1).ravel()
+    y = (centres[:, 1, np.newaxis, np.newaxis] +
+         offsets[np.newaxis, :, np.newaxis]).repeat(size, axis=2).ravel()
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    image[y[inside], x[inside]] = color
+
+
+def write_png(image: np.ndarray, filename: str) -> None:
+    """
+    Write an image into a png file.
+
+    :param image: An array of shape (height, width, 3) containing RGB or
+        of shape (height, width) containing grey values, of type uint8.
+    :param filename: Path to the file.
+    """
+    height, width = image.shape[:2]
+    colour_type = 2 if image.ndim == 3 else 0
+    rows = np.empty((height, 1 + image[0].size), np.uint8)
+    rows[:, 0] = 0  # no filter
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + \
+            struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    with open(filename, 'wb') as stream:
+        stream.write(b'\x89PNG\r\n\x1a\n')
+        stream.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8,
+                                                colour_type, 0, 0, 0)))
+        stream.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        stream.write(chunk(b'IEND', b''))
+
+
+def export_graph_to_png(graph: Graph, filename: str, width: int = 256,
+                        height: int = 256, **kwargs) -> None:
+    """
+    Export a thumbnail of a graph into a png file.
+
+    :param graph: The graph to export.
+    :param filename: Path to the file.
+    :param width: The width of the image in pixels.
+    :param height: The height of the image in pixels.
+    :param kwargs: Further arguments of `rasterize_graph`.
+    """
+    write_png(rasterize_graph(graph, width, height, **kwargs), filename)
+
 
 class TIKZVertex:
     def __init__(self, name, x, y):
@@ -202,13 +789,10 @@ def normalize_tikz_graph(graph: TIKZGraph) -> None:
 def graph_to_TIKZ(graph: Graph, graph_name='', prefix='', element_names=None,
                   element_id_offset=0) -> TIKZGraph:
     tikz_graph = TIKZGraph(graph_name)
-    v_nr = 0
+    ids = tikz_graph.ids
     current_id = element_id_offset
-    if element_names is None:
-        element_names = {}
     for vertex in graph.vertices:
-        vertex_name = f'{prefix}v{v_nr}'
-        tikz_vertex = TIKZVertex(vertex_name,
+        tikz_vertex = TIKZVertex(f'{prefix}v{current_id - element_id_offset}',
                                  float(vertex.attr['x']),
                                  float(vertex.attr['y']))
         if('.helper_node' in vertex.attr and vertex.attr['.helper_node']):
@@ -216,25 +800,27 @@ def graph_to_TIKZ(graph: Graph, graph_name='', prefix='', element_names=None,
         else:
             tikz_vertex.label = str(current_id)
         tikz_graph.vertices.append(tikz_vertex)
-        tikz_graph.ids[vertex] = current_id
+        ids[vertex] = current_id
         current_id += 1
-        element_names[vertex] = vertex_name
-        v_nr += 1
-    e_nr = 0
-    for edge in graph.edges:
-        edge_name = f'{prefix}e{e_nr}'
-        tikz_edge = TIKZEdge(edge_name,
-                             element_names[edge.vertex1],
-                             element_names[edge.vertex2])
+    # the names of the vertices follow from their ids
+    for e_nr, edge in enumerate(graph.edges):
+        tikz_edge = TIKZEdge(
+            f'{prefix}e{e_nr}',
+            f'{prefix}v{ids[edge.vertex1] - element_id_offset}',
+            f'{prefix}v{ids[edge.vertex2] - element_id_offset}'
+        )
         if '.directed' in edge.attr and edge.attr['.directed']:
             tikz_edge.style = 'directed_edge'
         tikz_edge.label = str(current_id)
         tikz_graph.edges.append(tikz_edge)
-        tikz_graph.ids[edge] = current_id
+        ids[edge] = current_id
         current_id += 1
-        element_names[edge] = edge_name
-        e_nr += 1
-    if v_nr + e_nr == 0:
+    if element_names is not None:
+        for element, tikz_element in zip(chain(graph.vertices, graph.edges),
+                                         chain(tikz_graph.vertices,
+                                               tikz_graph.edges)):
+            element_names[element] = tikz_element.name
+    if current_id == element_id_offset:
         return tikz_graph
     normalize_tikz_graph(tikz_graph)
     return tikz_graph
@@ -250,45 +836,69 @@ def mappings_to_TIKZ(mappings, mother_names, daughter_names):
 
 
 @singledispatch
-def get_TIKZ_string(arg) -> str:
-    return ''
+def write_TIKZ(arg, stream: TextIO) -> None:
+    """
+    Write the TikZ code of a graph or of mappings into a stream.
+
+    The code is written line by line, so the time needed grows linearly
+    with the number of elements and the code is never held in memory
+    as a whole.
+
+    :param arg: A `TIKZGraph` or `TIKZMappings`.
+    :param stream: The stream to write to.
+    """
+    pass
 
 
-@get_TIKZ_string.register(TIKZGraph)
-def _(tikz_graph: TIKZGraph) -> str:
+@write_TIKZ.register(TIKZGraph)
+def _(tikz_graph: TIKZGraph, stream: TextIO) -> None:
     positioning = ''
     if tikz_graph.right_of is not None:
         positioning = f', shift={{($({tikz_graph.right_of}.east |- 0,0) + (3cm, 0)$)}}'
-    result = f'  \\begin{{scope}}[local bounding box={tikz_graph.name}{positioning}]\n'
+    stream.write(f'  \\begin{{scope}}[local bounding box={tikz_graph.name}{positioning}]\n')
+    offset_x, offset_y = tikz_graph.pos_offset
     for vertex in tikz_graph.vertices:
-        x = round(vertex.x + tikz_graph.pos_offset[0], 1)
-        y = round(vertex.y + tikz_graph.pos_offset[1], 1)
-        result = f'{result}    \\node [{vertex.style}] ({vertex.name}) ' \
-                 f'at ({x},{y}) [label={vertex.label}] {{}};\n'
-    result = f'{result}\n'
+        x = round(vertex.x + offset_x, 1)
+        y = round(vertex.y + offset_y, 1)
+        stream.write(f'    \\node [{vertex.style}] ({vertex.name}) '
+                     f'at ({x},{y}) [label={vertex.label}] {{}};\n')
+    stream.write('\n')
     for edge in tikz_graph.edges:
-        result = f'{result}    \\path [{edge.style}] ({edge.vertex1}) ' \
-                 f'edge node ({edge.name}) {{ {edge.label} }}' \
-                 f'({edge.vertex2});\n'
-    result = f'{result}\n    \\node [box,fit='
+        stream.write(f'    \\path [{edge.style}] ({edge.vertex1}) '
+                     f'edge node ({edge.name}) {{ {edge.label} }}'
+                     f'({edge.vertex2});\n')
+    stream.write('\n    \\node [box,fit=')
     for vertex in tikz_graph.vertices:
-        result = f'{result} ({vertex.name}) '
-    result = f'{result}] [label={{[centered]north:{tikz_graph.name}}}] {{}};\n\n'
-    result = f'{result}  \\end{{scope}}\n'
-    return result
+        stream.write(f' ({vertex.name}) ')
+    stream.write(f'] [label={{[centered]north:{tikz_graph.name}}}] {{}};\n\n')
+    stream.write('  \\end{scope}\n')
 
 
-@get_TIKZ_string.register(TIKZMappings)
-def _(tikz_mappings: TIKZMappings) -> str:
-    result = '    \\path [isomorphism] \n'
+@write_TIKZ.register(TIKZMappings)
+def _(tikz_mappings: TIKZMappings, stream: TextIO) -> None:
+    stream.write('    \\path [isomorphism] \n')
     for m_name, d_name in tikz_mappings.mappings:
-        result = f'{result}      ({m_name}) edge ({d_name})\n'
-    result = f'{result}      ;\n\n'
-    return result
+        stream.write(f'      ({m_name}) edge ({d_name})\n')
+    stream.write('      ;\n\n')
 
 
-def get_latex_attr_table_string(tikz_graph: TIKZGraph) -> str:
-    result = ''
+def get_TIKZ_string(arg) -> str:
+    """
+    Return the TikZ code of a graph or of mappings, see `write_TIKZ`.
+    """
+    stream = io.StringIO()
+    write_TIKZ(arg, stream)
+    return stream.getvalue()
+
+
+def write_latex_attr_table(tikz_graph: TIKZGraph, stream: TextIO) -> None:
+    """
+    Write the rows of the LaTeX table of the attributes of a graph into
+    a stream.
+
+    :param tikz_graph: The graph.
+    :param stream: The stream to write to.
+    """
     for element, id_ in tikz_graph.ids.items():
         attrs = dict(element.attr)
         attrs.pop('.generation', None)
@@ -297,27 +907,46 @@ def get_latex_attr_table_string(tikz_graph: TIKZGraph) -> str:
         if len(attrs) == 0:
             continue
         elif len(attrs) > 1:
-            result = f'{result}      \\multirow{{{len(attrs)}}}{{*}}{{\\textbf{{{str(id_)}:}}}} '
+            stream.write(f'      \\multirow{{{len(attrs)}}}{{*}}{{\\textbf{{{str(id_)}:}}}} ')
         else:
-            result = f'{result}      \\textbf{{{str(id_)}:}} '
+            stream.write(f'      \\textbf{{{str(id_)}:}} ')
         for attr_name, attr_value in attrs.items():
-            result = f'{result}      & \\verb|{attr_name}| & \\lstinline[]${str(attr_value)}$ \\\\ \n'
-    return result
+            stream.write(f'      & \\verb|{attr_name}| & \\lstinline[]${str(attr_value)}$ \\\\ \n')
 
 
-def get_latex_vector_table_string(production: Production,
-                                  element_names: Dict[GraphElement, str]
-                                  ) -> str:
-    result = ''
+def get_latex_attr_table_string(tikz_graph: TIKZGraph) -> str:
+    stream = io.StringIO()
+    write_latex_attr_table(tikz_graph, stream)
+    return stream.getvalue()
+
+
+def write_latex_vector_table(production: Production,
+                             element_names: Dict[GraphElement, str],
+                             stream: TextIO) -> None:
+    """
+    Write the rows of the LaTeX table of the vectors of a production
+    into a stream.
+
+    :param production: The production.
+    :param element_names: The names of the elements of the mother graph.
+    :param stream: The stream to write to.
+    """
     for vec_name, elements in production.vectors.items():
         if isinstance(elements, Vertex):
-            result = f'{result}      \\textbf{{{vec_name}}} & ' \
-                     f'Point \\textbf{{{element_names[elements]}}} \\\\ \n'
+            stream.write(f'      \\textbf{{{vec_name}}} & '
+                         f'Point \\textbf{{{element_names[elements]}}} \\\\ \n')
         else:
-            result = f'{result}      \\textbf{{{vec_name}}} & ' \
-                     f'Line from \\textbf{{{element_names[elements[0]]}}} to ' \
-                     f'\\textbf{{{element_names[elements[1]]}}} \\\\ \n'
-    return result
+            stream.write(f'      \\textbf{{{vec_name}}} & '
+                         f'Line from \\textbf{{{element_names[elements[0]]}}} to '
+                         f'\\textbf{{{element_names[elements[1]]}}} \\\\ \n')
+
+
+def get_latex_vector_table_string(production: Production,
+                                  element_names: Dict[GraphElement, str]
+                                  ) -> str:
+    stream = io.StringIO()
+    write_latex_vector_table(production, element_names, stream)
+    return stream.getvalue()
 
 
 def export_production_to_TIKZ(production: Production, filename: str) -> None:
@@ -371,20 +1000,20 @@ def export_production_to_TIKZ(production: Production, filename: str) -> None:
     table_postamble = ('    \\caption{Attribute definitions of the production "".}\n'
                        '    \\label{tab:}\n'
                        '   \\end{table}\n')
-    with open(filename, 'w') as file:
+    with open(filename, 'w', buffering=1 << 20) as file:
         file.write(preamble)
-        file.write(get_TIKZ_string(tikz_mother_graph))
-        file.write(get_TIKZ_string(tikz_daughter_graph))
-        file.write(get_TIKZ_string(tikz_mappings))
+        write_TIKZ(tikz_mother_graph, file)
+        write_TIKZ(tikz_daughter_graph, file)
+        write_TIKZ(tikz_mappings, file)
         file.write(postamble)
         file.write('\n\n\n')
         file.write(table_preamble)
         file.write(attr_table_preamble)
-        file.write(get_latex_attr_table_string(tikz_mother_graph))
-        file.write(get_latex_attr_table_string(tikz_daughter_graph))
+        write_latex_attr_table(tikz_mother_graph, file)
+        write_latex_attr_table(tikz_daughter_graph, file)
         file.write(attr_table_postamble)
         file.write(vector_table_preamble)
-        file.write(get_latex_vector_table_string(production, tikz_mother_graph.ids))
+        write_latex_vector_table(production, tikz_mother_graph.ids, file)
         file.write(vector_table_postamble)
         file.write(table_postamble)
 
@@ -416,11 +1045,11 @@ def export_graph_to_TIKZ(graph: Graph, filename: str) -> None:
                        '    \\caption{Attribute definitions of the production "".}\n'
                        '    \\label{tab:}\n'
                        '   \\end{table}\n')
-    with open(filename, 'w') as file:
+    with open(filename, 'w', buffering=1 << 20) as file:
         file.write(preamble)
-        file.write(get_TIKZ_string(tikz_graph))
+        write_TIKZ(tikz_graph, file)
         file.write(postamble)
         file.write('\n\n\n')
         file.write(table_preamble)
-        file.write(get_latex_attr_table_string(tikz_graph))
+        write_latex_attr_table(tikz_graph, file)
         file.write(table_postamble)
\ No newline at end of file
@@ -1,9 +1,20 @@
 import random
-from typing import List, TypeVar, Tuple
+import itertools
+from collections.abc import MutableMapping
+from typing import (List, TypeVar, Tuple, Union, Sequence, Dict, Any,
+                    Generator, Callable, Iterator)
 from timeit import default_timer as timer
 from model_gen.utils import *
-from model_gen.graph import get_generations, copy_without_meta_elements
+from model_gen.graph import generation_key, copy_without_meta_elements
 from model_gen.productions import *
+from model_gen.profiling import RunProfiler
+from model_gen.budget import RunBudget, StopReason
+from model_gen.checkpoint import Checkpoint
+from model_gen.context import RunContext
+from model_gen.exceptions import ModelGenArgumentError
+from model_gen.analysis import (NegativeMatchCache, DependencyGraph,
+                                GrammarAnalysis)
+from model_gen.compilation import CompiledGrammar, compile_grammar
 
 
 log = get_logger('model_gen.' + __name__)
@@ -11,27 +22,164 @@ log = get_logger('model_gen.' + __name__)
 T = TypeVar('T')
 
 
+class Derivation(list):
+    """
+    The list of result graphs returned by applying a grammar.
+
+    Besides the graphs themselves it carries additional information
+    about the run which created it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profile: Union[Dict[str, Any], None] = None
+        """The report of the run profiler, if profiling was enabled."""
+        self.stop_reason: Union[StopReason, None] = None
+        """The reason the run stopped."""
+        self.start_step: int = 0
+        """The number of derivation steps performed before the first
+        graph of the derivation, e.g. when the run was resumed."""
+
+
+class DerivationStep:
+    """
+    A single step of a derivation as yielded by `Grammar.iter_apply`.
+    """
+
+    def __init__(self, index: int, production_name: str,
+                 production: Production, option: ProductionOption,
+                 match: Mapping, graph: Graph, delta: GraphDelta,
+                 stage: int = 0):
+        self.index: int = index
+        """The number of the step, counted from the start of the run."""
+        self.stage: int = stage
+        """The index of the stage the production belongs to, see
+        `Grammar.stages`."""
+        self.production_name: str = production_name
+        self.production: Production = production
+        self.option: ProductionOption = option
+        self.match: Mapping = match
+        """Maps the mother graph to the elements of the host graph."""
+        self.graph: Graph = graph
+        """The result graph of the step."""
+        self.delta: GraphDelta = delta
+        """The changes made to the host graph to arrive at the result."""
+
+
 class Grammar:
     """
     A grammar is a collection of productions that can be applied on a graph.
+
+    A grammar may consist of subgrammars, which are applied as stages
+    of a pipeline after the productions of the grammar itself: every
+    stage is applied to the last graph of the previous one until none
+    of its productions matches anymore or it reaches its maximum number
+    of derivation steps. Each stage only matches its own productions.
     """
     def __init__(self, productions: Dict[str, Production]=None,
                  global_vars: Dict[str, str]=None,
-                 subgrammars: Iterable['Grammar']=None):
-        self.productions: UniqueBidict[str, Production] = UniqueBidict({
-            name: copy_without_meta_elements(production)
-            for name, production in productions.items()
-        })
-        self.grouped_productions = {}
-        for production in self.productions.values():
-            self.grouped_productions.setdefault(
-                production.priority, []
-            ).append(production)
-        self.global_vars: Dict[str, str] = global_vars
-        self.subgrammars: Iterable['Grammar'] = subgrammars
-
-    def apply(self, target_graph: Graph, max_steps: Dict = None) \
-            -> List[Graph]:
+                 subgrammars: Iterable['Grammar']=None,
+                 compiled: CompiledGrammar=None,
+                 name: str=None,
+                 max_steps: Dict=None):
+        """
+        :param productions: The productions of the grammar by name.
+        :param global_vars: The global variables of the grammar.
+        :param subgrammars: The grammars applied after this one.
+        :param compiled: A compiled grammar, e.g. one returned by
+            `compile` in a different process. If given, the
+            productions and global variables are taken from it.
+        :param name: The name of the grammar, used in log messages.
+        :param max_steps: The maximum number of derivation steps of the
+            grammar when it is applied as a stage, which only tightens
+            the maximum of the run. Also the maximum of the run if none
+            is passed to `apply`.
+        """
+        if compiled is None:
+            if productions is None:
+                productions = {}
+            compiled = compile_grammar(productions, global_vars)
+        self._compiled: CompiledGrammar = compiled
+        self.global_vars: Dict[str, str] = compiled.global_vars
+        if subgrammars is None:
+            subgrammars = []
+        self.subgrammars: List['Grammar'] = list(subgrammars)
+        self.name: Union[str, None] = name
+        self.max_steps: Union[Dict, None] = max_steps
+
+    def __repr__(self):
+        if self.name is not None:
+            return f'Grammar({self.name})'
+        return f'Grammar({id(self):#x})'
+
+    def compile(self) -> CompiledGrammar:
+        """
+        Return the compiled grammar, which holds everything about the
+        productions that does not change during a run.
+
+        Grammars with the same content share the same compiled grammar.
+        It can be pickled to create the same grammar in another process
+        without compiling it again.
+
+        :return: The compiled grammar.
+        """
+        return self._compiled
+
+    @property
+    def productions(self) -> UniqueBidict:
+        """
+        The productions of the grammar by name, without meta elements.
+        """
+        return self._compiled.productions
+
+    @property
+    def grouped_productions(self) -> Dict[int, List[Production]]:
+        """
+        The productions of the grammar grouped by priority.
+        """
+        return self._compiled.grouped_productions
+
+    @property
+    def dependencies(self) -> DependencyGraph:
+        """
+        The static producer/consumer graph of the productions.
+        """
+        return self._compiled.dependencies
+
+    def stages(self) -> List['Grammar']:
+        """
+        Return the grammars applied one after the other by `apply`.
+
+        These are this grammar, unless it has no productions of its
+        own, followed by the stages of all subgrammars.
+
+        :return: A list of grammars in the order they are applied.
+        """
+        result = [self] if len(self.productions) > 0 else []
+        for subgrammar in self.subgrammars:
+            result.extend(subgrammar.stages())
+        return result
+
+    def analyse(self, host_graph: Graph = None) -> GrammarAnalysis:
+        """
+        Statically analyse the productions of the grammar.
+
+        :param host_graph: If given, productions which can never be
+            applied during a derivation starting at this graph are
+            reported as unreachable.
+        :return: The analysis of the grammar.
+        """
+        return GrammarAnalysis(self.dependencies, host_graph)
+
+    def apply(self, target_graph: Graph, max_steps: Dict = None,
+              weights: Dict[str, Union[Sequence[float],
+                                       Dict[int, float]]] = None,
+              profile: Union[bool, str] = False,
+              budget: RunBudget = None,
+              checkpoint: str = None,
+              checkpoint_interval: float = 5.0,
+              rng: random.Random = None) \
+            -> Derivation:
         """
         Apply the productions of the grammar to a target graph and
         return a derivation sequence of the result graph.
@@ -40,53 +188,450 @@ class Grammar:
                              be applied.
         :param max_steps: The maximum number of productions to be
                           applied. If 0 then there is no limit,
-                          execution will only stop if
+                          execution will only stop if no production
+                          matches anymore. Defaults to the maximum of
+                          the grammar. The maximum of 'all' steps
+                          counts the steps of all stages, a stage
+                          with a maximum of its own stops earlier if
+                          that is reached first. The maxima of
+                          priorities apply to every stage.
+        :param weights: Weights overriding those of the production
+            options for this run only, keyed by the name of the
+            production. See `Production.build_option_table` for the
+            accepted values.
+        :param profile: If True, collect a profile of the run and save
+            it in the `profile` attribute of the returned derivation.
+            If a file path is passed the profile is additionally
+            written to that file as json.
+        :param budget: Limits on the resources the run may use. If one
+            of them is exceeded the run stops gracefully and the
+            partial derivation is returned.
+        :param checkpoint: If set, the state of the run is written to
+            this file periodically and when the run ends. Pass the file
+            to `resume` to continue the run.
+        :param checkpoint_interval: The minimal time between two
+            checkpoints in seconds.
+        :param rng: The random number generator of the run, which is
+            available as `random` to all expressions of the grammar.
+            Defaults to a new generator seeded from the `random`
+            module.
         :return: The sequence of graphs that results from applying
-                 the grammar to the target graph.
+                 the grammar to the target graph. Its `stop_reason`
+                 tells why the run stopped.
+        """
+        if rng is None:
+            rng = random.Random(random.getrandbits(64))
+        max_steps = self._run_max_steps(max_steps)
+        state = self._start_stage(0, target_graph, max_steps, weights, rng)
+        return self._collect(state, rng, max_steps, profile, budget,
+                             checkpoint, checkpoint_interval)
+
+    def iter_apply(self, target_graph: Graph, max_steps: Dict = None,
+                   weights: Dict[str, Union[Sequence[float],
+                                            Dict[int, float]]] = None,
+                   profiler: RunProfiler = None,
+                   budget: RunBudget = None,
+                   checkpoint: str = None,
+                   checkpoint_interval: float = 5.0,
+                   rng: random.Random = None) \
+            -> Generator['DerivationStep', None, StopReason]:
+        """
+        Apply the productions of the grammar to a target graph and
+        yield every derivation step as soon as it is performed.
+
+        Unlike `apply` no result graphs are kept, so consumers can
+        process them one at a time and stop the run early by closing
+        the generator. The memory budget therefore only accounts for
+        the current graph. The value of the generator, e.g. the result
+        of `yield from`, is the reason the run stopped.
+
+        :param target_graph: The graph to which the productions will
+            be applied.
+        :param max_steps: See `apply`.
+        :param weights: See `apply`.
+        :param profiler: If set, the run is recorded in this profiler.
+        :param budget: See `apply`.
+        :param checkpoint: See `apply`.
+        :param checkpoint_interval: See `apply`.
+        :param rng: See `apply`.
+        :return: A generator of the derivation steps.
+        """
+        if rng is None:
+            rng = random.Random(random.getrandbits(64))
+        max_steps = self._run_max_steps(max_steps)
+        state = self._start_stage(0, target_graph, max_steps, weights, rng)
+        return self._iter_stages(state, rng, max_steps, profiler, budget,
+                                 checkpoint, checkpoint_interval,
+                                 retain_graphs=False)
+
+    def resume(self, checkpoint: str, max_steps: Dict = None,
+               profile: Union[bool, str] = False,
+               budget: RunBudget = None,
+               checkpoint_interval: float = 5.0) -> Derivation:
+        """
+        Continue a run of the grammar from a checkpoint written by
+        `apply`.
+
+        The run performs the same derivation steps it would have
+        performed had it not been interrupted. New checkpoints are
+        written to the same file.
+
+        :param checkpoint: Path to the checkpoint file.
+        :param max_steps: If set, overrides the maximum number of
+            derivation steps of the original run. Steps performed
+            before the checkpoint count towards the maximum.
+        :param profile: See `apply`.
+        :param budget: See `apply`.
+        :param checkpoint_interval: See `apply`.
+        :return: The sequence of graphs resulting from the derivation
+            steps performed after the checkpoint.
+        """
+        state = Checkpoint.load(checkpoint)
+        stages = self.stages()
+        if (state.stage >= len(stages)
+                or set(state.option_vars)
+                != set(stages[state.stage].productions)):
+            log.error(f'The checkpoint »{checkpoint}« was written by a '
+                      f'grammar with the productions '
+                      f'{sorted(state.option_vars)} in stage '
+                      f'{state.stage}.')
+            raise ModelGenArgumentError
+        if max_steps is not None:
+            state.run_max_steps = max_steps
+            state.max_steps = self._stage_max_steps(
+                max_steps, stages[state.stage].max_steps, state.first_step
+            )
+        rng = random.Random()
+        rng.setstate(state.random_state)
+        log.info(f'Resuming the run from »{checkpoint}« at step '
+                 f'{state.first_step + state.step_counts["all"]}.')
+        return self._collect(state, rng, state.run_max_steps, profile,
+                             budget, checkpoint, checkpoint_interval)
+
+    def _run_max_steps(self, max_steps: Union[Dict, None]) -> Dict:
+        """
+        Return the maximum number of derivation steps of a run.
         """
         if max_steps is None:
-            max_steps = {all: 0}
-        start_time = timer()
+            max_steps = self.max_steps
+        if max_steps is None:
+            max_steps = {'all': 0}
+        return max_steps
+
+    @staticmethod
+    def _stage_max_steps(run_max_steps: Dict,
+                         stage_max_steps: Union[Dict, None],
+                         first_step: int) -> Dict:
+        """
+        Return the maximum number of derivation steps of a stage.
+
+        The maximum of 'all' steps of the result counts the steps of
+        the whole run, the other maxima the steps of the stage.
+
+        :param run_max_steps: The maximum number of derivation steps of
+            the run.
+        :param stage_max_steps: The maximum of the stage itself, which
+            can only tighten that of the run.
+        :param first_step: The number of derivation steps performed by
+            the previous stages.
+        :return: The maximum number of derivation steps of the stage.
+        """
+        max_steps = dict(run_max_steps)
+        if stage_max_steps is None:
+            return max_steps
+        for key, value in stage_max_steps.items():
+            if key == 'all':
+                if value == 0:
+                    continue
+                value += first_step
+                if max_steps.get('all', 0) != 0:
+                    value = min(value, max_steps['all'])
+            elif key in max_steps:
+                value = min(value, max_steps[key])
+            max_steps[key] = value
+        return max_steps
+
+    def _start_stage(self, index: int, target_graph: Graph,
+                     max_steps: Dict, weights: Union[Dict, None],
+                     rng: random.Random, first_step: int = 0
+                     ) -> Union[Checkpoint, None]:
+        """
+        Start a stage of a run and return its initial state.
+
+        :param index: The index of the stage in `stages`.
+        :param max_steps: The maximum number of derivation steps of the
+            run, see `apply`.
+        :param first_step: The number of derivation steps performed by
+            the previous stages.
+        :return: The state of the stage or None if there is no such
+            stage.
+        """
+        stages = self.stages()
+        if index >= len(stages):
+            return None
+        stage = stages[index]
+        state = stage._start_run(
+            target_graph,
+            self._stage_max_steps(max_steps, stage.max_steps, first_step),
+            weights, rng
+        )
+        state.run_max_steps = max_steps
+        state.stage = index
+        state.first_step = first_step
+        return state
+
+    def _start_run(self, target_graph: Graph, max_steps: Union[Dict, None],
+                   weights: Union[Dict, None],
+                   rng: random.Random) -> Checkpoint:
+        """
+        Evaluate the variables of a new run and return its initial
+        state.
+        """
+        if max_steps is None:
+            max_steps = {'all': 0}
+        if weights is None:
+            weights = {}
         log.info(f'Applying the grammar {self} to the target '
                  f'{id(target_graph)} for max {max_steps} steps.')
-        result_graphs = []
         global_var_results = {
-            name: eval(instruction) for name, instruction
-            in self.global_vars.items()
+            name: eval(compile_expression(instruction), None,
+                       {'random': rng}) for name,
+            instruction in self.global_vars.items()
         }
         log.info(f'Global variables are: {global_var_results}.')
-        for prod in self.productions.values():
-            prod.global_vars = global_var_results
-            for prod_opt in prod.production_options:
-                prod_opt.vars = {**evaluate_per_run_vars(prod_opt, global_var_results),
-                                 **global_var_results}
-        new_host_graph = target_graph
+        option_vars = {
+            name: [{**evaluate_per_run_vars(prod_opt,
+                                            {**global_var_results,
+                                             'random': rng}),
+                    **global_var_results}
+                   for prod_opt in prod.production_options]
+            for name, prod in self.productions.items()
+        }
         step_counts = {priority: 0 for priority
                        in self.grouped_productions.keys()}
         step_counts['all'] = 0
+        return Checkpoint(target_graph, step_counts, max_steps, weights,
+                          global_var_results, option_vars)
+
+    def _collect(self, state: Union[Checkpoint, None], rng: random.Random,
+                 max_steps: Dict, profile: Union[bool, str],
+                 budget: Union[RunBudget, None], checkpoint: Union[str, None],
+                 checkpoint_interval: float) -> Derivation:
+        """
+        Perform all derivation steps starting at the state of a run and
+        return the derivation.
+
+        See `apply` for a description of the arguments.
+        """
+        start_time = timer()
+        result_graphs = Derivation()
+        if state is not None:
+            result_graphs.start_step = (state.first_step
+                                        + state.step_counts['all'])
+        profiler = RunProfiler() if profile else None
+        steps = self._iter_stages(state, rng, max_steps, profiler, budget,
+                                  checkpoint, checkpoint_interval,
+                                  retain_graphs=True)
         while True:
-            log.info(f'Runnig derivation {step_counts["all"]}.')
-            production, matches = self._find_matching_production(
-                new_host_graph, step_counts, max_steps
-            )
-            if production is None:
-                break
-            production_option = production.select_option()
-            matching_mapping = self._select_match(matches, production_option)
-            new_host_graph = production.apply(new_host_graph, matching_mapping)
-            result_graphs.append(new_host_graph)
-            log.info(f'Resulted in a graph with {len(new_host_graph)} elements.')
-            step_counts['all'] += 1
-            step_counts[production.priority] += 1
-            if max_steps['all'] != 0 and max_steps['all'] <= step_counts['all']:
+            try:
+                step = next(steps)
+            except StopIteration as stop:
+                result_graphs.stop_reason = stop.value
                 break
+            result_graphs.append(step.graph)
         end_time = timer()
         dt = end_time - start_time
-        log.info(f'Calculated {len(result_graphs)} derivations in {dt} seconds.')
+        log.info(f'Calculated {len(result_graphs)} derivations in {dt} seconds, '
+                 f'stopped because of {result_graphs.stop_reason.value}.')
+        if profiler is not None:
+            result_graphs.profile = profiler.report()
+            if isinstance(profile, str):
+                profiler.save(profile)
         return result_graphs
 
+    def _iter_stages(self, state: Union[Checkpoint, None],
+                     rng: random.Random, max_steps: Dict,
+                     profiler: Union[RunProfiler, None],
+                     budget: Union[RunBudget, None],
+                     checkpoint: Union[str, None],
+                     checkpoint_interval: float, retain_graphs: bool) \
+            -> Generator['DerivationStep', None, StopReason]:
+        """
+        Perform the derivation steps of all remaining stages of a run,
+        starting at the state of the current stage, and yield them.
+
+        Every stage is applied to the last graph of the previous stage.
+        All stages share the context of the run, so the budget applies
+        to the run as a whole, once it is used up no further stages are
+        started.
+
+        :param max_steps: The maximum number of derivation steps of the
+            run, see `apply`.
+        See `_iter_run` and `RunContext` for a description of the other
+        arguments.
+        """
+        context = RunContext(rng, profiler=profiler, budget=budget)
+        stop_reason = StopReason.NO_MATCH
+        stages = self.stages()
+        while state is not None:
+            stage = stages[state.stage]
+            steps = stage._iter_run(state, context, checkpoint,
+                                    checkpoint_interval, retain_graphs)
+            graph = state.graph
+            try:
+                while True:
+                    try:
+                        step = next(steps)
+                    except StopIteration as stop:
+                        stop_reason = stop.value
+                        break
+                    graph = step.graph
+                    yield step
+            finally:
+                steps.close()
+            if stop_reason not in (StopReason.NO_MATCH, StopReason.MAX_STEPS):
+                break
+            log.info(f'Finished stage {state.stage} {stage} because of '
+                     f'{stop_reason.value}.')
+            performed_steps = state.first_step + state.step_counts['all']
+            if (max_steps.get('all', 0) != 0
+                    and max_steps['all'] <= performed_steps):
+                stop_reason = StopReason.MAX_STEPS
+                break
+            state = self._start_stage(
+                state.stage + 1, graph, max_steps, state.weights, rng,
+                performed_steps
+            )
+        return stop_reason
+
+    def _iter_run(self, state: Checkpoint, context: RunContext,
+                  checkpoint: Union[str, None], checkpoint_interval: float,
+                  retain_graphs: bool) \
+            -> Generator['DerivationStep', None, StopReason]:
+        """
+        Perform derivation steps of this grammar alone starting at the
+        state of a run and yield them.
+
+        :param context: The context of the run, which gets the variables,
+            weights and match cache of this stage.
+        :param retain_graphs: Whether the consumer keeps all result
+            graphs, which is taken into account by the memory budget.
+        See `iter_apply` for a description of the other arguments.
+        """
+        rng = context.rng
+        profiler = context.profiler
+        max_steps = state.max_steps
+        step_counts = state.step_counts
+        option_vars = {}
+        for name, prod in self.productions.items():
+            for prod_opt, variables in zip(prod.production_options,
+                                           state.option_vars[name]):
+                option_vars[prod_opt] = variables
+        # The weights may be meant for productions of other stages.
+        option_tables = {
+            self.productions[name]:
+                self.productions[name].build_option_table(prod_weights)
+            for name, prod_weights in state.weights.items()
+            if name in self.productions
+        }
+        new_host_graph = state.graph
+        analysis = self.analyse(new_host_graph)
+        log.info(f'Production dependency order is {analysis.order}.')
+        match_cache = NegativeMatchCache(self.productions.values(),
+                                         analysis.dependencies)
+        for name in sorted(analysis.unreachable):
+            log.warning(f'Production {name} can never be applied to the '
+                        f'target {id(new_host_graph)}.')
+            match_cache.exclude(self.productions[name])
+        for name in state.dead:
+            match_cache.mark_failed(self.productions[name])
+        if analysis.terminal_values:
+            log.info(f'Terminal attribute values are '
+                     f'{sorted(analysis.terminal_values, key=repr)}.')
+        context.global_vars = state.global_vars
+        context.option_vars = option_vars
+        context.option_tables = option_tables
+        context.match_cache = match_cache
+        last_checkpoint = timer()
+        try:
+            while True:
+                # The maximum of all steps counts those of earlier stages.
+                if (max_steps.get('all', 0) != 0
+                        and max_steps['all']
+                        <= state.first_step + step_counts['all']):
+                    return StopReason.MAX_STEPS
+                stop_reason = context.check_budget(new_host_graph)
+                if stop_reason is not None:
+                    log.warning(f'Stopping the run after '
+                                f'{step_counts["all"]} steps, reached the '
+                                f'budget {stop_reason.value}.')
+                    return stop_reason
+                log.info(f'Runnig derivation {step_counts["all"]}.')
+                step_start = timer()
+                production, matches = self._find_matching_production(
+                    new_host_graph, step_counts, max_steps, context
+                )
+                if production is None:
+                    return StopReason.NO_MATCH
+                name = self.productions.inverse[production]
+                production_option = production.select_option(
+                    option_tables.get(production), rng
+                )
+                matching_mapping = self._select_match(
+                    matches, production_option, new_host_graph, rng
+                )
+                if profiler is not None:
+                    apply_start = timer()
+                new_host_graph, delta = production.apply_with_delta(
+                    new_host_graph, matching_mapping, production_option,
+                    context
+                )
+                match_cache.update(
+                    itertools.chain(delta.added, delta.changed), name
+                )
+                context.add_graph(new_host_graph, retain_graphs)
+                log.info(f'Resulted in a graph with {len(new_host_graph)} '
+                         f'elements.')
+                if profiler is not None:
+                    step_end = timer()
+                    profiler.record_application(
+                        name, step_end - apply_start, len(delta.added),
+                        len(delta.removed)
+                    )
+                    profiler.record_step(step_counts['all'], name,
+                                         len(new_host_graph),
+                                         step_end - step_start)
+                step = DerivationStep(state.first_step + step_counts['all'],
+                                      name, production, production_option,
+                                      matching_mapping, new_host_graph, delta,
+                                      state.stage)
+                step_counts['all'] += 1
+                step_counts[production.priority] += 1
+                if (checkpoint is not None
+                        and timer() - last_checkpoint >= checkpoint_interval):
+                    self._save_checkpoint(checkpoint, state, new_host_graph,
+                                          context)
+                    last_checkpoint = timer()
+                yield step
+        finally:
+            if checkpoint is not None:
+                self._save_checkpoint(checkpoint, state, new_host_graph,
+                                      context)
+
+    def _save_checkpoint(self, file_path: str, state: Checkpoint,
+                         host_graph: Graph, context: RunContext) -> None:
+        """
+        Update the state of the run and write it to the checkpoint file.
+        """
+        state.graph = host_graph
+        state.random_state = context.rng.getstate()
+        state.dead = sorted(self.productions.inverse[production]
+                            for production in context.match_cache.dead)
+        state.save(file_path)
+
     def _find_matching_production(self, target_graph: Graph,
-                                  step_counts: Dict, max_steps: Dict
+                                  step_counts: Dict, max_steps: Dict,
+                                  context: RunContext = None
                                   ) -> Tuple[Production, List[Mapping]]:
         """
         Find a single production that has at least one match against the target
@@ -101,22 +646,50 @@ class Grammar:
             derivation steps, categorised by priority.
         :param max_steps: A dict containing the maximum number derivation steps
             to perform, categorised by priority.
+        :param context: The context of the run. Its profiler records
+            every attempt to match a production, its match cache is
+            used to skip productions known to not match the target
+            graph and its budget limits the number of matches.
         :return: One matching production along with all the possible matching
             subgraphs of the target graph. If no match is found returns
             (None,[]).
         """
+        if context is None:
+            context = RunContext()
+        profiler = context.profiler
+        match_cache = context.match_cache
         result = (None, [])
         for priority in sorted(self.grouped_productions.keys()):
             if (priority in max_steps
                     and step_counts[priority] >= max_steps[priority]):
                 continue
-            for production in randomly(self.grouped_productions[priority]):
+            for production in randomly(self.grouped_productions[priority],
+                                       context.rng):
+                if match_cache is not None and match_cache.is_dead(production):
+                    log.debug(f'Skipping production '
+                              f'{self.productions.inverse[production]}, it '
+                              f'can not match since its last attempt.')
+                    if profiler is not None:
+                        profiler.record_skip(
+                            self.productions.inverse[production]
+                        )
+                    continue
                 log.info(f'Testing production '
                          f'{self.productions.inverse[production]} for match.')
-                matching_mappings = production.match(target_graph)
+                if profiler is not None:
+                    match_start = timer()
+                matching_mappings = production.match(
+                    target_graph, context.budget.max_matches, context
+                )
+                if profiler is not None:
+                    profiler.record_match(self.productions.inverse[production],
+                                          timer() - match_start,
+                                          len(matching_mappings))
                 if len(matching_mappings) == 0:
                     log.info(f'No match found for production '
                              f'{self.productions.inverse[production]}.')
+                    if match_cache is not None:
+                        match_cache.mark_failed(production)
                     continue
                 else:
                     result = (production, matching_mappings)
@@ -127,35 +700,68 @@ class Grammar:
 
     @staticmethod
     def _select_match(matches: List[Mapping],
-                      production_option: ProductionOption) -> Mapping:
+                      production_option: ProductionOption,
+                      host_graph: Graph = None, rng=random) -> Mapping:
         """
         Select a singe match out of a list of possible matches.
 
         :param matches: The list of matches from which to select one.
         :param production_option: The production option which is being matched.
+        :param host_graph: If given, the matches to select from are
+            sorted by the position of the matched elements in the host
+            graph, so that the selection does not depend on the order in
+            which they were found.
+        :param rng: The random number generator to draw from.
         :return: The selected match
         """
         valid_matches = matches
         if ('generation' in production_option.conditions
                 and production_option.conditions['generation'] == 'oldest'):
-            best_generations = None
+            best_key = None
             best_mappings = []
-            for mapping in matches:
-                generations = get_generations(mapping.values())
-                if best_generations is None:
-                    best_generations = generations
+            for mapping in valid_matches:
+                key = generation_key(mapping.values())
+                if best_key is None or key > best_key:
+                    best_key = key
                     best_mappings = [mapping]
-                    continue
-                if generations > best_generations:
-                    best_generations = generations
-                    best_mappings = [mapping]
-                elif generations == best_generations:
+                elif key == best_key:
                     best_mappings.append(mapping)
             valid_matches = best_mappings
-            log.debug(f'Oldest generations were {repr(best_generations)}.')
-        i = random.randint(0, len(valid_matches)-1)
+            log.debug(f'Oldest generations were {best_key!r}.')
+        if host_graph is not None and len(valid_matches) > 1:
+            valid_matches = Grammar._sort_matches(
+                valid_matches, production_option.mother_graph, host_graph
+            )
+        i = rng.randint(0, len(valid_matches)-1)
         return valid_matches[i]
 
+    @staticmethod
+    def _sort_matches(matches: List[Mapping], mother_graph: Graph,
+                      host_graph: Graph) -> List[Mapping]:
+        """
+        Sort matches by the position of the matched elements in the host
+        graph. Only the positions of the matched elements are looked up,
+        the host graph is searched until all of them were found.
+
+        :param matches: The matches to sort.
+        :param mother_graph: The mother graph of the matches.
+        :param host_graph: The graph the matches were found in.
+        :return: The sorted matches.
+        """
+        matched = {id(element) for mapping in matches
+                   for element in mapping.values()}
+        position = {}
+        for index, element in enumerate(itertools.chain(
+                host_graph.vertices, host_graph.edges, host_graph.faces)):
+            if id(element) in matched:
+                position[id(element)] = index
+                if len(position) == len(matched):
+                    break
+        mother_elements = mother_graph.element_list('vef')
+        return sorted(matches, key=lambda mapping: [
+            position[id(mapping[element])] for element in mother_elements
+        ])
+
     def to_yaml(self) -> Iterable:
         """
         Serialize the grammar into a list or dict which can be
@@ -164,32 +770,161 @@ class Grammar:
         :return: The grammar as a list or dict.
         """
         data = {
-            'productions': [x.to_yaml() for x in self.productions.values()],
+            'id': id(self),
+            'name': self.name,
+            'productions': {name: production.to_yaml() for name, production
+                            in self.productions.items()},
+            'global_vars': self.global_vars,
+            'max_steps': self.max_steps,
             'subgrammars': [x.to_yaml() for x in self.subgrammars],
-            'id': id(self)
         }
         return data
 
+    # noinspection PyDefaultArgument
     @staticmethod
-    def from_yaml(data, mapping=None):
+    def from_yaml(data, mapping=None) -> 'Grammar':
+        """
+        Deserialize a grammar from a list or dict which was saved in a
+        yaml file.
+
+        :param data: The list or dict containing the grammar data.
+        :param mapping: A dictionary which will be used to recreate
+            references between objects.
+        :return: The grammar.
+        """
         if mapping is None:
             mapping = {}
         if data['id'] in mapping:
             return mapping[data['id']]
-        result = Grammar()
-        result.productions = Production.from_yaml(data, mapping)
-        result.subgrammars = Grammar.from_yaml(data, mapping)
+        productions = {name: Production.from_yaml(production_data, mapping)
+                       for name, production_data
+                       in data.get('productions', {}).items()}
+        subgrammars = [Grammar.from_yaml(subgrammar_data, mapping)
+                       for subgrammar_data in data.get('subgrammars', [])]
+        result = Grammar(productions, data.get('global_vars', {}),
+                         subgrammars, name=data.get('name', None),
+                         max_steps=data.get('max_steps', None))
         mapping[data['id']] = result
         return result
 
 
+class LazyGraphMapping(MutableMapping):
+    """
+    A dict of graphs by name, which creates every graph only when it is
+    accessed for the first time.
+
+    Graphs are added either directly or as a loader, a function without
+    arguments returning the graph, e.g. a graph still to be read from
+    its serialised data. Iterating over the names or checking the
+    length does not create any graphs.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Graph]] = None):
+        """
+        :param loaders: The loaders of the graphs by name.
+        """
+        self._graphs: Dict[str, Union[Graph, None]] = {}
+        self._loaders: Dict[str, Callable[[], Graph]] = {}
+        for name, loader in (loaders or {}).items():
+            self.set_loader(name, loader)
+
+    def set_loader(self, name: str, loader: Callable[[], Graph]) -> None:
+        """
+        Add a graph which is created by a loader on first access.
+
+        :param name: The name of the graph.
+        :param loader: Returns the graph when called.
+        """
+        self._graphs[name] = None
+        self._loaders[name] = loader
+
+    def is_loaded(self, name: str) -> bool:
+        """
+        Check whether a graph was already created.
+
+        :param name: The name of the graph.
+        :return: True if the graph exists, False if it still has to be
+            created by its loader.
+        """
+        return name not in self._loaders
+
+    def loader(self, name: str) -> Union[Callable[[], Graph], None]:
+        """
+        Return the loader of a graph which was not created yet.
+
+        :param name: The name of the graph.
+        :return: The loader, None if the graph was already created.
+        """
+        return self._loaders.get(name, None)
+
+    def __getitem__(self, name: str) -> Graph:
+        if name in self._loaders:
+            self._graphs[name] = self._loaders[name]()
+            del self._loaders[name]
+        return self._graphs[name]
+
+    def __setitem__(self, name: str, graph: Graph) -> None:
+        self._graphs[name] = graph
+        self._loaders.pop(name, None)
+
+    def __delitem__(self, name: str) -> None:
+        del self._graphs[name]
+        self._loaders.pop(name, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._graphs)
+
+    def __len__(self) -> int:
+        return len(self._graphs)
+
+    def __repr__(self):
+        return (f'LazyGraphMapping({len(self)} graphs, '
+                f'{len(self._loaders)} not loaded)')
+
+
 class GrammarInfo:
 
     def __init__(self):
-        self.host_graphs: Dict[str, Graph] = None
+        self.host_graphs: MutableMapping[str, Graph] = None
         self.productions: Dict[str, Production] = None
-        self.result_graphs: Dict[str, Graph] = None
+        self.result_graphs: MutableMapping[str, Graph] = None
         self.global_vars: Dict[str, Any] = None
+        self.subgrammars: List[Dict[str, Any]] = None
         self.options: Dict[str, Any] = None
         self.extra: Dict[str, Any] = None
         self.svg_preamble: Dict = None
+
+    def create_grammar(self) -> Grammar:
+        """
+        Create the grammar described by the info.
+
+        Every entry of `subgrammars` lists the names of the productions
+        of one stage, along with its optional `name`, `global_vars`
+        and `max_derivations`. The global variables of a stage extend
+        those of the grammar. All productions which are not part of
+        any stage form the first stage.
+
+        :return: The grammar.
+        """
+        global_vars = self.global_vars
+        if global_vars is None:
+            global_vars = {}
+        staged = set()
+        subgrammars = []
+        for stage in self.subgrammars or []:
+            names = stage.get('productions', [])
+            for name in names:
+                if name not in self.productions:
+                    log.error(f'The subgrammar {stage.get("name", None)} '
+                              f'uses the unknown production {name}.')
+                    raise ModelGenArgumentError
+            staged.update(names)
+            subgrammars.append(Grammar(
+                {name: self.productions[name] for name in names},
+                {**global_vars, **stage.get('global_vars', {})},
+                name=stage.get('name', None),
+                max_steps=stage.get('max_derivations', None)
+            ))
+        return Grammar({name: production for name, production
+                        in self.productions.items() if name not in staged},
+                       global_vars, subgrammars)
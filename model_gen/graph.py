@@ -2,6 +2,7 @@ import abc
 import itertools
 import copy
 import random
+from fractions import Fraction
 from functools import singledispatch
 from typing import MutableSet, Dict, Any, AnyStr, Sequence, Iterable, List, Set
 from typing import MutableSequence, Tuple, Callable, AbstractSet, Union
@@ -9,7 +10,7 @@ from types import SimpleNamespace
 from collections import deque
 from model_gen.exceptions import ModelGenArgumentError
 from model_gen.exceptions import ModelGenIncongruentGraphStateError
-from model_gen.utils import get_logger, Mapping
+from model_gen.utils import get_logger, Mapping, compile_expression
 
 log = get_logger('model_gen.' + __name__)
 
@@ -54,7 +55,8 @@ class GraphElement(abc.ABC):
                     continue
                 if eval_attr:
                     def matching_function(attr, attrs):
-                        return eval(graph_element.attr[attr_key],
+                        return eval(compile_expression(
+                                        graph_element.attr[attr_key]),
                                     {**eval_vars, 'attr': attr, 'attrs': attrs})
                     if not matching_function(self.attr[attr_key], self.attr):
                         return False
@@ -660,7 +662,12 @@ class Graph(MutableSet):
 
     def match(self, other_graph: 'Graph', eval_attrs: bool=False,
               geometric_order: Tuple[List[GraphElement], List[GraphElement]]=None,
-              eval_vars: Dict[str, Any]=None) -> List[Mapping]:
+              eval_vars: Dict[str, Any]=None,
+              max_results: int=None,
+              oldest_only: bool=False,
+              start_element: GraphElement=None,
+              start_filter: Callable[[GraphElement], bool]=None
+              ) -> List[Mapping]:
         """
         Find all possible matches of the other graph in this graph.
 
@@ -677,18 +684,41 @@ class Graph(MutableSet):
             function.
         :param eval_vars: Variables to set during evaluation of
             attributes.
+        :param max_results: If set, stop searching once this many
+            matches were found.
+        :param oldest_only: If true, only return the matches with the
+            largest `generation_key`, i.e. the oldest ones. Partial
+            matches which can not reach the average generation of the
+            oldest match found so far are discarded early.
+        :param start_element: The element of the other graph which is
+            matched first. Choosing a selective one keeps the number
+            of partial matches small. Defaults to any element.
+        :param start_filter: If given, only elements of this graph for
+            which it returns True are tested against the start element.
+            It must not reject any element that would match.
         :return: A list of all possible matches, empty of there are
                  none.
         """
         log.debug(f'Matching graph {id(self):#x} against graph '
                   f'{id(other_graph):#x}.')
-        other_element = other_graph.get_any_element()
+        other_element = start_element
+        if other_element is None:
+            other_element = other_graph.get_any_element()
         if other_element is None:
             return []
         task_list: List[Tuple] = []
         results: List[Mapping] = []
+        if oldest_only:
+            generation_of = {id(element): int(element.attr['.generation'])
+                             for element in self.element_list('vef')}
+            min_generation = min(generation_of.values(), default=0)
+            best_key = None
+            best_total = None
+            size = len(other_graph)
         for own_element in self:
-            if not own_element.matches(other_element, eval_attrs):
+            if start_filter is not None and not start_filter(own_element):
+                continue
+            if not own_element.matches(other_element, eval_attrs, eval_vars):
                 continue
             mapping = Mapping({other_element: own_element})
             unmapped_elements = {e: other_element for e
@@ -702,13 +732,43 @@ class Graph(MutableSet):
             task_list.append(
                 (mapping, unmapped_elements, debug)
             )
+        if oldest_only:
+            # Search from the oldest elements, so that the best match is
+            # found early and more partial matches can be discarded.
+            task_list.sort(key=lambda task: -generation_of[
+                id(task[0][other_element])
+            ])
         while len(task_list) > 0:
             mapping, unmapped_elements, debug = task_list.pop()
+            if oldest_only:
+                # The total is compared instead of the average, since
+                # all matches have the same number of elements.
+                total = sum(generation_of[id(element)]
+                            for element in mapping.values())
+                bound = total + (size - len(mapping)) * min_generation
+                if best_total is not None and bound > best_total:
+                    continue
             if len(mapping) == len(other_graph) and len(unmapped_elements) == 0:
                 if not self.check_matching(mapping):
                     raise ModelGenIncongruentGraphStateError
+                if oldest_only:
+                    # Matches with the same average generation still
+                    # differ in their oldest elements, so only the
+                    # complete key decides.
+                    key = generation_key(mapping.values())
+                    if best_key is None or key > best_key:
+                        best_key = key
+                        best_total = total
+                        results = []
+                    elif key < best_key:
+                        continue
                 if mapping not in results:
                     results.append(mapping)
+                    if (max_results is not None
+                            and len(results) >= max_results):
+                        log.debug(f'Stopped matching after {max_results} '
+                                  f'matches.')
+                        break
                 continue
             elif len(mapping) == len(other_graph):
                 raise ValueError('Finished mapping, but unmapped_elements is '
@@ -904,14 +964,64 @@ class Graph(MutableSet):
         """
         if data['id'] in mapping:
             return mapping[data['id']]
-        result = Graph()
-        for vertex_data in data['vertices']:
-            result.add(Vertex.from_yaml(vertex_data, mapping))
-        for edge_data in data['edges']:
-            result.add(Edge.from_yaml(edge_data, mapping))
+        vertices = [Vertex.from_yaml(vertex_data, mapping)
+                    for vertex_data in data['vertices']]
+        edges = [Edge.from_yaml(edge_data, mapping)
+                 for edge_data in data['edges']]
+        result = Graph.from_elements(vertices, edges)
         mapping[data['id']] = result
         return result
 
+    @staticmethod
+    def from_elements(vertices: Iterable[Vertex], edges: Iterable[Edge],
+                      validate: bool = True) -> 'Graph':
+        """
+        Create a graph from all of its vertices and edges at once.
+
+        Unlike adding the elements one at a time, which checks the
+        connections of every element against the whole graph, the
+        edges are connected to their vertices in a single pass, so the
+        time needed is linear in the number of elements. Like `add`,
+        every element without a generation is assigned the highest
+        generation of the elements before it, vertices before edges.
+
+        :param vertices: The vertices of the graph.
+        :param edges: The edges of the graph.
+        :param validate: Whether to check that the elements are unique
+                         and that the edges only connect vertices of
+                         the graph. Can be skipped for trusted input.
+        :return: The new graph.
+        """
+        result = Graph(vertices=vertices, edges=edges, faces=[])
+        if validate:
+            vertex_set = set(result.vertices)
+            if (len(vertex_set) < len(result.vertices)
+                    or len(set(result.edges)) < len(result.edges)):
+                log.error('Error creating Graph: An element is contained '
+                          'more than once.')
+                raise ModelGenIncongruentGraphStateError
+            for edge in result.edges:
+                if ((edge.vertex1 is not None
+                     and edge.vertex1 not in vertex_set)
+                        or (edge.vertex2 is not None
+                            and edge.vertex2 not in vertex_set)):
+                    log.error('Error creating Graph: An Edge references a '
+                              'Vertex which is not part of the Graph.')
+                    raise ModelGenIncongruentGraphStateError
+        max_generation = 0
+        for element in itertools.chain(result.vertices, result.edges):
+            generation = element.attr.get('.generation', None)
+            if generation is None:
+                element.attr['.generation'] = max_generation
+            elif int(generation) > max_generation:
+                max_generation = int(generation)
+        for edge in result.edges:
+            if edge.vertex1 is not None:
+                edge.vertex1.edges.add(edge)
+            if edge.vertex2 is not None:
+                edge.vertex2.edges.add(edge)
+        return result
+
     class AllElemIter:
         """
         Iterates over all elements of a graph in a order such that
@@ -1120,6 +1230,31 @@ def get_generations(graph_elements: Iterable[GraphElement]) -> Generations:
     return Generations(generations)
 
 
+GenerationKey = Tuple[Fraction, Tuple[int, ...]]
+
+
+def generation_key(graph_elements: Iterable[GraphElement]) -> GenerationKey:
+    """
+    Return a key describing the age of a group of graph elements, e.g.
+    a match, which is larger the older the elements are.
+
+    Groups are first compared by the average of their generations.
+    Groups with the same average are compared by their generations in
+    ascending order, so that the group with the oldest element wins.
+    Two groups have the same key if and only if their `Generations`
+    are equal.
+
+    :param graph_elements: The iterable of graph elements.
+    :return: A hashable and sortable key.
+    """
+    generations = sorted(int(element.attr['.generation'])
+                         for element in graph_elements)
+    if len(generations) == 0:
+        return Fraction(0), ()
+    return (-Fraction(sum(generations), len(generations)),
+            tuple(-generation for generation in generations))
+
+
 def graph_is_consistent(graph: Graph) -> bool:
     """
     Tests if the graph is consistent, i.e. all connections between
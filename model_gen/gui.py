@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from typing import TypeVar, Dict
+import threading
+from timeit import default_timer as timer
+from typing import TypeVar, Dict, List, Tuple, Callable, Union
 
 import wx
 import wx.lib.newevent
-import yaml
 
-from gui_elements import MainNotebook, EVT_RUN_GRAMMAR, EVT_EXPORT_SVG
+from gui_elements import MainNotebook, EVT_RUN_GRAMMAR, EVT_EXPORT_SVG, \
+    EVT_CANCEL_GRAMMAR
 from model_gen.grammar import Grammar, GrammarInfo
 from model_gen.productions import Production
 from model_gen.utils import get_logger
-from model_gen.graph import Graph
+from model_gen.graph import Graph, non_recursive_copy
 from model_gen.opts import Opts
-from model_gen.serialisation import from_yaml, to_yaml
+from model_gen.serialisation import save_grammar_info
+from model_gen.cache import load_grammar_info_cached
 from model_gen.exports import export_graph_to_svg
 
 T = TypeVar('T')
@@ -21,6 +24,73 @@ T = TypeVar('T')
 log = get_logger('model_gen')
 
 
+class DerivationWorker(threading.Thread):
+    """
+    Runs a grammar in a background thread, so the GUI stays responsive.
+
+    The result graphs are handed to the main thread in batches through
+    `wx.CallAfter`, at most once per interval, so fast grammars do not
+    flood the event queue.
+    """
+
+    def __init__(self, grammar: Grammar, host_graph: Graph,
+                 max_steps: Dict,
+                 on_results: Callable[[List[Tuple[int, Graph]]], None],
+                 on_finished: Callable[[Union[Exception, None]], None],
+                 interval: float = 0.1):
+        """
+        :param grammar: The grammar to run.
+        :param host_graph: The graph to apply the grammar to. It must
+            not be changed during the run.
+        :param max_steps: See `Grammar.apply`.
+        :param on_results: Called on the main thread with a list of the
+            new derivation steps as tuples of index and result graph.
+        :param on_finished: Called on the main thread once the run
+            ended, with the exception which stopped it if any.
+        :param interval: The minimal time between two batches in
+            seconds.
+        """
+        super().__init__(daemon=True)
+        self.grammar: Grammar = grammar
+        self.host_graph: Graph = host_graph
+        self.max_steps: Dict = max_steps
+        self.on_results = on_results
+        self.on_finished = on_finished
+        self.interval: float = interval
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """
+        Stop the run after the current derivation step.
+        """
+        self._cancelled.set()
+
+    def run(self) -> None:
+        steps = self.grammar.iter_apply(self.host_graph, self.max_steps)
+        batch = []
+        last_batch = timer()
+        error = None
+        try:
+            for step in steps:
+                batch.append((step.index, step.graph))
+                if self._cancelled.is_set():
+                    log.info(f'Cancelled the run after {step.index + 1} '
+                             f'derivations.')
+                    break
+                if timer() - last_batch >= self.interval:
+                    wx.CallAfter(self.on_results, batch)
+                    batch = []
+                    last_batch = timer()
+        except Exception as e:
+            log.error(f'The run of the grammar failed: {e!r}.')
+            error = e
+        finally:
+            steps.close()
+            if batch:
+                wx.CallAfter(self.on_results, batch)
+            wx.CallAfter(self.on_finished, error)
+
+
 class GraphUI(wx.Frame):
     """
     The main window of the Application.
@@ -38,6 +108,7 @@ class GraphUI(wx.Frame):
         self.Show()
 
         self.grammar_info: GrammarInfo = None
+        self.worker: Union[DerivationWorker, None] = None
 
         if 'last_grammar_file_path' in opts:
             self.load_grammar_from_file(opts['last_grammar_file_path'])
@@ -86,6 +157,7 @@ class GraphUI(wx.Frame):
                   self.view_show_all_labels)
 
         self.Bind(EVT_RUN_GRAMMAR, self.run_grammar)
+        self.Bind(EVT_CANCEL_GRAMMAR, self.cancel_grammar)
         self.Bind(EVT_EXPORT_SVG, self.export_svg)
 
     def load_graphs(self, host_graphs: Dict[str, Graph],
@@ -109,7 +181,8 @@ class GraphUI(wx.Frame):
         """
         log.debug('Opening export dialog.')
         with wx.FileDialog(self, 'Export Graphs',
-                           wildcard='YAML files (*.yml)|*.yml',
+                           wildcard='YAML files (*.yml)|*.yml|'
+                                    'Binary files (*.npz)|*.npz',
                            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT
                            ) as file_dialog:
             if file_dialog.ShowModal() == wx.ID_CANCEL:
@@ -123,10 +196,8 @@ class GraphUI(wx.Frame):
                 self.notebook.production_panel.list.get_data()
             self.grammar_info.result_graphs = \
                 self.notebook.result_panel.list.get_data()
-            data = to_yaml(self.grammar_info)
             try:
-                with open(path, 'w') as stream:
-                    yaml.safe_dump(data, stream)
+                save_grammar_info(self.grammar_info, path)
             except IOError:
                 log.error(f'Could not open/write-to file {path}.')
                 wx.LogError(f'Cannot save export to file {path}.')
@@ -145,7 +216,8 @@ class GraphUI(wx.Frame):
         """
         log.debug('Opening import dialog.')
         with wx.FileDialog(self, 'Import Graphs',
-                           wildcard='YAML files (*.yml)|*.yml',
+                           wildcard='YAML files (*.yml)|*.yml|'
+                                    'Binary files (*.npz)|*.npz',
                            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST
                            ) as file_dialog:
             if file_dialog.ShowModal() == wx.ID_CANCEL:
@@ -162,13 +234,11 @@ class GraphUI(wx.Frame):
         :param file_path: Path to the file.
         """
         try:
-            with open(file_path, 'r') as stream:
-                data = yaml.safe_load(stream)
-                grammar_info: GrammarInfo = from_yaml(GrammarInfo(), data)
-                self.grammar_info = grammar_info
-                self.load_graphs(grammar_info.host_graphs,
-                                 grammar_info.productions,
-                                 grammar_info.result_graphs)
+            grammar_info = load_grammar_info_cached(file_path)
+            self.grammar_info = grammar_info
+            self.load_graphs(grammar_info.host_graphs,
+                             grammar_info.productions,
+                             grammar_info.result_graphs)
         except IOError:
             log.error(f'Cannon open/read from file »{file_path}«.')
             wx.LogError(f'Cannot open file {file_path}.')
@@ -176,11 +246,14 @@ class GraphUI(wx.Frame):
     def run_grammar(self, _) -> None:
         """
         Run the grammar defined by the productions on the active
-        hostgraph and add the result to result graphs.
+        hostgraph in the background and add the results to the result
+        graphs as they are derived.
         """
+        if self.worker is not None:
+            log.warning('The grammar is already running.')
+            return
         log.info('Running grammar.')
-        grammar = Grammar(self.grammar_info.productions,
-                          self.grammar_info.global_vars)
+        grammar = self.grammar_info.create_grammar()
         host_graph = self.notebook.host_graph_panel.get_active()
         if host_graph is None:
             log.error(
@@ -190,14 +263,40 @@ class GraphUI(wx.Frame):
             return
         max_derivations = self.grammar_info.options['max_derivations']
         max_derivations.setdefault('all', opts['max_derivations'])
-        results = grammar.apply(host_graph, max_derivations)
         offset = len(self.grammar_info.result_graphs)
-        log.debug(
-            f'There where {len(results)} derivations calculated.')
-        for i, result in enumerate(results):
-            self.grammar_info.result_graphs[f'Result {i + offset}'] = result
-            self.notebook.result_panel.load_data(
-                self.grammar_info.result_graphs)
+        result_panel = self.notebook.result_panel
+        num_results = 0
+
+        def on_results(steps: List[Tuple[int, Graph]]) -> None:
+            nonlocal num_results
+            result_panel.list.add_graphs(
+                {f'Result {index + offset}': graph for index, graph in steps}
+            )
+            num_results += len(steps)
+            result_panel.update_progress(num_results)
+
+        def on_finished(error: Union[Exception, None]) -> None:
+            self.worker = None
+            result_panel.finish_run()
+            log.debug(
+                f'There where {num_results} derivations calculated.')
+            if error is not None:
+                wx.LogError(f'The run of the grammar failed: {error}')
+
+        # The host graph may be edited while the grammar is running.
+        self.worker = DerivationWorker(grammar, non_recursive_copy(host_graph),
+                                       max_derivations, on_results,
+                                       on_finished)
+        result_panel.start_run(max_derivations['all'])
+        self.worker.start()
+
+    def cancel_grammar(self, _) -> None:
+        """
+        Stop the running grammar after its current derivation step.
+        """
+        if self.worker is not None:
+            log.info('Cancelling the run of the grammar.')
+            self.worker.cancel()
 
     def switch_label_display(self, _) -> None:
         """
@@ -214,6 +313,8 @@ class GraphUI(wx.Frame):
 
     def on_quit(self, _) -> None:
         log.info('Closing Model Gen.')
+        if self.worker is not None:
+            self.worker.cancel()
         self.Close()
 
 
@@ -1,3 +1,4 @@
+from collections.abc import MutableMapping
 from typing import Dict, Tuple, Union
 
 import wx
@@ -17,6 +18,7 @@ from model_gen.exports import export_production_to_TIKZ, \
 log = get_logger('model_gen.' + __name__)
 
 RunGrammarEvent, EVT_RUN_GRAMMAR = wx.lib.newevent.NewCommandEvent()
+CancelGrammarEvent, EVT_CANCEL_GRAMMAR = wx.lib.newevent.NewCommandEvent()
 ExportSVGEvent, EVT_EXPORT_SVG = wx.lib.newevent.NewCommandEvent()
 
 class MainNotebook(aui.AuiNotebook):
@@ -171,9 +173,16 @@ class ResultGraphPanel(wx.Panel):
         self.export_button.Bind(wx.EVT_BUTTON, self.on_export_button)
         self.run_button = wx.Button(self, label='Run')
         self.run_button.Bind(wx.EVT_BUTTON, self.on_run_button)
+        self.cancel_button = wx.Button(self, label='Cancel')
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel_button)
+        self.cancel_button.Disable()
         hbox2.Add(self.export_button, proportion=0, flag=wx.ALIGN_LEFT)
         hbox2.Add(self.run_button, proportion=0, flag=wx.ALIGN_LEFT)
+        hbox2.Add(self.cancel_button, proportion=0, flag=wx.ALIGN_LEFT)
+        self.gauge = wx.Gauge(self, range=1)
+        self.max_steps = 0
         vbox.Add(self.list, proportion=1, flag=wx.EXPAND)
+        vbox.Add(self.gauge, proportion=0, flag=wx.EXPAND)
         vbox.Add(hbox2, proportion=0, flag=wx.EXPAND)
         hbox.Add(vbox, proportion=0, flag=wx.EXPAND)
         hbox.Add(self.graph_panel, proportion=1, flag=wx.EXPAND)
@@ -188,6 +197,41 @@ class ResultGraphPanel(wx.Panel):
         """
         self.list.load_data(data)
 
+    def start_run(self, max_steps: int) -> None:
+        """
+        Show the progress of a run of the grammar, which can now be
+        cancelled.
+
+        :param max_steps: The maximum number of derivation steps of the
+            run, 0 if there is none.
+        """
+        self.max_steps = max_steps
+        self.run_button.Disable()
+        self.cancel_button.Enable()
+        self.gauge.SetRange(max(max_steps, 1))
+        self.gauge.SetValue(0)
+        if max_steps == 0:
+            self.gauge.Pulse()
+
+    def update_progress(self, steps: int) -> None:
+        """
+        Show the number of derivation steps performed by the run.
+
+        :param steps: The number of steps.
+        """
+        if self.max_steps > 0:
+            self.gauge.SetValue(min(steps, self.max_steps))
+        else:
+            self.gauge.Pulse()
+
+    def finish_run(self) -> None:
+        """
+        Reset the controls once the run has ended.
+        """
+        self.run_button.Enable()
+        self.cancel_button.Disable()
+        self.gauge.SetValue(0)
+
     def on_run_button(self, _) -> None:
         """
         Post a RunGrammarEvent wx Event when the button is clicked.
@@ -195,6 +239,13 @@ class ResultGraphPanel(wx.Panel):
         event = RunGrammarEvent(wx.ID_ANY)
         wx.PostEvent(self, event)
 
+    def on_cancel_button(self, _) -> None:
+        """
+        Post a CancelGrammarEvent wx Event when the button is clicked.
+        """
+        event = CancelGrammarEvent(wx.ID_ANY)
+        wx.PostEvent(self, event)
+
     def on_export_button(self, _) -> None:
         """
         Dispatch a ExportGraphEvent when the export graph button is pushed.
@@ -221,36 +272,58 @@ class GraphList(wx.ListCtrl):
         super().__init__(*args, style=style, **kwargs)
         self.graph_panel = graph_panel
         self.InsertColumn(0, 'name', width=150)
-        self.graphs: Dict[int, Tuple[str, Graph]] = {}
+        self.graphs: Dict[int, str] = {}
+        self.data: MutableMapping[str, Graph] = {}
         self.selected = None
         self.active = None
 
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_select)
 
-    def load_data(self, data: Dict[str, Graph]) -> None:
+    def load_data(self, data: MutableMapping[str, Graph]) -> None:
         """
         Load new data into the graph list.
 
+        Only the names of the graphs are needed to fill the list, so
+        graphs of a lazy mapping are only loaded once they are selected.
+
         :param data: The graphs to load as dict with names matched to graphs.
         """
         self.DeleteAllItems()
         self.graphs.clear()
+        self.data = data
         if len(data) > 0:
             self.active = 0
         i = 0
-        for name, graph_data in data.items():
+        for name in data:
             index = self.InsertItem(i, name)
-            self.graphs[index] = (name, graph_data)
+            self.graphs[index] = name
             i += 1
 
-    def get_data(self) -> Dict[str, Graph]:
+    def add_graphs(self, graphs: Dict[str, Graph]) -> None:
+        """
+        Append graphs to the list, without reloading it.
+
+        :param graphs: The graphs to add as dict with names matched to
+            graphs.
+        """
+        self.Freeze()
+        try:
+            for name, graph in graphs.items():
+                self.data[name] = graph
+                index = self.InsertItem(self.GetItemCount(), name)
+                self.graphs[index] = name
+        finally:
+            self.Thaw()
+        if self.active is None and len(self.data) > 0:
+            self.active = 0
+
+    def get_data(self) -> MutableMapping[str, Graph]:
         """
         Get the graph data associated with this list of graphs.
 
         :return: A dictionary with all the data about the Graphs.
         """
-        result = {name: graph for name, graph in self.graphs.values()}
-        return result
+        return self.data
 
     def delete_selection(self) -> None:
         """
@@ -259,7 +332,7 @@ class GraphList(wx.ListCtrl):
         if self.selected is None:
             return
         self.DeleteItem(self.selected)
-        self.graphs.pop(self.selected)
+        del self.data[self.graphs.pop(self.selected)]
         self.graph_panel.load_graph(Graph())
 
     def get_active(self) -> Graph or None:
@@ -269,8 +342,7 @@ class GraphList(wx.ListCtrl):
         :return: The currently active Graph
         """
         if self.active is not None:
-            _, active_graph = self.graphs[self.active]
-            return active_graph
+            return self.data[self.graphs[self.active]]
         return None
 
     def on_select(self, event) -> None:
@@ -280,7 +352,7 @@ class GraphList(wx.ListCtrl):
         item_index = event.GetIndex()
         self.selected = item_index
         self.active = item_index
-        graph = self.graphs[item_index][1]
+        graph = self.data[self.graphs[item_index]]
         self.graph_panel.load_graph(graph)
 
 
@@ -1,7 +1,11 @@
 import abc
-from typing import Dict, Tuple, Set, MutableSequence, Union
+import math
+from collections import defaultdict
+from typing import Dict, Tuple, Set, MutableSequence, Union, List, \
+    Iterable
 from functools import partial
 
+import numpy as np
 import wx
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_wx import \
@@ -9,10 +13,12 @@ from matplotlib.backends.backend_wx import \
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from matplotlib.figure import Figure
 from matplotlib.patches import ConnectionPatch, FancyArrow
+from matplotlib.collections import EllipseCollection, LineCollection, \
+    PolyCollection
+from matplotlib.colors import to_rgba
 import matplotlib.patheffects as pe
 import matplotlib.backend_bases
 import matplotlib.artist
-from pydispatch import dispatcher
 
 from model_gen.exceptions import ModelGenArgumentError
 from model_gen.graph import GraphElement, Graph, Vertex, Edge
@@ -23,6 +29,12 @@ from model_gen.geometry import Vec, normalize
 log = get_logger('model_gen.' + __name__)
 opts = Opts()
 
+PICK_RADIUS = 5
+"""
+The distance in points within which edges are hovered and clicked,
+the default pick radius of matplotlib lines.
+"""
+
 
 def _get_round_edges_bitmap(width: int, height: int, radius: int):
     """
@@ -357,6 +369,24 @@ class AttributeRequirementEditingFrame(wx.Frame):
             self.SetPosition(self.GetPosition() - change)
 
 
+def get_hover_text(graph_element: Union[GraphElement, None]) -> str:
+    """
+    Return the on-hover text of a graph element, which lists its
+    attributes.
+
+    :param graph_element: The graph element.
+    :return: A string containing the hover text of the element.
+    """
+    if graph_element is None:
+        return ''
+    text = ''
+    for name, value in graph_element.attr.items():
+        if name in ('x', 'y') or name.startswith('.'):
+            continue
+        text += f'{name}: {value}\n'
+    return text[:-1]
+
+
 class GraphPanel(wx.Panel):
     """
     A container for the plots of a graph.
@@ -399,6 +429,16 @@ class GraphPanel(wx.Panel):
         self.graph_to_figure: Bidict[GraphElement, FigureElement] = Bidict()
         self.vertices: Set[FigureVertex] = set()
         self.edges: Set[FigureEdge] = set()
+        self.collections: Dict[plt.Axes, GraphCollections] = {}
+        """The graphs drawn as collections, by the axes they are in."""
+        self.spatial_indices: Dict[plt.Axes, SpatialIndex] = {}
+        """The spatial indices of the drawn elements, by their axes."""
+        self.hovered_elements: Set[FigureElement] = set()
+        self.dragged_elements: Set[FigureElement] = set()
+        """The dragged vertices and their edges, which are blitted."""
+        self.drag_background = None
+        """The canvas without the dragged elements, saved when the
+        dragging starts."""
 
     @property
     def elements(self) -> Set['FigureElement']:
@@ -437,6 +477,10 @@ class GraphPanel(wx.Panel):
     def draw_graph(self, graph=None, axes=None) -> None:
         """
         Draw the graph as a set of circles and connecting edges.
+
+        Graphs with more elements than the option
+        `gui.collection_threshold` are drawn as collections, see
+        `GraphCollections`.
         """
 
         # noinspection PyShadowingNames
@@ -473,6 +517,7 @@ class GraphPanel(wx.Panel):
             graph = self.graph
         i = 0
         free_spaces = [(0, 0)]
+        use_collections = len(graph) > opts['gui']['collection_threshold']
         for graph_vertex in graph.vertices:
             if 'x' in graph_vertex.attr and 'y' in graph_vertex.attr:
                 x = float(graph_vertex.attr['x'])
@@ -484,11 +529,16 @@ class GraphPanel(wx.Panel):
                 graph_vertex.attr['y'] = position[1]
                 add_new_free_spaces(position, free_spaces)
                 i += 1
+            if use_collections:
+                continue
             figure_vertex = FigureVertex(graph_vertex, position,
                                          color='w', ec='k', zorder=10)
             self.vertices.add(figure_vertex)
             self.graph_to_figure[graph_vertex] = figure_vertex
             axes.add_artist(figure_vertex)
+        if use_collections:
+            self._draw_graph_collections(graph, axes)
+            return
         for graph_edge in graph.edges:
 
             def get_figure_vertex_for_edge(graph_vertex: Vertex, i
@@ -522,9 +572,108 @@ class GraphPanel(wx.Panel):
             for element in self.elements:
                 if element.get_hover_text() != '':
                     element.annotation = self.annotate_element(element)
+        self.spatial_indices[axes] = SpatialIndex(
+            [element for element in self.elements if element.axes is axes]
+        )
+        self.setup_mpl_visuals(axes)
+        self.redraw()
+
+    def _draw_graph_collections(self, graph: Graph, axes: plt.Axes) -> None:
+        """
+        Draw a graph as collections and show all of it.
+
+        Labels are only shown for the hovered element, regardless of the
+        option `show_all_labels`.
+        """
+        log.info(f'Drawing the graph with {len(graph)} elements as '
+                 f'collections.')
+        collections = GraphCollections(graph, axes)
+        self.collections[axes] = collections
         self.setup_mpl_visuals(axes)
+        x_limits, y_limits = collections.get_limits()
+        axes.set_xlim(*x_limits)
+        axes.set_ylim(*y_limits)
         self.redraw()
 
+    def _pick_tolerance(self, event: matplotlib.backend_bases.LocationEvent
+                        ) -> float:
+        """
+        Return `PICK_RADIUS` in data coordinates of the axes of the
+        event.
+        """
+        pixels = PICK_RADIUS * self.figure.dpi / 72
+        inverted = event.inaxes.transData.inverted()
+        return abs(inverted.transform((event.x + pixels, event.y))[0]
+                   - event.xdata)
+
+    def _elements_at(self, event: matplotlib.backend_bases.LocationEvent
+                     ) -> List['FigureElement']:
+        """
+        Return the drawn FigureElements which contain the event.
+
+        Only the elements close to the event according to the spatial
+        index of its axes are tested.
+        """
+        index = self.spatial_indices.get(event.inaxes)
+        if index is None or event.xdata is None:
+            return []
+        candidates = index.query(event.xdata, event.ydata,
+                                 self._pick_tolerance(event))
+        return [element for element in candidates
+                if element.contains(event)[0]]
+
+    def _collection_element_at(
+            self, event: matplotlib.backend_bases.LocationEvent
+    ) -> Tuple[Union['GraphCollections', None], Union[GraphElement, None]]:
+        """
+        Return the collections the event is in, if its graph is drawn
+        as collections, and the graph element at the event.
+        """
+        collections = self.collections.get(event.inaxes)
+        if collections is None or event.xdata is None:
+            return collections, None
+        return collections, collections.element_at(
+            event.xdata, event.ydata, self._pick_tolerance(event)
+        )
+
+    def _annotate_hovered(self, collections: 'GraphCollections') -> None:
+        """
+        Replace the annotation of the previously hovered element of a
+        graph drawn as collections by that of the hovered one.
+        """
+        if collections.annotation is not None:
+            collections.annotation.remove()
+            collections.annotation = None
+        if collections.hovered is not None:
+            collections.annotation = self.annotate(
+                get_hover_text(collections.hovered),
+                collections.get_center(collections.hovered),
+                collections.axes
+            )
+
+    def _select_collection_element(
+            self, event: matplotlib.backend_bases.MouseEvent,
+            collections: 'GraphCollections',
+            element: Union[GraphElement, None]
+    ) -> None:
+        """
+        Select an element of a graph drawn as collections, or connect
+        it to the selected element, see `connect_elements`.
+        """
+        selected = collections.selected
+        if selected is None or element is None or selected is element:
+            collections.set_selected(None if selected is element else element)
+            self.redraw()
+            return
+        collections.set_selected(None)
+        if isinstance(selected, Vertex) and isinstance(element, Vertex):
+            log.debug('Connecting Vertices.')
+            self._add_edge(self._get_connected_graph(event.inaxes), selected,
+                           element)
+            self._redraw_graph()
+        else:
+            self.redraw()
+
     def annotate(self, text: str, position: Tuple[int, int],
                  axes: plt.Axes = None) -> Union[plt.Annotation, None]:
         """
@@ -578,6 +727,11 @@ class GraphPanel(wx.Panel):
         """
         self.vertices.clear()
         self.edges.clear()
+        self.collections.clear()
+        self.spatial_indices.clear()
+        self.hovered_elements.clear()
+        self.dragged_elements.clear()
+        self.drag_background = None
         self.subplot.clear()
         self.selected_element = None
         self.pressed_elements.clear()
@@ -688,6 +842,7 @@ class GraphPanel(wx.Panel):
             element.add_extra_path_effect('selection',
                                           pe.Stroke(linewidth=5,
                                                     foreground='b'))
+            self.redraw()
             return
         graph = self._get_connected_graph(event.inaxes)
         element1 = self.graph_to_figure.inverse[self.selected_element][0]
@@ -715,10 +870,15 @@ class GraphPanel(wx.Panel):
         """
         log.info(f'Removing Element(s) @ {event.x} - {event.y}')
         graph = self._get_connected_graph(event.inaxes)
-        to_remove = {x for x in self.elements if x.contains(event)[0]}
+        collections, element = self._collection_element_at(event)
+        if collections is not None:
+            to_remove = set() if element is None else {element}
+        else:
+            to_remove = {self.graph_to_figure.inverse[x][0]
+                         for x in self._elements_at(event)}
         log.info(f'Elements to remove are {to_remove}')
         for element in to_remove:
-            graph.remove(self.graph_to_figure.inverse[element][0])
+            graph.remove(element)
         self._redraw_graph()
 
     def open_attr_editing(self, element) -> None:
@@ -733,8 +893,10 @@ class GraphPanel(wx.Panel):
             self.attr_editing_window = AttributeEditingFrame(self, wx.ID_ANY,
                                                              position=position,
                                                              element=element)
-            figure_element = self.graph_to_figure[element]
-            figure_element.annotation = self.annotate_element(figure_element)
+            figure_element = self.graph_to_figure.get(element)
+            if figure_element in self.elements:
+                figure_element.annotation = self.annotate_element(
+                    figure_element)
 
     def close_attr_editing(self) -> None:
         """
@@ -778,27 +940,39 @@ class GraphPanel(wx.Panel):
             self.redraw()
         if self.attr_req_editing_window is not None:
             self.close_attr_req_editing()
+        collections, element = self._collection_element_at(event)
+        if collections is not None:
+            if element is not None and event.guiEvent.ShiftDown() \
+                    and self.attr_editing_window is None:
+                if event.button == 1:
+                    self.open_attr_editing(element)
+                elif event.button == 3:
+                    self.open_attr_req_editing(element)
+            return
         if event.button == 1:  # 1 = left click
             self.press_start_position = (event.xdata, event.ydata)
-            for element in self.elements:
-                if element.contains(event)[0]:
-                    if event.guiEvent.ShiftDown() \
-                            and self.attr_editing_window is None:
-                        self.open_attr_editing(
-                            self.graph_to_figure.inverse[element][0])
-                    self.pressed_elements[element] = element.get_center()
-                    dispatcher.connect(receiver=element.on_position_change,
-                                       signal='element_position_changed')
+            for element in self._elements_at(event):
+                if event.guiEvent.ShiftDown() \
+                        and self.attr_editing_window is None:
+                    self.open_attr_editing(
+                        self.graph_to_figure.inverse[element][0])
+                self.pressed_elements[element] = element.get_center()
         if event.button == 3:  # 3 = right click
-            for element in self.elements:
-                if element.contains(event)[0]:
-                    if event.guiEvent.ShiftDown() \
-                            and self.attr_editing_window is None:
-                        self.open_attr_req_editing(
-                            self.graph_to_figure.inverse[element][0])
-                        return
+            for element in self._elements_at(event):
+                if event.guiEvent.ShiftDown() \
+                        and self.attr_editing_window is None:
+                    self.open_attr_req_editing(
+                        self.graph_to_figure.inverse[element][0])
+                    return
 
     def on_release(self, event: matplotlib.backend_bases.MouseEvent):
+        if event.button == 1 and not self.event_in_axes(event):
+            # A drag may end outside of the axes, the dragged elements
+            # still need to be drawn normally again.
+            self.press_start_position = None
+            self.pressed_elements.clear()
+            self._end_drag()
+            return
         if not self.event_in_axes(event):
             return
         if event.button == 1:  # 1 = left click
@@ -806,17 +980,18 @@ class GraphPanel(wx.Panel):
                 self.add_vertex(event)
                 return
             self.press_start_position = None
-            for element in self.elements:
-                if element.contains(event)[0] \
-                        and element in self.pressed_elements:
+            for element in self._elements_at(event):
+                if element in self.pressed_elements:
                     self.pressed_elements.pop(element)
-                    dispatcher.disconnect(receiver=element.on_position_change,
-                                          signal='element_position_changed')
+            self._end_drag()
         elif event.button == 3 and not event.guiEvent.ShiftDown():  # 3 = right click
-            for element in self.vertices | self.edges:
-                if element.contains(event)[0]:
-                    self.connect_elements(event, element)
-                    return
+            collections, element = self._collection_element_at(event)
+            if collections is not None:
+                self._select_collection_element(event, collections, element)
+                return
+            for element in self._elements_at(event):
+                self.connect_elements(event, element)
+                return
             if self.selected_element is not None:
                 self.selected_element.remove_extra_path_effect('selection')
                 self.selected_element = None
@@ -837,36 +1012,118 @@ class GraphPanel(wx.Panel):
     def on_motion(self, event: matplotlib.backend_bases.MouseEvent):
         if not self.event_in_axes(event):
             return
-        for element in self.elements:
-            if element.contains(event)[0]:
-                if not element.hovered:
-                    element.hovered = True
-                    element.on_hover()
-                    if element.annotation is None \
-                            and element.get_hover_text() != '':
-                        element.annotation = self.annotate_element(element)
-            else:
-                if element.hovered:
-                    element.hovered = False
-                    element.on_unhover()
-                    if element.annotation is not None \
-                            and not opts['show_all_labels']:
-                        element.annotation.set_visible(False)
-                        element.annotation.remove()
-                        element.annotation = None
+        collections, element = self._collection_element_at(event)
+        if collections is not None:
+            if collections.set_hovered(element):
+                self._annotate_hovered(collections)
+                self.redraw()
+            return
         # This is a sanity check. With gui interactions it could easily happen
         # that a mouse release occurs is such a way that an inconsistency
         # appears.
         if len(self.pressed_elements) != 0 \
                 and self.press_start_position is None:
             self.pressed_elements.clear()
-        elif len(self.pressed_elements) > 0:
-            dispatcher.send(signal='element_position_changed', sender=self)
-            for element, center in self.pressed_elements.items():
-                if isinstance(element, FigureVertex):
-                    dx = event.xdata - self.press_start_position[0]
-                    dy = event.ydata - self.press_start_position[1]
-                    element.center = (center[0] + dx, center[1] + dy)
+            self._end_drag()
+        if any(isinstance(element, FigureVertex)
+               for element in self.pressed_elements):
+            self._drag_vertices(event)
+            return
+        hovered_elements = set(self._elements_at(event))
+        changed = hovered_elements != self.hovered_elements
+        for element in self.hovered_elements - hovered_elements:
+            element.hovered = False
+            element.on_unhover()
+            if element.annotation is not None \
+                    and not opts['show_all_labels']:
+                element.annotation.set_visible(False)
+                element.annotation.remove()
+                element.annotation = None
+        for element in hovered_elements - self.hovered_elements:
+            element.hovered = True
+            element.on_hover()
+            if element.annotation is None \
+                    and element.get_hover_text() != '':
+                element.annotation = self.annotate_element(element)
+        self.hovered_elements = hovered_elements
+        if changed:
+            self.redraw()
+
+    def _drag_vertices(self, event: matplotlib.backend_bases.MouseEvent
+                       ) -> None:
+        """
+        Move the pressed vertices along with the mouse.
+
+        If the canvas supports blitting, only the dragged vertices,
+        their edges and the annotations and mappings attached to them
+        are redrawn over the background saved when the dragging
+        started.
+        """
+        if self.canvas.supports_blit and self.drag_background is None:
+            self._start_drag()
+        dx = event.xdata - self.press_start_position[0]
+        dy = event.ydata - self.press_start_position[1]
+        for element, center in self.pressed_elements.items():
+            if not isinstance(element, FigureVertex):
+                continue
+            element.center = (center[0] + dx, center[1] + dy)
+            element.on_position_change()
+            index = self.spatial_indices.get(element.axes)
+            if index is not None:
+                index.update(element)
+                for edge in element.edges:
+                    index.update(edge)
+        if self.drag_background is None:
+            self.redraw()
+            return
+        self.canvas.restore_region(self.drag_background)
+        for artist in sorted(self._get_dragged_artists(),
+                             key=lambda a: a.get_zorder()):
+            self.figure.draw_artist(artist)
+        self.canvas.blit(self.figure.bbox)
+
+    def _get_dragged_artists(self) -> List[matplotlib.artist.Artist]:
+        """
+        Return all artists that change while the dragged elements move.
+
+        The arrows of the edges are recreated on every move, so the
+        list is only valid until the next one.
+        """
+        artists = []
+        for element in self.dragged_elements:
+            artists.append(element)
+            if isinstance(element, FigureEdge) and element.arrow is not None:
+                artists.append(element.arrow)
+            for artist in (element.annotation, element.mapping_left,
+                           element.mapping_right):
+                if artist is not None:
+                    artists.append(artist)
+        return artists
+
+    def _start_drag(self) -> None:
+        """
+        Exclude the pressed vertices and everything attached to them
+        from drawing and save the canvas without them as background.
+        """
+        for element in self.pressed_elements:
+            if isinstance(element, FigureVertex):
+                self.dragged_elements.add(element)
+                self.dragged_elements.update(element.edges)
+        for artist in self._get_dragged_artists():
+            artist.set_animated(True)
+        self.canvas.draw()
+        self.drag_background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def _end_drag(self) -> None:
+        """
+        Draw the dragged elements normally again after the dragging.
+        """
+        if not self.dragged_elements:
+            return
+        for artist in self._get_dragged_artists():
+            artist.set_animated(False)
+        self.dragged_elements.clear()
+        self.drag_background = None
         self.redraw()
 
 
@@ -897,6 +1154,11 @@ class ProductionGraphsPanel(GraphPanel):
         """
         self.vertices.clear()
         self.edges.clear()
+        self.collections.clear()
+        self.spatial_indices.clear()
+        self.hovered_elements.clear()
+        self.dragged_elements.clear()
+        self.drag_background = None
         self.subplot.clear()
         self.subplot2.clear()
 
@@ -1055,14 +1317,7 @@ class FigureElement(matplotlib.artist.Artist):
 
         :return: A string containing the hover text of the element.
         """
-        if self.graph_element is None:
-            return ''
-        text = ''
-        for name, value in self.graph_element.attr.items():
-            if name in ('x', 'y') or name.startswith('.'):
-                continue
-            text += f'{name}: {value}\n'
-        return text[:-1]
+        return get_hover_text(self.graph_element)
 
     def add_extra_path_effect(self, name: str,
                               effect: pe.AbstractPathEffect) -> None:
@@ -1230,6 +1485,7 @@ class FigureEdge(FigureElement, plt.Line2D):
         self.set_ydata((p1.y, p2.y))
         self.arrow.remove()
         self.arrow = create_directional_arrow(self)
+        self.arrow.set_animated(self.get_animated())
         self.axes.add_patch(self.arrow)
 
     def get_center(self) -> Tuple[int, int]:
@@ -1286,6 +1542,437 @@ class FigureEdge(FigureElement, plt.Line2D):
         self.remove_extra_path_effect('hover')
 
 
+class SpatialIndex:
+    """
+    A uniform grid over the bounding boxes of FigureElements, used to
+    find the elements at a position without testing all of them.
+
+    The bounding box of an edge spans the centers of its vertices
+    instead of its drawn line, so it stays valid while the vertices
+    are dragged.
+    """
+
+    def __init__(self, elements: Iterable['FigureElement'] = (),
+                 cell_size: float = None):
+        """
+        :param elements: The elements to index.
+        :param cell_size: The side length of the square cells of the
+            grid in data coordinates, defaults to four vertex radii.
+        """
+        if cell_size is None:
+            cell_size = 4 * opts['gui']['attrs']['vertex_radius']
+        self.cell_size: float = cell_size
+        self.cells: Dict[Tuple[int, int], Set[FigureElement]] = \
+            defaultdict(set)
+        """The elements whose bounding box overlaps a cell, by cell."""
+        self.element_cells: Dict[FigureElement, List[Tuple[int, int]]] = {}
+        """The cells every element is in."""
+        for element in elements:
+            self.insert(element)
+
+    def __len__(self):
+        return len(self.element_cells)
+
+    def _get_cells(self, x_min: float, y_min: float, x_max: float,
+                   y_max: float) -> List[Tuple[int, int]]:
+        """
+        Return all cells which overlap a bounding box.
+        """
+        i_min = math.floor(x_min / self.cell_size)
+        i_max = math.floor(x_max / self.cell_size)
+        j_min = math.floor(y_min / self.cell_size)
+        j_max = math.floor(y_max / self.cell_size)
+        return [(i, j) for i in range(i_min, i_max + 1)
+                for j in range(j_min, j_max + 1)]
+
+    @staticmethod
+    def get_bounds(element: 'FigureElement'
+                   ) -> Tuple[float, float, float, float]:
+        """
+        Return the bounding box of an element as
+        (x_min, y_min, x_max, y_max).
+        """
+        if isinstance(element, FigureEdge) and element.vertex1 is not None \
+                and element.vertex2 is not None:
+            x1, y1 = element.vertex1.get_center()
+            x2, y2 = element.vertex2.get_center()
+            return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        if isinstance(element, FigureVertex):
+            x, y = element.get_center()
+            radius = element.get_radius()
+            return x - radius, y - radius, x + radius, y + radius
+        x, y = element.get_center()
+        return x, y, x, y
+
+    def insert(self, element: 'FigureElement') -> None:
+        """
+        Add an element to the index.
+        """
+        cells = self._get_cells(*self.get_bounds(element))
+        for cell in cells:
+            self.cells[cell].add(element)
+        self.element_cells[element] = cells
+
+    def remove(self, element: 'FigureElement') -> None:
+        """
+        Remove an element from the index.
+        """
+        for cell in self.element_cells.pop(element, ()):
+            elements = self.cells[cell]
+            elements.discard(element)
+            if not elements:
+                del self.cells[cell]
+
+    def update(self, element: 'FigureElement') -> None:
+        """
+        Move an element within the index after its position changed.
+        """
+        self.remove(element)
+        self.insert(element)
+
+    def query(self, x: float, y: float, tolerance: float = 0.0
+              ) -> Set['FigureElement']:
+        """
+        Return the elements whose bounding box may be within a distance
+        of a position.
+
+        The result is a superset of the elements at the position, which
+        still need to be tested exactly.
+
+        :param x: The x coordinate of the position.
+        :param y: The y coordinate of the position.
+        :param tolerance: The distance in data coordinates.
+        :return: The elements close to the position.
+        """
+        result = set()
+        for cell in self._get_cells(x - tolerance, y - tolerance,
+                                    x + tolerance, y + tolerance):
+            result.update(self.cells.get(cell, ()))
+        return result
+
+
+class BoundsGrid:
+    """
+    A uniform grid over an array of bounding boxes, used to find the
+    vertices and edges of `GraphCollections` at a position without
+    testing all of them.
+
+    Unlike `SpatialIndex` the grid is built once with NumPy, the boxes
+    can not be moved afterwards. Boxes spanning more than `MAX_CELLS`
+    cells, e.g. very long edges, are not added to the cells but
+    returned by every query.
+    """
+    MAX_CELLS = 64
+
+    def __init__(self, bounds: np.ndarray, cell_size: float):
+        """
+        :param bounds: The bounding boxes as rows of
+            (x_min, y_min, x_max, y_max).
+        :param cell_size: The side length of the square cells of the
+            grid in data coordinates.
+        """
+        self.cell_size: float = cell_size
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        """The indices of the boxes overlapping a cell, by cell."""
+        low = np.floor(bounds[:, :2] / cell_size).astype(np.int64)
+        extents = np.floor(bounds[:, 2:] / cell_size).astype(np.int64) \
+            - low + 1
+        counts = extents[:, 0] * extents[:, 1]
+        large = counts > self.MAX_CELLS
+        self.large: np.ndarray = np.flatnonzero(large)
+        """The indices of the boxes returned by every query."""
+        counts[large] = 0
+        total = int(counts.sum())
+        if total == 0:
+            return
+        # Every box gets one entry per cell it overlaps, numbered row by
+        # row within its cells.
+        indices = np.repeat(np.arange(len(bounds)), counts)
+        numbers = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+        widths = extents[indices, 0]
+        i = low[indices, 0] + numbers % widths
+        j = low[indices, 1] + numbers // widths
+        order = np.lexsort((j, i))
+        i, j, indices = i[order], j[order], indices[order]
+        starts = np.flatnonzero(np.concatenate(
+            ([True], (i[1:] != i[:-1]) | (j[1:] != j[:-1]))
+        ))
+        for start, cell_indices in zip(starts, np.split(indices, starts[1:])):
+            self.cells[int(i[start]), int(j[start])] = cell_indices
+
+    def query(self, x: float, y: float, tolerance: float = 0.0
+              ) -> np.ndarray:
+        """
+        Return the indices of the boxes which may be within a distance
+        of a position, in ascending order.
+
+        The result is a superset of the boxes containing the position,
+        which still need to be tested exactly.
+
+        :param x: The x coordinate of the position.
+        :param y: The y coordinate of the position.
+        :param tolerance: The distance in data coordinates.
+        :return: The indices of the boxes close to the position.
+        """
+        i_min = math.floor((x - tolerance) / self.cell_size)
+        i_max = math.floor((x + tolerance) / self.cell_size)
+        j_min = math.floor((y - tolerance) / self.cell_size)
+        j_max = math.floor((y + tolerance) / self.cell_size)
+        parts = [self.large]
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                if (i, j) in self.cells:
+                    parts.append(self.cells[i, j])
+        return np.unique(np.concatenate(parts))
+
+
+class GraphCollections:
+    """
+    Visual representation of a whole graph as a few matplotlib
+    collections, which is used for graphs too large to be drawn as
+    individual FigureElements.
+
+    All vertices are drawn as a single EllipseCollection, all edges as
+    a single LineCollection and their arrow heads as a single
+    PolyCollection. Hovering and selecting elements changes their
+    colour and line width in the arrays of per-element styles, instead
+    of adding path effects. The element at a position is found through
+    a `BoundsGrid` of the vertices and one of the edges. Elements can
+    not be dragged.
+    """
+
+    def __init__(self, graph: Graph, axes: plt.Axes):
+        """
+        :param graph: The graph to draw. All its vertices need to have
+            a position.
+        :param axes: The axes to draw into.
+        """
+        self.axes: plt.Axes = axes
+        self.radius: float = opts['gui']['attrs']['vertex_radius']
+        self.vertices: List[Vertex] = list(graph.vertices)
+        """The drawn vertices in the order of the collection."""
+        vertex_indices = {vertex: i for i, vertex in enumerate(self.vertices)}
+        # Edges which are not connected to two vertices are not drawn.
+        self.edges: List[Edge] = [edge for edge in graph.edges
+                                  if edge.vertex1 in vertex_indices
+                                  and edge.vertex2 in vertex_indices]
+        """The drawn edges in the order of the collection."""
+        self.element_indices: Dict[GraphElement, int] = {
+            **vertex_indices,
+            **{edge: i for i, edge in enumerate(self.edges)}
+        }
+        self.positions: np.ndarray = np.array(
+            [(float(vertex.attr['x']), float(vertex.attr['y']))
+             for vertex in self.vertices], dtype=float
+        ).reshape(-1, 2)
+        edge_vertices = np.array(
+            [(vertex_indices[edge.vertex1], vertex_indices[edge.vertex2])
+             for edge in self.edges], dtype=np.intp
+        ).reshape(-1, 2)
+        self.segments: np.ndarray = self._calc_segments(edge_vertices)
+        """The start and end points of all edges, of shape (n, 2, 2)."""
+        self.vertex_grid: BoundsGrid = BoundsGrid(
+            np.hstack([self.positions - self.radius,
+                       self.positions + self.radius]),
+            4 * self.radius
+        )
+        """Finds the vertices at a position."""
+        edge_low = self.segments.min(axis=1)
+        edge_high = self.segments.max(axis=1)
+        # Most edges only span a few cells of the size of a typical edge.
+        edge_size = 4 * self.radius
+        if len(self.edges) > 0:
+            edge_size = max(edge_size,
+                            float(np.median(np.max(edge_high - edge_low,
+                                                   axis=1))))
+        self.edge_grid: BoundsGrid = BoundsGrid(
+            np.hstack([edge_low, edge_high]), edge_size
+        )
+        """Finds the edges at a position."""
+        self.hovered: Union[GraphElement, None] = None
+        self.selected: Union[GraphElement, None] = None
+        self.annotation: Union[plt.Annotation, None] = None
+        """The annotation of the hovered element."""
+
+        helper_nodes = np.array([vertex.attr.get('.helper_node', False)
+                                 for vertex in self.vertices], dtype=bool)
+        self._vertex_colors = np.tile(to_rgba('k'), (len(self.vertices), 1))
+        self._vertex_colors[helper_nodes] = to_rgba('w')
+        self._vertex_widths = np.full(len(self.vertices),
+                                      plt.rcParams['patch.linewidth'])
+        self._edge_colors = np.tile(to_rgba('k'), (len(self.edges), 1))
+        self._edge_widths = np.full(len(self.edges),
+                                    plt.rcParams['lines.linewidth'])
+        diameters = np.full(len(self.vertices), 2 * self.radius)
+        collection_args = dict(units='xy', offsets=self.positions,
+                               facecolors='w',
+                               edgecolors=self._vertex_colors,
+                               linewidths=self._vertex_widths, zorder=10)
+        try:
+            self.vertex_collection = EllipseCollection(
+                diameters, diameters, 0, offset_transform=axes.transData,
+                **collection_args
+            )
+        except (TypeError, AttributeError):  # matplotlib < 3.6
+            self.vertex_collection = EllipseCollection(
+                diameters, diameters, 0, transOffset=axes.transData,
+                **collection_args
+            )
+        self.edge_collection = LineCollection(
+            self.segments, colors=self._edge_colors,
+            linewidths=self._edge_widths, zorder=2
+        )
+        self.arrow_collection = PolyCollection(
+            self._calc_arrow_heads(), facecolors=opts['gui']['arrows']['color'],
+            edgecolors='none', zorder=3
+        )
+        axes.add_collection(self.edge_collection, autolim=False)
+        axes.add_collection(self.arrow_collection, autolim=False)
+        axes.add_collection(self.vertex_collection, autolim=False)
+
+    def _calc_segments(self, edge_vertices: np.ndarray) -> np.ndarray:
+        """
+        Calculate the lines of edges between the circumferences of
+        their vertices, like `connection_points_between_figure_elements`.
+        """
+        centers1 = self.positions[edge_vertices[:, 0]]
+        centers2 = self.positions[edge_vertices[:, 1]]
+        directions = centers2 - centers1
+        lengths = np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        directions = np.divide(directions, lengths,
+                               out=np.zeros_like(directions),
+                               where=lengths > 0)
+        radius = self.radius + opts['gui']['attrs']['linewidth_offset']
+        return np.stack([centers1 + directions * radius,
+                         centers2 - directions * radius], axis=1)
+
+    def _calc_arrow_heads(self) -> np.ndarray:
+        """
+        Calculate the triangles of the arrow heads at the end of all
+        edges, like `create_directional_arrow`.
+        """
+        arrow_opts = opts['gui']['arrows']
+        starts = self.segments[:, 0]
+        tips = self.segments[:, 1]
+        directions = tips - starts
+        lengths = np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        directions = np.divide(directions, lengths,
+                               out=np.zeros_like(directions),
+                               where=lengths > 0)
+        normals = np.stack([-directions[:, 1], directions[:, 0]], axis=1)
+        head_length = min(arrow_opts['head_length'],
+                          arrow_opts['arrow_start_offset'])
+        bases = tips - directions * head_length
+        half_width = normals * arrow_opts['head_width'] / 2
+        return np.stack([tips, bases + half_width, bases - half_width],
+                        axis=1)
+
+    def element_at(self, x: float, y: float, tolerance: float
+                   ) -> Union[GraphElement, None]:
+        """
+        Return the element at a position, preferring vertices over
+        edges.
+
+        :param x: The x coordinate of the position.
+        :param y: The y coordinate of the position.
+        :param tolerance: The maximum distance of edges to the position.
+        :return: The closest element containing the position or None.
+        """
+        point = np.array((x, y))
+        candidates = self.vertex_grid.query(x, y)
+        if len(candidates) > 0:
+            distances = np.sum((self.positions[candidates] - point) ** 2,
+                               axis=1)
+            i = int(np.argmin(distances))
+            if distances[i] <= self.radius ** 2:
+                return self.vertices[candidates[i]]
+        candidates = self.edge_grid.query(x, y, tolerance)
+        if len(candidates) > 0:
+            segments = self.segments[candidates]
+            starts = segments[:, 0]
+            directions = segments[:, 1] - starts
+            lengths = np.sum(directions ** 2, axis=1)
+            factors = np.divide(np.sum((point - starts) * directions, axis=1),
+                                lengths, out=np.zeros_like(lengths),
+                                where=lengths > 0)
+            closest = starts + directions * np.clip(factors, 0, 1)[:, None]
+            distances = np.sum((closest - point) ** 2, axis=1)
+            i = int(np.argmin(distances))
+            if distances[i] <= tolerance ** 2:
+                return self.edges[candidates[i]]
+        return None
+
+    def get_center(self, element: GraphElement) -> Tuple[float, float]:
+        """
+        Return the center position of a drawn element.
+        """
+        if isinstance(element, Vertex):
+            return tuple(self.positions[self.element_indices[element]])
+        return tuple(self.segments[self.element_indices[element]].mean(axis=0))
+
+    def set_hovered(self, element: Union[GraphElement, None]) -> bool:
+        """
+        Highlight the hovered element.
+
+        :param element: The hovered element or None.
+        :return: Whether the hovered element changed.
+        """
+        if element is self.hovered:
+            return False
+        self.hovered = element
+        self._update_styles()
+        return True
+
+    def set_selected(self, element: Union[GraphElement, None]) -> bool:
+        """
+        Highlight the selected element.
+
+        :param element: The selected element or None.
+        :return: Whether the selected element changed.
+        """
+        if element is self.selected:
+            return False
+        self.selected = element
+        self._update_styles()
+        return True
+
+    def _update_styles(self) -> None:
+        """
+        Apply the highlights of the hovered and selected element to the
+        collections.
+        """
+        vertex_colors = self._vertex_colors.copy()
+        vertex_widths = self._vertex_widths.copy()
+        edge_colors = self._edge_colors.copy()
+        edge_widths = self._edge_widths.copy()
+        for element, color, width in ((self.selected, 'b', 5),
+                                      (self.hovered, 'r', 3)):
+            if element is None or element not in self.element_indices:
+                continue
+            i = self.element_indices[element]
+            if isinstance(element, Vertex):
+                vertex_colors[i] = to_rgba(color)
+                vertex_widths[i] = width
+            else:
+                edge_colors[i] = to_rgba(color)
+                edge_widths[i] = width
+        self.vertex_collection.set_edgecolors(vertex_colors)
+        self.vertex_collection.set_linewidths(vertex_widths)
+        self.edge_collection.set_colors(edge_colors)
+        self.edge_collection.set_linewidths(edge_widths)
+
+    def get_limits(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """
+        Return the x and y limits of the axes showing the whole graph.
+        """
+        if len(self.vertices) == 0:
+            return (-10, 10), (-10, 10)
+        low = self.positions.min(axis=0) - 2 * self.radius
+        high = self.positions.max(axis=0) + 2 * self.radius
+        return (low[0], high[0]), (low[1], high[1])
+
+
 def connection_points_between_circles(center1: Vec, center2: Vec,
                                       radius1: float, radius2: float
                                       ) -> Tuple[Vec, Vec]:
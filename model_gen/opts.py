@@ -5,7 +5,7 @@ options for Model Gen.
 
 import yaml
 import os
-from model_gen.utils import Singleton, get_logger
+from model_gen.utils import Singleton, get_logger, YamlLoader, YamlDumper
 from model_gen.exceptions import ModelGenInvalidValueError
 
 log = get_logger('model_gen.' + __name__)
@@ -29,7 +29,7 @@ class Opts(dict, metaclass=Singleton):
             this_dir = os.path.dirname(__file__)
             with open(os.path.join(this_dir, self.OPTS_FILE_PATH), 'r',
                       encoding='utf-8') as stream:
-                data = yaml.safe_load(stream)
+                data = yaml.load(stream, Loader=YamlLoader)
                 if not isinstance(data, dict):
                     log.error(f'The data in {self.OPTS_FILE_PATH} is malformed'
                               f' (is not a dict) and cannot be used.')
@@ -49,7 +49,7 @@ class Opts(dict, metaclass=Singleton):
                 this_dir = os.path.dirname(__file__)
                 file_path = os.path.join(this_dir, self.OPTS_FILE_PATH)
             with open(file_path, 'w', encoding='utf-8') as stream:
-                yaml.safe_dump(dict(self), stream)
+                yaml.dump(dict(self), stream, Dumper=YamlDumper)
         except IOError as e:
             log.error(f'Error writing Options: Cannot open file '
                       f'{self.OPTS_FILE_PATH} for writing.')
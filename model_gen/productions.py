@@ -3,14 +3,18 @@ import scipy.stats
 import numpy as np
 from math import pi, asin, atan, acos, sqrt, isnan, isinf
 from functools import partial, singledispatch
+from itertools import accumulate
+from timeit import default_timer as timer
 from typing import Iterable, Sized, Union, Tuple, Sequence, Dict, List, Any
 
-from model_gen.utils import Mapping, get_logger
+from model_gen.utils import Mapping, AliasTable, get_logger, \
+    compile_expression
 from model_gen.graph import Graph, GraphElement, Vertex, Edge, \
     get_max_generation, graph_is_consistent, copy_without_meta_elements, \
     get_min_max_points, get_positions, get_position, non_recursive_copy
 from model_gen.exceptions import ModelGenArgumentError, \
     ModelGenIncongruentGraphStateError
+from model_gen.context import RunContext
 from model_gen.geometry import Vec, angle, norm, perp_right, perp_left, \
     cross, rotate, normalize
 
@@ -154,6 +158,30 @@ class ProductionApplicationHierarchy:
         return self.map(result, new_source_level, target_level)
 
 
+class GraphDelta:
+    """
+    Describes the changes made to a host graph by applying a
+    production to it.
+
+    Added and changed elements are elements of the result graph,
+    removed elements are elements of the host graph. The mapping
+    `host_to_result` relates every element of the host graph to its
+    copy inside the result graph.
+    """
+
+    def __init__(self, added: List[GraphElement] = None,
+                 changed: List[GraphElement] = None,
+                 removed: List[GraphElement] = None,
+                 host_to_result: Mapping = None):
+        self.added: List[GraphElement] = added if added is not None else []
+        self.changed: List[GraphElement] = \
+            changed if changed is not None else []
+        self.removed: List[GraphElement] = \
+            removed if removed is not None else []
+        self.host_to_result: Mapping = \
+            host_to_result if host_to_result is not None else Mapping()
+
+
 class ProductionOption:
     """
     Saves a daughter graph and all information about the mapping
@@ -161,7 +189,7 @@ class ProductionOption:
     """
 
     def __init__(self, mother_graph: Graph, mapping: Mapping,
-                 daughter_graph: Graph, weight: int = 1,
+                 daughter_graph: Graph, weight: float = 1,
                  attr_requirements: Dict[GraphElement,
                                          Dict[str, GraphElement]]=None,
                  conditions: Dict[str, str]=None,
@@ -202,17 +230,32 @@ class ProductionOption:
                 self.to_remove.append(element)
         self.to_add = [element for element in daughter_elements if
                        element not in mapping.inverse]
+        self._compile_var_calc_instructions()
+        # Set when the grammar containing the option is compiled.
+        self.geometry: Union['OptionGeometry', None] = None
+
+    def _compile_var_calc_instructions(self) -> None:
         self.var_per_run = []
         self.var_per_application = []
         for name, instruction, eval_strategy in self.var_calc_instructions:
-            compiled_instr = compile(instruction, '<stdin>', 'eval')
+            compiled_instr = compile_expression(instruction)
             if eval_strategy == 'run':
                 self.var_per_run.append((name, compiled_instr))
             elif eval_strategy == 'application':
                 self.var_per_application.append((name, compiled_instr))
             else:
                 raise ValueError('Incorrect evaluation strategy specified.')
-        self.vars = {}
+
+    def __getstate__(self):
+        # Code objects can not be pickled, they are compiled again.
+        state = dict(self.__dict__)
+        del state['var_per_run']
+        del state['var_per_application']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_var_calc_instructions()
 
     def to_yaml(self) -> Iterable:
         """
@@ -351,43 +394,120 @@ class Production:
             Dict[str, Union[Vertex, Tuple[Vertex, Vertex]]] \
             = vectors
         self.priority = priority
-        self.total_weight = 0
         if conditions is None:
             conditions = {}
         self.conditions = conditions
-        for mapping in self.production_options:
-            self.total_weight += mapping.weight
-        self.mother_elem_sorted_by_x = sorted(
-            mother_graph.vertices,
-            key=lambda vertex: float(vertex.attr['x'])
+        self.weights: List[float] = [float(option.weight) for option
+                                     in self.production_options]
+        self.cumulative_weights: List[float] = list(accumulate(self.weights))
+        self.total_weight: float = (self.cumulative_weights[-1]
+                                    if self.cumulative_weights else 0)
+        self.option_table: Union[AliasTable, None] = (
+            AliasTable(self.weights) if self.total_weight > 0 else None
         )
-        self.mother_elem_sorted_by_y = sorted(
-            mother_graph.vertices,
-            key=lambda vertex: float(vertex.attr['y'])
+        self._mother_elem_sorted_by_x: Union[List[Vertex], None] = None
+        self._mother_elem_sorted_by_y: Union[List[Vertex], None] = None
+        # Set when the grammar containing the production is compiled.
+        self.search_plan = None
+        # If every option only uses the oldest matches, the others need
+        # not be searched for.
+        self.prefers_oldest: bool = len(self.production_options) > 0 and all(
+            option.conditions.get('generation', None) == 'oldest'
+            for option in self.production_options
         )
-        self.global_vars: Dict[str, Any] = {}
 
-    def match(self, host_graph: Graph) \
-            -> Iterable[Mapping]:
+    @property
+    def mother_elem_sorted_by_x(self) -> List[Vertex]:
+        """
+        The vertices of the mother graph sorted by their x-coordinate,
+        which are only sorted once they are needed for the geometric
+        ordering of matches.
+        """
+        if self._mother_elem_sorted_by_x is None:
+            self._mother_elem_sorted_by_x = sorted(
+                self.mother_graph.vertices,
+                key=lambda vertex: float(vertex.attr['x'])
+            )
+        return self._mother_elem_sorted_by_x
+
+    @property
+    def mother_elem_sorted_by_y(self) -> List[Vertex]:
+        """
+        The vertices of the mother graph sorted by their y-coordinate.
+        """
+        if self._mother_elem_sorted_by_y is None:
+            self._mother_elem_sorted_by_y = sorted(
+                self.mother_graph.vertices,
+                key=lambda vertex: float(vertex.attr['y'])
+            )
+        return self._mother_elem_sorted_by_y
+
+    def match(self, host_graph: Graph, max_results: int = None,
+              context: RunContext = None) -> Iterable[Mapping]:
         """
         Tries to match the production against a target Graph.
 
+        If all production options select the oldest match, only the
+        matches with the lowest average generation are returned.
+
         :param host_graph: The host graph against which the
                            production is matched.
+        :param max_results: If set, stop searching once this many
+            matches were found.
+        :param context: The context of the run, which provides the
+            variables for the match predicates.
         :return: All possible matching subgraphs of the target graph.
         """
+        if context is None:
+            context = RunContext()
+        eval_vars = context.eval_vars()
+        start_element = None
+        start_filter = None
+        if self.search_plan is not None:
+            start_element = self.search_plan.start_element
+            start_filter = self.search_plan.admits
         if ('.geometric_ordering' in self.conditions
-                and eval(self.conditions['.geometric_ordering'])):
+                and eval(compile_expression(
+                    self.conditions['.geometric_ordering']), None,
+                         dict(eval_vars))):
             return host_graph.match(self.mother_graph, eval_attrs=True,
                                     geometric_order=(
                                         self.mother_elem_sorted_by_x,
                                         self.mother_elem_sorted_by_y
-                                    ))
+                                    ),
+                                    eval_vars=eval_vars,
+                                    max_results=max_results,
+                                    oldest_only=self.prefers_oldest,
+                                    start_element=start_element,
+                                    start_filter=start_filter)
         return host_graph.match(self.mother_graph, eval_attrs=True,
-                                eval_vars=self.global_vars)
+                                eval_vars=eval_vars,
+                                max_results=max_results,
+                                oldest_only=self.prefers_oldest,
+                                start_element=start_element,
+                                start_filter=start_filter)
 
     def apply(self, host_graph: Graph,
-              map_mother_to_host: Mapping) -> Graph:
+              map_mother_to_host: Mapping,
+              option: ProductionOption = None,
+              context: RunContext = None) -> Graph:
+        """
+        Applies a production to a specific subgraph of the host graph and
+        returns the result graph.
+
+        See `apply_with_delta` for a description of the arguments.
+
+        :return: The graph resulting from applying the production.
+        """
+        result_graph, _ = self.apply_with_delta(host_graph, map_mother_to_host,
+                                                option, context)
+        return result_graph
+
+    def apply_with_delta(self, host_graph: Graph,
+                         map_mother_to_host: Mapping,
+                         option: ProductionOption = None,
+                         context: RunContext = None
+                         ) -> Tuple[Graph, 'GraphDelta']:
         """
         Applies a production to a specific subgraph of the host graph and
         returns the result graph.
@@ -400,7 +520,12 @@ class Production:
         :param host_graph: The graph to which the production is applied.
         :param map_mother_to_host: The specific subgraph of the host graph
         to which the production will be applied.
-        :return: The graph resulting from applying the production.
+        :param option: The production option to apply. If None an
+            option is selected randomly.
+        :param context: The context of the run, which provides the
+            variables, the random number generator and the profiler.
+        :return: The graph resulting from applying the production and
+            the changes made to the host graph to arrive at it.
         """
 
         def map_elements_to_be_removed(element, source_level, target_level,
@@ -411,21 +536,32 @@ class Production:
                 return None
 
         log.debug(f'Applying {self} to graph {id(host_graph)}.')
-        option = self.select_option()
+        if context is None:
+            context = RunContext()
+        profiler = context.profiler
+        if option is None:
+            option = self.select_option(context.option_tables.get(self),
+                                        context.rng)
+        if profiler is not None:
+            phase_start = timer()
         hierarchy = ProductionApplicationHierarchy(
             host_graph,
             map_mother_to_host,
             option
         )
+        if profiler is not None:
+            profiler.add_phase_time('copy', timer() - phase_start)
         result_graph = hierarchy.result_graph
-        to_add = {hierarchy.map(x, 'D', 'C') for x in option.to_add}
-        to_change = {hierarchy.map(x, 'D', 'R') for x in option.to_change}
-        to_remove = {hierarchy.map(x, 'M', 'R') for x in option.to_remove}
-        to_calc_attr = {(x, hierarchy.map(x, 'D', 'C'), None) for x in
-                        option.to_add}
-        to_calc_attr = to_calc_attr.union({
+        # Lists keep the order of the production option, so attributes
+        # are evaluated and elements added in the same order every run.
+        to_add = [hierarchy.map(x, 'D', 'C') for x in option.to_add]
+        to_change = [hierarchy.map(x, 'D', 'R') for x in option.to_change]
+        to_remove = [hierarchy.map(x, 'M', 'R') for x in option.to_remove]
+        to_calc_attr = [(x, hierarchy.map(x, 'D', 'C'), None) for x in
+                        option.to_add]
+        to_calc_attr.extend(
             (x, hierarchy.map(x, 'D', 'R'), hierarchy.map(x, 'D', 'H'))
-            for x in option.to_change})
+            for x in option.to_change)
         vectors = {}
         for vec_name, vec_info in self.vectors.items():
             if isinstance(vec_info, Vertex):
@@ -436,10 +572,13 @@ class Production:
         global_attr_reqs = {name: hierarchy.map(value, 'M', 'H')
                             for name, value
                             in option.attr_requirements.get('all', {}).items()}
-        local_eval_vars = {**global_attr_reqs, **vectors}
+        local_eval_vars = {**global_attr_reqs, **vectors,
+                           'random': context.rng}
         variables = evaluate_per_app_vars(option, local_eval_vars)
-        variables.update(option.vars)
+        variables.update(context.get_option_vars(option))
+        variables['random'] = context.rng
         new_generation = get_max_generation(map_mother_to_host.values()) + 1
+        placement = None
         # For edges which get reconnected to a different vertex in the daugter
         # graph, set the old connection to None in the result graph
         for M_edge, M_vertex in option.edge_conn_to_remove:
@@ -468,7 +607,13 @@ class Production:
                     #       or 'new_y' not in C_element.attr)
                     # and '.new_pos' not in C_element.attr
             ):
-                x, y = _calculate_new_position(C_element, option, hierarchy)
+                if profiler is not None:
+                    phase_start = timer()
+                if placement is None:
+                    placement = VertexPlacement(option, hierarchy)
+                x, y = placement.position(C_element)
+                if profiler is not None:
+                    profiler.add_phase_time('positions', timer() - phase_start)
                 if 'new_x' not in C_element.attr:
                     C_element.attr['x'] = x
                 if 'new_y' not in C_element.attr:
@@ -487,6 +632,8 @@ class Production:
             )
         # Now calculate the new attributes for all elements that where part of
         # the daughter graph.
+        if profiler is not None:
+            phase_start = timer()
         for D_element, target_element, old_element in to_calc_attr:
             attr_requirements = {}
             if D_element in option.attr_requirements:
@@ -508,7 +655,8 @@ class Production:
                     # for name, value in kwargs.items():
                     #     locals()[name] = value
                     eval_vars = {**kwargs, **global_attr_reqs, 'old': old}
-                    return eval(attr_func_text, None, eval_vars)
+                    return eval(compile_expression(attr_func_text), None,
+                                eval_vars)
 
                 if attr_name == '.new_pos':
                     pos = attr_func(old_element, self_=target_element,
@@ -534,25 +682,72 @@ class Production:
                                                            **vectors,
                                                            **variables)
 
+        if profiler is not None:
+            profiler.add_phase_time('attributes', timer() - phase_start)
+            phase_start = timer()
         log.debug(f'Applied {self} with result graph {id(result_graph)}.')
         if not graph_is_consistent(result_graph):
             raise ModelGenIncongruentGraphStateError
-        return result_graph
+        if profiler is not None:
+            profiler.add_phase_time('consistency', timer() - phase_start)
+        delta = GraphDelta(
+            added=list(to_add),
+            changed=list(to_change),
+            removed=[hierarchy.map(x, 'M', 'H') for x in option.to_remove],
+            host_to_result=hierarchy.host_to_result
+        )
+        return result_graph, delta
 
-    def select_option(self) -> ProductionOption:
+    def select_option(self, option_table: AliasTable = None,
+                      rng=random) -> ProductionOption:
         """
         Randomly select a mapping and daughter graph from the list of possible
         mappings.
 
-        :return: A tuple containing the mapping between mother and daughter
-                 graphs and the corresponding daughter graph.
+        :param option_table: An alias table overriding the weights of
+            the production options, as returned by
+            `build_option_table`. If None the weights of the options
+            themselves are used.
+        :param rng: The random number generator to draw from.
+        :return: The selected production option.
+        """
+        if option_table is None:
+            option_table = self.option_table
+        if option_table is None:
+            raise ValueError('The production has no option with a '
+                             'positive weight.')
+        return self.production_options[option_table.sample(rng)]
+
+    def build_option_table(self,
+                           weights: Union[Sequence[float],
+                                          Dict[int, float]] = None
+                           ) -> AliasTable:
         """
-        rand_num = random.randint(0, self.total_weight-1)
-        for mapping in self.production_options:
-            if rand_num < mapping.weight:
-                return mapping
-            rand_num -= mapping.weight
-        raise ValueError
+        Build an alias table over the production options using
+        different weights than the ones saved in the options.
+
+        This allows overriding the weights for a single run without
+        rebuilding the production.
+
+        :param weights: Either a weight for every production option
+            in order, or a dict mapping the index of some production
+            options to their new weight. Options not contained in the
+            dict keep their own weight.
+        :return: An alias table to pass to `select_option`.
+        """
+        if weights is None:
+            return self.option_table
+        if isinstance(weights, dict):
+            new_weights = list(self.weights)
+            for index, weight in weights.items():
+                new_weights[int(index)] = float(weight)
+        else:
+            new_weights = [float(weight) for weight in weights]
+        if len(new_weights) != len(self.production_options):
+            log.error(f'Expected {len(self.production_options)} weights but '
+                      f'got {len(new_weights)}.')
+            raise ModelGenArgumentError
+        return AliasTable(new_weights)
 
     def to_yaml(self) -> Iterable:
         """
@@ -611,170 +806,195 @@ class Production:
         return result
 
 
-def _calculate_new_position(new_element, option, hierarchy) -> (float, float):
+class OptionGeometry:
     """
-    Calculate the position of a newly added element dependend on the
-    barycenter of all mapped daughter elements.
+    The positions within the mother and daughter graph of a production
+    option, which are needed to place the vertices added by the option.
 
-    :param new_element: The element whose new position is to be
-        calculated.
-    :param option: The matched production option.
-    :param hierarchy: The production application hierarchy of this
-        application of the production option.
-    :return:
+    These do not depend on the host graph, so they are calculated only
+    once when the grammar is compiled.
     """
-    daughter_barycenter = _calculate_daughter_barycenter(option)
-    mother_positions = get_positions(option.mother_graph.vertices)
-    mother_barycenter = _calculate_barycenter(mother_positions)
-    mother_deviations = np.std(mother_positions, 0)
-    host_vertices = hierarchy.map_sequence(option.mother_graph.vertices,
-                                           'M', 'H')
-    host_positions = get_positions(host_vertices)
-    host_barycenter = _calculate_host_barycenter(option, hierarchy)
-    daughter_vertices = option.daughter_graph.vertices
-    daughter_positions = get_positions(daughter_vertices)
-    daughter_deviations = np.std(daughter_positions, 0)
-    directed_m_edge = None
-    for edge in option.mother_graph.edges:
-        if edge.attr.get('.directed', False):
-            directed_m_edge = edge
-            break
-    if directed_m_edge is not None:
-        directed_h_edge = hierarchy.map(directed_m_edge, 'M', 'H')
-        mother_vec = Vec(directed_m_edge.vertex1, directed_m_edge.vertex2)
-        host_vec = Vec(directed_h_edge.vertex1, directed_h_edge.vertex2)
-        mother_angle = np.arctan2(mother_vec.y, mother_vec.x)
-        host_angle = np.arctan2(host_vec.y, host_vec.x)
-    else:
-        if mother_deviations[0] == 0:
-            mother_angle = pi/2
+
+    def __init__(self, option: ProductionOption):
+        """
+        :param option: The production option.
+        """
+        self.daughter_barycenter: Tuple[float, float] = \
+            _calculate_daughter_barycenter(option)
+        self.mother_positions: List[Tuple[float, float]] = get_positions(
+            option.mother_graph.vertices
+        )
+        self.mother_barycenter: Tuple[float, float] = _calculate_barycenter(
+            self.mother_positions
+        )
+        self.daughter_positions: List[Tuple[float, float]] = get_positions(
+            option.daughter_graph.vertices
+        )
+        self.mother_extent: Tuple[float, float] = _calculate_extent(
+            self.mother_positions
+        )
+        self.daughter_extent: Tuple[float, float] = _calculate_extent(
+            self.daughter_positions
+        )
+        self.directed_edge: Union[Edge, None] = None
+        for edge in option.mother_graph.edges:
+            if edge.attr.get('.directed', False):
+                self.directed_edge = edge
+                break
+        if self.directed_edge is not None:
+            mother_vec = Vec(self.directed_edge.vertex1,
+                             self.directed_edge.vertex2)
+            self.mother_angle: float = np.arctan2(mother_vec.y, mother_vec.x)
         else:
-            mother_verticality = mother_deviations[1] / mother_deviations[0]
-            if mother_verticality > 2:
-                mother_slope, _ = _get_gradient(
-                    [(y, x) for x, y in mother_positions]
-                )
-                if mother_slope == 0:
-                    mother_slope = float('inf')
-                else:
-                    mother_slope = 1 / mother_slope
-                    mother_slope = normalize(Vec(x1=1, y1=mother_slope)).y
-            else:
-                mother_slope, _ = _get_gradient(mother_positions)
-                mother_slope = normalize(Vec(x1=1, y1=mother_slope)).y
-            if isinf(mother_slope):
-                mother_angle = pi / 2
-            else:
-                mother_angle = np.arcsin(mother_slope)
-        # if daughter_deviations[0] == 0:
-        #     daughter_angle = pi/2
-        # else:
-        #     daughter_verticality = daughter_deviations[1] / daughter_deviations[0]
-        #     if daughter_verticality > 2:
-        #         daughter_slope, _ = _get_gradient(
-        #             [(y, x) for x,y in daughter_positions]
-        #         )
-        #         if daughter_slope == 0:
-        #             daughter_slope = float('inf')
-        #         else:
-        #             daughter_slope = 1 / daughter_slope
-        #             daughter_slope = normalize(Vec(x1=1, y1=daughter_slope)).y
-        #     else:
-        #         daughter_slope, _ = _get_gradient(daughter_positions)
-        #         daughter_slope = normalize(Vec(x1=1, y1=daughter_slope)).y
-        #     if isinf(daughter_slope):
-        #         daughter_angle = pi/2
-        #     else:
-        #         daughter_angle = np.arcsin(daughter_slope)
-        host_deviations = np.std(host_positions, 0)
-        if host_deviations[0] == 0:
-            host_angle = pi/2
+            self.mother_angle: float = _get_angle(self.mother_positions)
+
+
+class VertexPlacement:
+    """
+    Places the vertices added by a single application of a production
+    option relative to the matched host vertices.
+
+    The rotation and scale between the mother graph and the matched
+    part of the host graph are the same for all new vertices, so they
+    are calculated once per application.
+    """
+
+    def __init__(self, option: ProductionOption,
+                 hierarchy: ProductionApplicationHierarchy):
+        """
+        :param option: The matched production option. If its geometry
+            was not calculated while compiling the grammar, it is
+            calculated here.
+        :param hierarchy: The production application hierarchy of this
+            application of the production option.
+        """
+        geometry = option.geometry
+        if geometry is None:
+            geometry = OptionGeometry(option)
+        self.geometry: OptionGeometry = geometry
+        host_vertices = hierarchy.map_sequence(option.mother_graph.vertices,
+                                               'M', 'H')
+        host_positions = get_positions(host_vertices)
+        self.host_barycenter: Tuple[float, float] = \
+            _calculate_host_barycenter(option, hierarchy)
+        if geometry.directed_edge is not None:
+            directed_h_edge = hierarchy.map(geometry.directed_edge, 'M', 'H')
+            host_vec = Vec(directed_h_edge.vertex1, directed_h_edge.vertex2)
+            host_angle = np.arctan2(host_vec.y, host_vec.x)
         else:
-            host_verticality = host_deviations[1] / host_deviations[0]
-            if host_verticality > 2:
-                host_slope, _ = _get_gradient(
-                    [(y, x) for x, y in host_positions]
+            host_angle = _get_angle(host_positions)
+        self.delta_angle: float = host_angle - geometry.mother_angle
+        self.daughter_center: Vec = Vec(x1=geometry.daughter_barycenter[0],
+                                        y1=geometry.daughter_barycenter[1])
+        if self.delta_angle != 0:
+            daughter_rot_positions = [
+                (vec.x, vec.y) for vec in (
+                    rotate(Vec(x1=x, y1=y), self.delta_angle,
+                           self.daughter_center)
+                    for x, y in geometry.daughter_positions
                 )
-                if host_slope == 0:
-                    host_slope = float('inf')
-                else:
-                    host_slope = 1 / host_slope
-                    host_slope = normalize(Vec(x1=1, y1=host_slope)).y
-            else:
-                host_slope, _ = _get_gradient(host_positions)
-                host_slope = normalize(Vec(x1=1, y1=host_slope)).y
-            if isinf(host_slope):
-                host_angle = pi/2
-            else:
-                host_angle = np.arcsin(host_slope)
-    delta_angle = host_angle - mother_angle
-    x,y = get_position(new_element)
-    if delta_angle != 0:
-        new_pos = rotate(Vec(x1=x, y1=y), delta_angle,
-                         Vec(x1=daughter_barycenter[0], y1=daughter_barycenter[1]))
-        daughter_rot_vecs = [
-            rotate(Vec(x1=x, y1=y),
-                   delta_angle,
-                   Vec(x1=daughter_barycenter[0], y1=daughter_barycenter[1]))
-            for x,y in daughter_positions
-        ]
-        daughter_rot_positions = [(vec.x,vec.y) for vec in daughter_rot_vecs]
-        mother_rot_vecs = [
-            rotate(Vec(x1=x, y1=y),
-                   delta_angle,
-                   Vec(x1=mother_barycenter[0], y1=mother_barycenter[1]))
-            for x, y in mother_positions
-        ]
-        mother_rot_positions = [(vec.x, vec.y) for vec in mother_rot_vecs]
+            ]
+            mother_center = Vec(x1=geometry.mother_barycenter[0],
+                                y1=geometry.mother_barycenter[1])
+            mother_rot_positions = [
+                (vec.x, vec.y) for vec in (
+                    rotate(Vec(x1=x, y1=y), self.delta_angle, mother_center)
+                    for x, y in geometry.mother_positions
+                )
+            ]
+        else:
+            daughter_rot_positions = geometry.daughter_positions
+            mother_rot_positions = geometry.mother_positions
+        mother_rot_extent = _calculate_extent(mother_rot_positions)
+        daughter_rot_extent = _calculate_extent(daughter_rot_positions)
+        host_extent = _calculate_extent(host_positions)
+        self.x_ratio: float = 1
+        self.y_ratio: float = 1
+        if not daughter_rot_extent[0] == 0:
+            x_mother_to_daughter = (mother_rot_extent[0]
+                                    / daughter_rot_extent[0])
+            if x_mother_to_daughter == 0:
+                x_mother_to_daughter = 1
+            if host_extent[0] != 0:
+                self.x_ratio = ((host_extent[0] / daughter_rot_extent[0])
+                                / x_mother_to_daughter)
+        if not daughter_rot_extent[1] == 0:
+            y_mother_to_daughter = (mother_rot_extent[1]
+                                    / daughter_rot_extent[1])
+            if y_mother_to_daughter == 0:
+                y_mother_to_daughter = 1
+            if host_extent[1] != 0:
+                self.y_ratio = ((host_extent[1] / daughter_rot_extent[1])
+                                / y_mother_to_daughter)
+        log.debug(f'   Angles (in x*pi): '
+                  f'H.a.: {host_angle / pi}, '
+                  f'M.a.: {geometry.mother_angle / pi}, '
+                  f'delta angle: {self.delta_angle / pi}.')
+        log.debug(f'   Position Calculation: '
+                  f'H.B.: {self.host_barycenter}, '
+                  f'M.B.: {geometry.mother_barycenter}, '
+                  f'D.B.: {geometry.daughter_barycenter}.')
+        log.debug(f'   Extents: '
+                  f'H.E.: {host_extent}, '
+                  f'M.E.: {geometry.mother_extent}, '
+                  f'D.E.: {geometry.daughter_extent}.')
+        log.debug(f'   Rotated Extents: '
+                  f'H.E.: {host_extent}, '
+                  f'M.E.: {mother_rot_extent}, '
+                  f'D.E.: {daughter_rot_extent}.')
+
+    def position(self, new_element: Vertex) -> Tuple[float, float]:
+        """
+        Calculate the position of a newly added vertex dependent on the
+        barycenter of all mapped daughter elements.
+
+        :param new_element: The vertex whose new position is to be
+            calculated.
+        :return: The x- and y-coordinate of the new position.
+        """
+        x, y = get_position(new_element)
+        if self.delta_angle != 0:
+            new_pos = rotate(Vec(x1=x, y1=y), self.delta_angle,
+                             self.daughter_center)
+        else:
+            new_pos = Vec(x1=x, y1=y)
+        dx = new_pos.x - self.geometry.daughter_barycenter[0]
+        dy = new_pos.y - self.geometry.daughter_barycenter[1]
+        new_x = self.host_barycenter[0] + dx * self.x_ratio
+        new_y = self.host_barycenter[1] + dy * self.y_ratio
+        log.debug(f'   Old position: {(x, y)}, delta: {(dx, dy)},'
+                  f' ratios: {(self.x_ratio, self.y_ratio)},'
+                  f' new position: {(new_x, new_y)}.')
+        return new_x, new_y
+
+
+def _get_angle(positions: List[Tuple[float, float]]) -> float:
+    """
+    Return the angle of the gradient of a list of positions.
+
+    If the positions are spread mostly vertically, the gradient is
+    calculated with the axes swapped to avoid an unstable slope.
+
+    :param positions: A list of positions.
+    :return: The angle between the gradient and the x-axis.
+    """
+    deviations = np.std(positions, 0)
+    if deviations[0] == 0:
+        return pi / 2
+    verticality = deviations[1] / deviations[0]
+    if verticality > 2:
+        slope, _ = _get_gradient([(y, x) for x, y in positions])
+        if slope == 0:
+            slope = float('inf')
+        else:
+            slope = 1 / slope
+            slope = normalize(Vec(x1=1, y1=slope)).y
     else:
-        daughter_rot_positions = daughter_positions
-        mother_rot_positions = mother_positions
-        new_pos = Vec(x1=x, y1=y)
-    log.debug(f'   Angles (in x*pi): '
-              f'H.a.: {host_angle / pi}, '
-              f'M.a.: {mother_angle / pi}, '
-              f'delta angle: {delta_angle / pi}. '
-              f'new position: {new_pos}.')
-
-    mother_extent = _calculate_extent(mother_positions)
-    daughter_extent = _calculate_extent(daughter_positions)
-    mother_rot_extent = _calculate_extent(mother_rot_positions)
-    daughter_rot_extent = _calculate_extent(daughter_rot_positions)
-    host_extent = _calculate_extent(host_positions)
-    x_ratio = 1
-    y_ratio = 1
-    if not daughter_rot_extent[0] == 0:
-        x_mother_to_daughter = (mother_rot_extent[0] / daughter_rot_extent[0])
-        if x_mother_to_daughter == 0:
-            x_mother_to_daughter = 1
-        if host_extent[0] != 0:
-            x_ratio = (host_extent[0] / daughter_rot_extent[0]) / x_mother_to_daughter
-    if not daughter_rot_extent[1] == 0:
-        y_mother_to_daughter = (mother_rot_extent[1] / daughter_rot_extent[1])
-        if y_mother_to_daughter == 0:
-            y_mother_to_daughter = 1
-        if host_extent[1] != 0:
-            y_ratio = (host_extent[1] / daughter_rot_extent[1]) / y_mother_to_daughter
-    dx = new_pos.x - daughter_barycenter[0]
-    dy = new_pos.y - daughter_barycenter[1]
-    new_x = host_barycenter[0] + dx * x_ratio
-    new_y = host_barycenter[1] + dy * y_ratio
-    log.debug(f'   Position Calculation: '
-              f'H.B.: {host_barycenter}, '
-              f'M.B.: {mother_barycenter}, '
-              f'D.B.: {daughter_barycenter}.')
-    log.debug(f'   Extents: '
-              f'H.E.: {host_extent}, '
-              f'M.E.: {mother_extent}, '
-              f'D.E.: {daughter_extent}.')
-    log.debug(f'   Rotated Extents: '
-              f'H.E.: {host_extent}, '
-              f'M.E.: {mother_rot_extent}, '
-              f'D.E.: {daughter_rot_extent}.')
-    log.debug(f'   Old position: {(x, y)}, delta: {(dx, dy)},'
-              f' ratios: {(x_ratio, y_ratio)},'
-              f' new position: {(new_x, new_y)}.')
-    return new_x, new_y
+        slope, _ = _get_gradient(positions)
+        slope = normalize(Vec(x1=1, y1=slope)).y
+    if isinf(slope):
+        return pi / 2
+    return np.arcsin(slope)
 
 
 def _calculate_daughter_barycenter(option: ProductionOption) -> (float, float):
@@ -939,11 +1159,9 @@ def _get_gradient(positions: List[Tuple[float, float]]) -> Tuple[float, float]:
     :return: A tuple containing slope and intercept of the gradient of the
         elements.
     """
-    if len(positions) < 3:
-        arguments = ([x[0] for x in positions], [x[1] for x in positions])
-    else:
-        arguments = (positions,)
-    slope, intercept, _, _, _ = scipy.stats.linregress(*arguments)
+    slope, intercept, _, _, _ = scipy.stats.linregress(
+        [x[0] for x in positions], [x[1] for x in positions]
+    )
     return slope, intercept
 
 
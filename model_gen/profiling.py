@@ -0,0 +1,163 @@
+"""
+This file contains the profiler used to collect timing information
+during runs of a grammar.
+"""
+
+import json
+from timeit import default_timer as timer
+from typing import Dict, List, Any
+
+from model_gen.utils import get_logger
+
+log = get_logger('model_gen.' + __name__)
+
+
+class ProductionProfile:
+    """
+    Collects the statistics of a single production during a run.
+    """
+
+    def __init__(self):
+        self.match_attempts: int = 0
+        self.match_skips: int = 0
+        self.match_time: float = 0.0
+        self.matches_found: int = 0
+        self.applications: int = 0
+        self.apply_time: float = 0.0
+        self.elements_added: int = 0
+        self.elements_removed: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the statistics as a dict fit for json export.
+
+        :return: A dict containing all statistics.
+        """
+        return dict(self.__dict__)
+
+
+class RunProfiler:
+    """
+    Collects timing information while a grammar is applied.
+
+    The grammar calls the `record_*` methods during the run. Call
+    `report` afterwards to get the collected data or `save` to write
+    it to a json file.
+
+    Phases are parts of applying a production which are interesting
+    on their own, e.g. copying the host graph, calculating the
+    positions of new vertices or checking the consistency of the
+    result.
+    """
+
+    def __init__(self):
+        self.start_time: float = timer()
+        self.productions: Dict[str, ProductionProfile] = {}
+        self.phases: Dict[str, float] = {}
+        self.steps: List[Dict[str, Any]] = []
+
+    def production(self, name: str) -> ProductionProfile:
+        """
+        Return the profile of a production, creating it if necessary.
+
+        :param name: The name of the production.
+        :return: The profile of the production.
+        """
+        profile = self.productions.get(name)
+        if profile is None:
+            profile = ProductionProfile()
+            self.productions[name] = profile
+        return profile
+
+    def record_match(self, name: str, duration: float,
+                     num_matches: int) -> None:
+        """
+        Record a single attempt to match a production.
+
+        :param name: The name of the matched production.
+        :param duration: The time the matching took in seconds.
+        :param num_matches: The number of matches found.
+        """
+        profile = self.production(name)
+        profile.match_attempts += 1
+        profile.match_time += duration
+        profile.matches_found += num_matches
+
+    def record_skip(self, name: str) -> None:
+        """
+        Record that matching a production was skipped, because it is
+        known to not match.
+
+        :param name: The name of the skipped production.
+        """
+        self.production(name).match_skips += 1
+
+    def record_application(self, name: str, duration: float,
+                           elements_added: int,
+                           elements_removed: int) -> None:
+        """
+        Record a single application of a production.
+
+        :param name: The name of the applied production.
+        :param duration: The time the application took in seconds.
+        :param elements_added: The number of elements added.
+        :param elements_removed: The number of elements removed.
+        """
+        profile = self.production(name)
+        profile.applications += 1
+        profile.apply_time += duration
+        profile.elements_added += elements_added
+        profile.elements_removed += elements_removed
+
+    def add_phase_time(self, phase: str, duration: float) -> None:
+        """
+        Add time spent in a phase of applying a production.
+
+        :param phase: The name of the phase.
+        :param duration: The time spent in seconds.
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def record_step(self, step: int, production_name: str,
+                    graph_size: int, duration: float) -> None:
+        """
+        Record a finished derivation step.
+
+        :param step: The number of the step.
+        :param production_name: The name of the applied production.
+        :param graph_size: The number of elements of the result graph.
+        :param duration: The time the whole step took in seconds.
+        """
+        self.steps.append({
+            'step': step,
+            'production': production_name,
+            'graph_size': graph_size,
+            'time': duration,
+        })
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return all collected data as a dict fit for json export.
+
+        :return: A dict containing the profile of the run.
+        """
+        return {
+            'total_time': timer() - self.start_time,
+            'productions': {name: profile.to_dict() for name, profile
+                            in self.productions.items()},
+            'phases': dict(self.phases),
+            'steps': list(self.steps),
+        }
+
+    def save(self, file_path: str) -> None:
+        """
+        Write the report of the run into a json file.
+
+        :param file_path: Path to the file.
+        """
+        try:
+            with open(file_path, 'w', encoding='utf-8') as stream:
+                json.dump(self.report(), stream, indent=2)
+        except IOError as e:
+            log.error(f'Cannot write the run profile to »{file_path}«.')
+            raise e
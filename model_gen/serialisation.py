@@ -6,15 +6,24 @@ Currently it only contains the functions for newly added classes, further
 functions await a refactoring.
 """
 
-from functools import singledispatch
-from typing import Dict
-from model_gen.grammar import GrammarInfo
+import re
+import yaml
+from functools import singledispatch, partial
+from typing import Dict, Iterable, Union, Any
+from model_gen.grammar import GrammarInfo, LazyGraphMapping
 from model_gen.graph import Graph
 from model_gen.productions import Production
 from model_gen.opts import Opts
+from model_gen.binary import BINARY_EXTENSION, save_binary, load_binary
+from model_gen.utils import get_logger, YamlLoader, YamlDumper
+from model_gen.exceptions import ModelGenInvalidValueError
 
 
 opts = Opts()
+log = get_logger('model_gen.' + __name__)
+
+_DOCUMENT_START = re.compile(rb'^---(?=[ \t\r\n]|$)', re.MULTILINE)
+"""Matches the start of every yaml document in a stream."""
 
 
 # noinspection PyUnusedLocal
@@ -46,13 +55,21 @@ def from_yaml(cls, data):
 
 @to_yaml.register(GrammarInfo)
 def grammar_info_to_yaml(grammar_info: GrammarInfo) -> Dict:
+    result = _grammar_info_header_to_yaml(grammar_info)
+    result['result_graphs'] = {name: graph.to_yaml() for name, graph in
+                               grammar_info.result_graphs.items()}
+    return result
+
+
+def _grammar_info_header_to_yaml(grammar_info: GrammarInfo) -> Dict:
+    """
+    Serialise everything of a grammar info except the result graphs.
+    """
     result = {
         'host_graphs': {name: graph.to_yaml() for name, graph in
                         grammar_info.host_graphs.items()},
         'productions': {name: prod.to_yaml() for name, prod in
                         grammar_info.productions.items()},
-        'result_graphs': {name: graph.to_yaml() for name, graph in
-                          grammar_info.result_graphs.items()},
         'global_vars': grammar_info.global_vars,
         'options': grammar_info.options,
         'extra': grammar_info.extra,
@@ -60,24 +77,158 @@ def grammar_info_to_yaml(grammar_info: GrammarInfo) -> Dict:
             'preamble': grammar_info.svg_preamble
         }
     }
+    if grammar_info.subgrammars:
+        result['subgrammars'] = grammar_info.subgrammars
     result['extra']['file_version'] = opts['yaml']['file_version']
     return result
 
 
 @from_yaml.register(GrammarInfo)
 def grammar_info_from_yaml(_: GrammarInfo, data: Dict) -> GrammarInfo:
-    result = GrammarInfo()
+    return _grammar_info_from_yaml(data)
 
+
+def _grammar_info_from_yaml(data: Dict) -> GrammarInfo:
+    """
+    Deserialise a grammar info. The host and result graphs are only
+    deserialised once they are accessed.
+    """
     mapping = {}
-    result.host_graphs = {name: Graph.from_yaml(graph_data, mapping)
-                          for name, graph_data in data['host_graphs'].items()}
+    result = GrammarInfo()
+    result.host_graphs = _lazy_graphs(data['host_graphs'])
     result.productions = {name: Production.from_yaml(prod_data, mapping)
                           for name, prod_data in data['productions'].items()}
-    result.result_graphs = {name: Graph.from_yaml(graph_data, mapping)
-                            for name, graph_data
-                            in data['result_graphs'].items()}
+    result.result_graphs = _lazy_graphs(data.get('result_graphs', {}))
     result.global_vars = data.get('global_vars', {})
+    result.subgrammars = data.get('subgrammars', [])
     result.options = data.get('options', {})
     result.extra = data.get('extra', {})
     result.svg_preamble = data.get('svg', {}).get('preamble', {})
     return result
+
+
+def _lazy_graphs(graphs_data: Dict[str, Any]) -> LazyGraphMapping:
+    # Every graph gets a mapping of its own, so a loader only refers to
+    # the data of its graph, see `LazyGraphMapping.loader`.
+    return LazyGraphMapping({
+        name: partial(Graph.from_yaml, graph_data, {})
+        for name, graph_data in graphs_data.items()
+    })
+
+
+def _load_result_graph(document_data: bytes, name: str,
+                       file_path: str) -> Graph:
+    """
+    Deserialise a result graph from its document in a grammar file.
+    """
+    document = yaml.load(document_data, Loader=YamlLoader)
+    if not isinstance(document, dict) or document.get('name', None) != name:
+        log.error(f'The result graph {name} is missing from its position '
+                  f'in the grammar file »{file_path}«.')
+        raise ModelGenInvalidValueError
+    return Graph.from_yaml(document['graph'], {})
+
+
+def save_grammar_info(grammar_info: GrammarInfo, file_path: str) -> None:
+    """
+    Write a grammar info into a yaml file, or into a binary file if
+    the path ends in `.npz`.
+
+    The yaml file is a stream of yaml documents. The first one contains
+    everything but the result graphs and lists their names under
+    `result_graph_names`, each result graph follows in a document of
+    its own. The result graphs are serialised and written one at a
+    time, so the file is never held in memory as a whole.
+
+    :param grammar_info: The grammar info to save.
+    :param file_path: Path to the file.
+    """
+    if file_path.endswith(BINARY_EXTENSION):
+        save_binary(grammar_info, file_path)
+        return
+    header = _grammar_info_header_to_yaml(grammar_info)
+    header['result_graph_names'] = list(grammar_info.result_graphs.keys())
+
+    def documents():
+        yield header
+        for name, graph in grammar_info.result_graphs.items():
+            yield {'name': name, 'graph': graph.to_yaml()}
+
+    try:
+        with open(file_path, 'w', encoding='utf-8') as stream:
+            yaml.dump_all(documents(), stream, Dumper=YamlDumper)
+    except IOError as e:
+        log.error(f'Cannot write the grammar file »{file_path}«.')
+        raise e
+
+
+def load_grammar_info(file_path: str,
+                      result_graphs: Union[bool, Iterable[str]] = True
+                      ) -> GrammarInfo:
+    """
+    Read a grammar info from a yaml file, or from a binary file if the
+    path ends in `.npz`.
+
+    Both yaml files written by `save_grammar_info` and files consisting
+    of a single document are supported. Only the productions are
+    deserialised right away, the host and result graphs are
+    deserialised once they are accessed. In the former files even the
+    documents of the result graphs are only parsed then, so reading a
+    file takes about the same time no matter how many result graphs it
+    contains.
+
+    :param file_path: Path to the file.
+    :param result_graphs: Which result graphs to load. True to load all
+        of them, False to load none or the names of those to load.
+    :return: The grammar info saved in the file.
+    """
+    if file_path.endswith(BINARY_EXTENSION):
+        result = load_binary(file_path, result_graphs)
+        if not isinstance(result, GrammarInfo):
+            log.error(f'The file »{file_path}« does not contain a grammar.')
+            raise ModelGenInvalidValueError
+        return result
+    try:
+        with open(file_path, 'rb') as stream:
+            content = stream.read()
+    except IOError as e:
+        log.error(f'Cannot read the grammar file »{file_path}«.')
+        raise e
+    bounds = [0] + [match.start() for match
+                    in _DOCUMENT_START.finditer(content)
+                    if match.start() > 0] + [len(content)]
+    header = yaml.load(content[bounds[0]:bounds[1]], Loader=YamlLoader)
+    if not isinstance(header, dict):
+        log.error(f'The grammar file »{file_path}« does not start '
+                  f'with a dict.')
+        raise ModelGenInvalidValueError
+    if 'result_graph_names' not in header:
+        names = list(header.get('result_graphs', {}).keys())
+    else:
+        names = header['result_graph_names']
+    if result_graphs is True:
+        wanted = set(names)
+    elif result_graphs is False:
+        wanted = set()
+    else:
+        wanted = set(result_graphs)
+    if 'result_graph_names' not in header:
+        header['result_graphs'] = {
+            name: graph_data for name, graph_data
+            in header.get('result_graphs', {}).items()
+            if name in wanted
+        }
+        return from_yaml(GrammarInfo(), header)
+    result = _grammar_info_from_yaml(header)
+    documents = len(bounds) - 2
+    if documents < len(names):
+        log.warning(f'The grammar file »{file_path}« lacks the result '
+                    f'graphs {names[documents:]}.')
+    for index, name in enumerate(names[:documents]):
+        if name in wanted:
+            result.result_graphs.set_loader(name, partial(
+                _load_result_graph, content[bounds[index + 1]:
+                                            bounds[index + 2]],
+                name, file_path
+            ))
+    return result
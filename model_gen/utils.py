@@ -1,9 +1,19 @@
+import functools
 import random
+import itertools
 import logging
 import logging.config
 import yaml
 import os
-from typing import Iterable, Sized
+from types import CodeType
+from typing import Iterable, Sized, Sequence, List, Any
+from model_gen.exceptions import ModelGenArgumentError
+
+# The libyaml bindings are much faster, but are not always available.
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
 
 logging_configured = False
 
@@ -33,6 +43,9 @@ class Bidict(dict):
             del self.inverse[self[key]]
         super(Bidict, self).__delitem__(key)
 
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
 
 class UniqueBidict(dict):
     """
@@ -52,6 +65,11 @@ class UniqueBidict(dict):
         self.inverse.pop(self[key])
         super().__delitem__(key)
 
+    def __reduce__(self):
+        # The items have to be restored through __init__, since
+        # __setitem__ relies on the inverse being present already.
+        return self.__class__, (dict(self),)
+
 
 class Mapping(UniqueBidict):
     """
@@ -123,16 +141,103 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-def randomly(objects: Sized and Iterable):
+class AliasTable:
+    """
+    Samples indices from a discrete, weighted distribution in constant
+    time using Walker's alias method.
+
+    Building the table takes linear time in the number of weights,
+    every draw afterwards needs a single random number.
+    """
+
+    def __init__(self, weights: Sequence[float]):
+        weights = [float(weight) for weight in weights]
+        if len(weights) == 0:
+            raise ModelGenArgumentError('Cannot build an alias table '
+                                        'without weights.')
+        if any(weight < 0 for weight in weights):
+            raise ModelGenArgumentError('Weights must not be negative.')
+        total = sum(weights)
+        if total <= 0:
+            raise ModelGenArgumentError('The sum of all weights must be '
+                                        'positive.')
+        size = len(weights)
+        self.weights: List[float] = weights
+        self.probabilities: List[float] = [1.0] * size
+        self.aliases: List[int] = list(range(size))
+        scaled = [weight * size / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever remains is only off by rounding errors and always
+        # keeps its own index.
+        for index in itertools.chain(small, large):
+            self.probabilities[index] = 1.0
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def sample(self, rng=random) -> int:
+        """
+        Draw a single index according to the weights of the table.
+
+        :param rng: The random number generator to use, anything
+            providing a `random()` method. Defaults to the `random`
+            module.
+        :return: The drawn index.
+        """
+        value = rng.random() * len(self.probabilities)
+        index = int(value)
+        if value - index < self.probabilities[index]:
+            return index
+        return self.aliases[index]
+
+
+EXPRESSION_CACHE_SIZE = 8192
+"""The number of compiled expressions kept by `compile_expression`."""
+
+
+def compile_expression(expression: Any) -> Any:
+    """
+    Return the compiled code of an expression, which is only compiled
+    the first time it is requested, as long as it is among the
+    `EXPRESSION_CACHE_SIZE` most recently used expressions.
+
+    Like `eval`, leading spaces and tabs are ignored. Values which are
+    not strings are returned unchanged.
+
+    :param expression: The source code of the expression.
+    :return: A code object to be passed to `eval`.
+    """
+    if not isinstance(expression, str):
+        return expression
+    return _compile_expression(expression)
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_expression(expression: str) -> CodeType:
+    return compile(expression.lstrip(' \t'), '<expression>', 'eval')
+
+
+def randomly(objects: Sized and Iterable, rng=random):
     shuffled = list(objects)
-    random.shuffle(shuffled)
+    rng.shuffle(shuffled)
     return shuffled
 
 
 def config_logging():
     this_dir = os.path.dirname(__file__)
     with open(os.path.join(this_dir, 'logging_config.yml'), 'r') as file:
-        log_conf_dict = yaml.safe_load(file)
+        log_conf_dict = yaml.load(file, Loader=YamlLoader)
     logging.config.dictConfig(log_conf_dict)
 
 
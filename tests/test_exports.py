@@ -0,0 +1,338 @@
+import io
+import os
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+import yaml
+import svgwrite
+from model_gen.graph import Graph, Vertex, Edge
+from model_gen.productions import Production, ProductionOption
+from model_gen.grammar import Grammar, GrammarInfo
+from model_gen.utils import Mapping
+from model_gen.exports import (SVGWriter, add_graphelement_to_svg_drawing,
+                               export_graph_to_svg, export_graph_to_TIKZ,
+                               get_TIKZ_string, graph_to_TIKZ, write_TIKZ,
+                               rasterize_graph, write_png,
+                               export_derivation_to_svg)
+from model_gen.batch import export_graphs
+from model_gen.binary import load_binary
+from model_gen.cli import main
+from model_gen.serialisation import save_grammar_info
+
+
+PREAMBLE = {'filter': {'brown': {'feColorMatrix': {
+    'type': 'matrix', 'values': '0 0 0 0 0.58 0 0 0 0 0.31 0 0 0 0 0.07 '
+                                '0 0 0 1 0'
+}}}}
+
+
+def make_vertex(x, y, **attrs):
+    vertex = Vertex()
+    vertex.attr = {'x': x, 'y': y, **attrs}
+    return vertex
+
+
+def make_graph():
+    vertices = [
+        make_vertex(0, 0),
+        make_vertex(1, 0, **{'.svg_stroke': 'red'}),
+        make_vertex(1, 1, **{'.svg_tag': 'rect', '.svg_width': 0.5,
+                             '.svg_height': 0.25, '.svg_class': 'a&b'}),
+        make_vertex(0, 1, **{'.svg_tag': 'image', '.svg_href': 'brush.png',
+                             '.svg_width': 2, '.svg_height': 1,
+                             '.svgx_rotate': 30, '.svg_filter': 'brown'}),
+        make_vertex(2, 2, **{'.svg_tag': 'None'}),
+    ]
+    edges = [Edge(vertices[0], vertices[1]), Edge(vertices[1], vertices[2]),
+             Edge(vertices[2], vertices[3]), Edge(vertices[3], vertices[0])]
+    edges[2].attr['.svg_stroke_opacity'] = 0.5
+    return Graph.from_elements(vertices, edges)
+
+
+def write_svg(graph, **kwargs):
+    stream = io.StringIO()
+    writer = SVGWriter(stream, '0 0 10 10', (10, 10), PREAMBLE, **kwargs)
+    writer.write_graph(graph)
+    writer.close()
+    return stream.getvalue()
+
+
+class TestSVGWriter:
+
+    def test_same_as_svgwrite(self):
+        graph = make_graph()
+        drawing = svgwrite.Drawing(debug=True, profile='full', size=(10, 10),
+                                   viewBox='0 0 10 10',
+                                   preserveAspectRatio='xMidYMid meet')
+        filters = {}
+        for filter_name, filter_def in PREAMBLE['filter'].items():
+            new_filter = drawing.defs.add(drawing.filter(id=filter_name))
+            for effect_name, effect_args in filter_def.items():
+                getattr(new_filter, effect_name)(**effect_args)
+            filters[filter_name] = new_filter
+        expected_svg = write_svg(graph, merge_edges=False, validate=True)
+        for element in graph:
+            add_graphelement_to_svg_drawing(element, drawing, filters)
+        assert expected_svg == drawing.tostring()
+
+    def test_merge_edges(self):
+        svg = write_svg(make_graph())
+        assert svg.count('<line') == 1
+        assert svg.count('d="M ') + svg.count(' M ') == 3
+        assert 'class="a&amp;b"' in svg
+
+    def test_merge_edges_keeps_order(self):
+        vertices = [make_vertex(x, 0) for x in range(4)]
+        edges = [Edge(vertices[i], vertices[i + 1]) for i in range(3)]
+        edges[1].attr['.svg_stroke'] = 'red'
+        svg = write_svg(Graph.from_elements(vertices, edges))
+        paths = svg.split('<path')[1:]
+        assert [('red' in path, path.count(' L ')) for path in paths] \
+            == [(False, 1), (True, 1), (False, 1)]
+
+    def test_export_graph_to_svg(self, tmp_path):
+        path = str(tmp_path / 'graph.svg')
+        export_graph_to_svg(make_graph(), path, PREAMBLE)
+        with open(path, encoding='utf-8') as stream:
+            assert stream.read().startswith('<?xml')
+
+
+class TestTIKZ:
+
+    def test_write_TIKZ(self):
+        graph = make_graph()
+        element_names = {}
+        tikz_graph = graph_to_TIKZ(graph, 'A', 'a_', element_names)
+        stream = io.StringIO()
+        write_TIKZ(tikz_graph, stream)
+        code = stream.getvalue()
+        assert code == get_TIKZ_string(tikz_graph)
+        lines = code.splitlines()
+        assert lines[0] == '  \\begin{scope}[local bounding box=A]'
+        assert sum(line.startswith('    \\node [vertex]')
+                   for line in lines) == 5
+        assert sum(line.startswith('    \\path [edge]')
+                   for line in lines) == 4
+        assert len(element_names) == 9
+        for edge in graph.edges:
+            assert (f'({element_names[edge.vertex1]}) edge node '
+                    f'({element_names[edge]})') in code
+
+    def test_export_graph_to_TIKZ(self, tmp_path):
+        path = str(tmp_path / 'graph.tex')
+        export_graph_to_TIKZ(make_graph(), path)
+        with open(path) as stream:
+            code = stream.read()
+        assert code.count('\\node [vertex]') == 5
+        assert '\\verb|.svg_stroke| & \\lstinline[]$red$' in code
+        assert code.endswith('\\end{table}\n')
+
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+
+def visible_shapes(root, time):
+    """
+    Return the shapes of an animated svg file visible at a time.
+    """
+    shapes = {}
+    for child in root:
+        if child.tag != SVG + 'g':
+            continue
+        if 'id' in child.attrib:
+            shapes[child.attrib['id']] = child[0]
+            continue
+        sets = child.findall(SVG + 'set')
+        if float(sets[0].attrib['begin'][:-1]) > time:
+            continue
+        for hide in sets[1:]:
+            del shapes[hide.attrib['{http://www.w3.org/1999/xlink}href'][1:]]
+        for group in child.findall(SVG + 'g'):
+            shapes[group.attrib['id']] = group[0]
+    return sorted(ET.tostring(shape) for shape in shapes.values())
+
+
+def make_grow_grammar():
+    mother_graph = Graph()
+    m_n1 = make_vertex(0, 0, label="attr == 'a'")
+    mother_graph.add(m_n1)
+    daughter_graph = Graph()
+    d_n1 = make_vertex(0, 0, label="'b'", **{'.svg_stroke': "'red'"})
+    d_n2 = make_vertex(1, 0, label="'a'")
+    d_e1 = Edge(d_n1, d_n2)
+    daughter_graph.add_elements([d_n1, d_n2, d_e1])
+    mapping = Mapping()
+    mapping[m_n1] = d_n1
+    option = ProductionOption(mother_graph, mapping, daughter_graph)
+    return Grammar({'grow': Production(mother_graph, [option])}, {})
+
+
+class TestSVGAnimation:
+
+    def test_export_derivation_to_svg(self, tmp_path):
+        host_graph = Graph()
+        host_graph.add(make_vertex(0, 0, label='a'))
+        steps = list(make_grow_grammar().iter_apply(host_graph, {'all': 4}))
+        path = str(tmp_path / 'derivation.svg')
+        export_derivation_to_svg(host_graph, (step.delta for step in steps),
+                                 path, {}, frame_duration=1)
+        root = ET.parse(path).getroot()
+        # only the changes of every step are written
+        assert len(root.findall(f'.//{SVG}circle')) == 1 + 2 * 4
+        assert len(root.findall(f'.//{SVG}line')) == 4
+        for time, graph in enumerate([host_graph] +
+                                     [step.graph for step in steps]):
+            export_graph_to_svg(graph, str(tmp_path / 'graph.svg'), {},
+                                merge_edges=False)
+            expected = [shape for shape
+                        in ET.parse(str(tmp_path / 'graph.svg')).getroot()
+                        if shape.tag != SVG + 'defs']
+            assert visible_shapes(root, time) == \
+                sorted(ET.tostring(shape) for shape in expected)
+        view_box = [float(x) for x in root.attrib['viewBox'].split()]
+        assert view_box[2] > 0 and view_box[3] >= 0
+
+
+class TestCLIAnimate:
+
+    @staticmethod
+    def write_grammar_file(path, options):
+        grammar_info = GrammarInfo()
+        host_graph = Graph()
+        host_graph.add(make_vertex(0, 0, label='a'))
+        grammar_info.host_graphs = {'host': host_graph}
+        grammar_info.productions = make_grow_grammar().productions
+        grammar_info.result_graphs = {}
+        grammar_info.global_vars = {}
+        grammar_info.options = options
+        grammar_info.extra = {}
+        grammar_info.svg_preamble = {}
+        save_grammar_info(grammar_info, path)
+
+    @staticmethod
+    def count_circles(path):
+        return len(ET.parse(path).getroot().findall(f'.//{SVG}circle'))
+
+    def test_animate_max_derivations_of_grammar(self, tmp_path):
+        grammar_path = str(tmp_path / 'grammar.yml')
+        self.write_grammar_file(grammar_path, {'max_derivations': {'all': 3}})
+        path = str(tmp_path / 'derivation.svg')
+        assert main(['animate', grammar_path, path]) == 0
+        assert self.count_circles(path) == 1 + 2 * 3
+        assert main(['animate', grammar_path, path, '-s', '2']) == 0
+        assert self.count_circles(path) == 1 + 2 * 2
+
+    def test_animate_max_derivations_of_opts(self, tmp_path, mocker):
+        mocker.patch.dict('model_gen.cli.opts', {'max_derivations': 2})
+        grammar_path = str(tmp_path / 'grammar.yml')
+        self.write_grammar_file(grammar_path, {})
+        path = str(tmp_path / 'derivation.svg')
+        assert main(['animate', grammar_path, path]) == 0
+        assert self.count_circles(path) == 1 + 2 * 2
+
+
+class TestRaster:
+
+    def test_rasterize_graph(self):
+        graph = make_graph()
+        image = rasterize_graph(graph, 41, 21, margin=0, point_size=1)
+        assert image.shape == (21, 41, 3)
+        black = np.all(image == 0, axis=2)
+        # the graph spans 2x2 units, scaled to 10 pixels per unit and
+        # centred horizontally, with y pointing up
+        assert black[20, 10] and black[20, 20] and black[10, 20]
+        assert black[10, 10] and black[20, 15] and black[15, 20]
+        # the vertex at (2, 2) has the .svg_tag None
+        assert not black[0, 30]
+        assert black.sum() == 40
+
+    def test_rasterize_graph_in_chunks(self, mocker):
+        graph = make_graph()
+        expected = rasterize_graph(graph, 41, 21, margin=0, line_width=2)
+        mocker.patch('model_gen.exports.RASTER_CHUNK_SIZE', 7)
+        image = rasterize_graph(graph, 41, 21, margin=0, line_width=2)
+        assert np.array_equal(image, expected)
+
+    def test_rasterize_empty_graph(self):
+        image = rasterize_graph(Graph(), 8, 8)
+        assert np.all(image == 255)
+
+    def test_write_png(self, tmp_path):
+        path = str(tmp_path / 'graph.png')
+        image = rasterize_graph(make_graph(), 16, 12)
+        write_png(image, path)
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        assert data[:8] == b'\x89PNG\r\n\x1a\n'
+        assert struct.unpack('>II', data[16:24]) == (16, 12)
+        idat_length = struct.unpack('>I', data[33:37])[0]
+        assert data[37:41] == b'IDAT'
+        rows = np.frombuffer(zlib.decompress(data[41:41 + idat_length]),
+                             np.uint8).reshape(12, -1)
+        assert np.all(rows[:, 0] == 0)
+        assert np.array_equal(rows[:, 1:].reshape(image.shape), image)
+
+
+class TestBatchExport:
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_export_graphs(self, tmp_path, workers):
+        broken_graph = Graph()
+        broken_graph.add(Vertex())
+        graphs = {'Result 0': make_graph(), 'Result 1': make_graph(),
+                  'broken': broken_graph}
+        report = export_graphs(graphs, str(tmp_path), 'svg', PREAMBLE,
+                               workers)
+        assert sorted(os.listdir(str(tmp_path))) == ['Result_0.svg',
+                                                     'Result_1.svg']
+        assert set(report.files) == {'Result 0', 'Result 1'}
+        assert set(report.failures) == {'broken'}
+        assert report.elements == 18
+
+    def test_export_graphs_same_file_name(self, tmp_path):
+        graphs = {'Result 0': make_graph(), 'Result_0': make_graph(),
+                  'result_0': make_graph()}
+        report = export_graphs(graphs, str(tmp_path), 'binary', workers=1)
+        assert sorted(os.listdir(str(tmp_path))) == [
+            'Result_0.npz', 'Result_0_2.npz', 'result_0_3.npz'
+        ]
+        assert len(set(report.files.values())) == 3
+
+    def test_cli_export_same_name(self, tmp_path):
+        grammar_path = str(tmp_path / 'grammar.yml')
+        host_graph, result_graph = make_graph(), Graph()
+        result_graph.add(make_vertex(0, 0))
+        with open(grammar_path, 'w') as stream:
+            yaml.safe_dump({
+                'host_graphs': {'graph': host_graph.to_yaml()},
+                'productions': {},
+                'result_graphs': {'graph': result_graph.to_yaml()},
+            }, stream)
+        output_dir = str(tmp_path / 'out')
+        assert main(['export', grammar_path, output_dir, '-f', 'binary',
+                     '-g', 'all', '-w', '1']) == 0
+        assert sorted(os.listdir(output_dir)) == ['host_graph.npz',
+                                                  'result_graph.npz']
+        graph = load_binary(os.path.join(output_dir, 'result_graph.npz'))
+        assert len(graph.vertices) == 1
+
+    def test_cli_export(self, tmp_path):
+        grammar_path = str(tmp_path / 'grammar.yml')
+        # The ids in the file are those of live objects, so both graphs
+        # need to exist at the same time.
+        host_graph, result_graph = make_graph(), make_graph()
+        with open(grammar_path, 'w') as stream:
+            yaml.safe_dump({
+                'host_graphs': {'host': host_graph.to_yaml()},
+                'productions': {},
+                'result_graphs': {'Result 0': result_graph.to_yaml()},
+            }, stream)
+        output_dir = str(tmp_path / 'out')
+        assert main(['export', grammar_path, output_dir, '-f', 'binary',
+                     '-g', 'all', '-w', '1']) == 0
+        assert sorted(os.listdir(output_dir)) == ['Result_0.npz',
+                                                  'host.npz']
+        graph = load_binary(os.path.join(output_dir, 'host.npz'))
+        assert len(graph.vertices) == 5
@@ -0,0 +1,483 @@
+import json
+import os
+import pickle
+import random
+import pytest
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+
+from model_gen.graph import Graph, Vertex, Edge
+from model_gen.productions import Production, ProductionOption
+from model_gen.grammar import Grammar, GrammarInfo, LazyGraphMapping
+from model_gen.budget import RunBudget, StopReason
+from model_gen.context import RunContext
+from model_gen.exceptions import ModelGenArgumentError
+from model_gen.analysis import (get_constant_values, NegativeMatchCache,
+                                DependencyGraph)
+from model_gen.serialisation import (save_grammar_info, load_grammar_info,
+                                     to_yaml)
+from model_gen.utils import Mapping
+from model_gen import cache, compilation
+from model_gen.cache import load_grammar_info_cached
+
+
+def make_vertex(x=0, y=0, **attrs):
+    vertex = Vertex()
+    vertex.attr.update({'x': x, 'y': y, **attrs})
+    return vertex
+
+
+def make_grow_production():
+    """
+    Production which turns a vertex labeled a into a vertex labeled b
+    with a newly attached vertex labeled a.
+    """
+    mother_graph = Graph()
+    m_n1 = make_vertex(label="attr == 'a'")
+    mother_graph.add(m_n1)
+    daughter_graph = Graph()
+    d_n1 = make_vertex(label="'b'")
+    d_n2 = make_vertex(1, 0, label="'a'")
+    d_e1 = Edge(d_n1, d_n2)
+    daughter_graph.add_elements([d_n1, d_n2, d_e1])
+    mapping = Mapping()
+    mapping[m_n1] = d_n1
+    option = ProductionOption(mother_graph, mapping, daughter_graph)
+    return Production(mother_graph, [option])
+
+
+def make_relabel_production(old_label, new_label, priority=0):
+    """
+    Production which relabels a single vertex.
+    """
+    mother_graph = Graph()
+    m_n1 = make_vertex(label=f"attr == '{old_label}'")
+    mother_graph.add(m_n1)
+    daughter_graph = Graph()
+    d_n1 = make_vertex(label=f"'{new_label}'")
+    daughter_graph.add(d_n1)
+    mapping = Mapping()
+    mapping[m_n1] = d_n1
+    option = ProductionOption(mother_graph, mapping, daughter_graph)
+    return Production(mother_graph, [option], priority=priority)
+
+
+def make_host_graph():
+    host_graph = Graph()
+    host_graph.add(make_vertex(label='a'))
+    return host_graph
+
+
+class TestGrammar:
+
+    def test_apply_steps(self):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        results = grammar.apply(make_host_graph(), {'all': 3})
+        assert len(results) == 3
+        assert [len(result.vertices) for result in results] == [2, 3, 4]
+        assert results.profile is None
+
+    def test_apply_profile(self, tmp_path):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        path = str(tmp_path / 'profile.json')
+        results = grammar.apply(make_host_graph(), {'all': 3}, profile=path)
+        profile = results.profile
+        assert profile['productions']['grow']['applications'] == 3
+        assert profile['productions']['grow']['elements_added'] == 6
+        assert profile['productions']['grow']['elements_removed'] == 0
+        assert [step['graph_size'] for step in profile['steps']] == [3, 5, 7]
+        with open(path) as stream:
+            assert json.load(stream)['steps'] == profile['steps']
+
+    def test_apply_profile_counts_delta(self):
+        mother_graph = Graph()
+        m_n1 = make_vertex(label="attr == 'a'")
+        mother_graph.add(m_n1)
+        option = ProductionOption(mother_graph, Mapping(), Graph())
+        grammar = Grammar({'remove': Production(mother_graph, [option])}, {})
+        host_graph = make_host_graph()
+        vertex = make_vertex(1, 0, label='b')
+        host_graph.add_elements([vertex, Edge(host_graph.vertices[0], vertex)])
+        results = grammar.apply(host_graph, {'all': 1}, profile=True)
+        assert len(results[-1]) == 2
+        profile = results.profile['productions']['remove']
+        assert profile['elements_added'] == 0
+        assert profile['elements_removed'] == 1
+
+    def test_apply_skips_dead_productions(self):
+        productions = {
+            'grow': make_grow_production(),
+            'never': make_relabel_production('z', 'y', priority=-1),
+        }
+        grammar = Grammar(productions, {})
+        results = grammar.apply(make_host_graph(), {'all': 4}, profile=True)
+        assert len(results) == 4
+        profile = results.profile['productions']['never']
+        assert profile['match_attempts'] == 0
+        assert profile['match_skips'] == 4
+
+    def test_apply_stop_reasons(self):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        results = grammar.apply(make_host_graph(), {'all': 2})
+        assert results.stop_reason is StopReason.MAX_STEPS
+        grammar = Grammar({'a_to_b': make_relabel_production('a', 'b')}, {})
+        results = grammar.apply(make_host_graph())
+        assert len(results) == 1
+        assert results.stop_reason is StopReason.NO_MATCH
+
+    @pytest.mark.parametrize('budget,steps,reason', [
+        (RunBudget(max_elements=6), 3, StopReason.MAX_ELEMENTS),
+        (RunBudget(max_memory=1), 1, StopReason.MAX_MEMORY),
+        (RunBudget(deadline=1e-9), 0, StopReason.DEADLINE),
+    ])
+    def test_apply_budget(self, budget, steps, reason):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        results = grammar.apply(make_host_graph(), {'all': 10}, budget=budget)
+        assert len(results) == steps
+        assert results.stop_reason is reason
+
+    def test_apply_max_matches(self):
+        host_graph = Graph()
+        host_graph.add_elements([make_vertex(i, 0, label='a')
+                                 for i in range(5)])
+        production = make_relabel_production('a', 'b')
+        assert len(production.match(host_graph)) == 5
+        assert len(production.match(host_graph, max_results=2)) == 2
+        grammar = Grammar({'a_to_b': production}, {})
+        results = grammar.apply(host_graph, budget=RunBudget(max_matches=1))
+        assert len(results) == 5
+
+    def test_budget_must_be_positive(self):
+        with pytest.raises(ModelGenArgumentError):
+            RunBudget(max_elements=0)
+
+    def test_budget_shared_by_runs(self):
+        budget = RunBudget(deadline=60, max_memory=1)
+        context = RunContext(budget=budget)
+        other_context = RunContext(budget=budget)
+        context.add_graph(make_host_graph())
+        assert context.check_budget(make_host_graph()) \
+            is StopReason.MAX_MEMORY
+        assert other_context.memory == 0
+        assert other_context.check_budget(make_host_graph()) is None
+        context.start_time -= 60
+        assert context.check_budget(make_host_graph()) is StopReason.DEADLINE
+        assert other_context.check_budget(make_host_graph()) is None
+
+    def test_resume_from_checkpoint(self, tmp_path):
+        production = make_grow_production()
+        for option in production.production_options:
+            for element in option.daughter_graph:
+                element.attr['value'] = 'random.random()'
+        grammar = Grammar({'grow': production}, {})
+        random.seed(1)
+        expected = grammar.apply(make_host_graph(), {'all': 6})
+        path = str(tmp_path / 'run.checkpoint')
+        random.seed(1)
+        first = grammar.apply(make_host_graph(), {'all': 3}, checkpoint=path)
+        random.seed(2)
+        resumed = grammar.resume(path, {'all': 6})
+        assert len(first) == 3
+        assert len(resumed) == 3
+        assert resumed.start_step == 3
+        assert resumed.stop_reason is StopReason.MAX_STEPS
+        assert ([element.attr for element in resumed[-1].element_list('vef')]
+                == [element.attr for element in expected[-1].element_list('vef')])
+
+    def test_iter_apply(self):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        steps = grammar.iter_apply(make_host_graph(), {'all': 3})
+        seen = []
+        while True:
+            try:
+                step = next(steps)
+            except StopIteration as stop:
+                assert stop.value is StopReason.MAX_STEPS
+                break
+            seen.append(step)
+        assert [step.index for step in seen] == [0, 1, 2]
+        assert all(step.production_name == 'grow' for step in seen)
+        assert [len(step.graph) for step in seen] == [3, 5, 7]
+        assert all(len(step.delta.added) == 2 for step in seen)
+        assert all(len(step.match) == 1 for step in seen)
+
+    def test_iter_apply_stop_early(self, tmp_path):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        path = str(tmp_path / 'run.checkpoint')
+        steps = grammar.iter_apply(make_host_graph(), checkpoint=path)
+        for step in steps:
+            if step.index == 4:
+                break
+        steps.close()
+        resumed = grammar.resume(path, {'all': 7})
+        assert resumed.start_step == 5
+        assert len(resumed) == 2
+
+    def test_concurrent_runs(self):
+        production = make_grow_production()
+        for option in production.production_options:
+            for element in option.daughter_graph:
+                element.attr['value'] = 'random.random()'
+        grammar = Grammar({'grow': production}, {})
+
+        def run(seed):
+            results = grammar.apply(make_host_graph(), {'all': 20},
+                                    rng=random.Random(seed))
+            return [element.attr for element
+                    in results[-1].element_list('vef')]
+
+        expected = [run(seed) for seed in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            assert list(executor.map(run, range(4))) == expected
+        assert expected[0] != expected[1]
+
+    def test_compile_shared_by_content(self):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        same = Grammar({'grow': make_grow_production()}, {})
+        other = Grammar({'a_to_b': make_relabel_production('a', 'b')}, {})
+        assert same.compile() is grammar.compile()
+        assert other.compile() is not grammar.compile()
+        assert other.compile().key != grammar.compile().key
+
+    def test_compiled_grammar_pickle(self):
+        grammar = Grammar({'grow': make_grow_production()}, {})
+        compiled = pickle.loads(pickle.dumps(grammar.compile()))
+        assert compiled.key == grammar.compile().key
+        copy = Grammar(compiled=compiled)
+        results = copy.apply(make_host_graph(), {'all': 3},
+                             rng=random.Random(1))
+        expected = grammar.apply(make_host_graph(), {'all': 3},
+                                 rng=random.Random(1))
+        assert ([len(result) for result in results]
+                == [len(result) for result in expected])
+
+    def test_apply_subgrammars(self):
+        relabel = Grammar({'a_to_c': make_relabel_production('a', 'c')}, {},
+                          name='relabel')
+        grammar = Grammar({'grow': make_grow_production()}, {}, [relabel],
+                          max_steps={'all': 2})
+        assert grammar.stages() == [grammar, relabel]
+        steps = list(grammar.iter_apply(make_host_graph(), {'all': 5}))
+        assert [step.stage for step in steps] == [0, 0, 1]
+        assert [step.index for step in steps] == [0, 1, 2]
+        results = grammar.apply(make_host_graph(), {'all': 5})
+        assert results.stop_reason is StopReason.NO_MATCH
+        assert sorted(vertex.attr['label'] for vertex
+                      in results[-1].vertices) == ['b', 'b', 'c']
+        results = grammar.apply(make_host_graph(), {'all': 2})
+        assert len(results) == 2
+        assert results.stop_reason is StopReason.MAX_STEPS
+
+    def test_subgrammar_max_steps(self):
+        grow = Grammar({'grow': make_grow_production()}, {}, name='grow',
+                       max_steps={'all': 3})
+        grammar = Grammar({}, {}, [grow])
+        assert grammar.stages() == [grow]
+        results = grammar.apply(make_host_graph(), {'all': 1})
+        assert len(results) == 1
+        assert results.stop_reason is StopReason.MAX_STEPS
+        results = grammar.apply(make_host_graph(), {'all': 0})
+        assert len(results) == 3
+        assert results.stop_reason is StopReason.MAX_STEPS
+
+    def test_grammar_yaml(self):
+        relabel = Grammar({'a_to_c': make_relabel_production('a', 'c')}, {},
+                          name='relabel', max_steps={'all': 1})
+        grammar = Grammar({'grow': make_grow_production()}, {}, [relabel])
+        loaded = Grammar.from_yaml(grammar.to_yaml())
+        assert [stage.name for stage in loaded.stages()] == [None, 'relabel']
+        assert loaded.subgrammars[0].max_steps == {'all': 1}
+        assert set(loaded.productions) == {'grow'}
+
+
+class TestGrammarFiles:
+
+    @staticmethod
+    def make_grammar_info():
+        grammar_info = GrammarInfo()
+        grammar_info.host_graphs = {'host': make_host_graph()}
+        grammar_info.productions = {'grow': make_grow_production()}
+        grammar = grammar_info.create_grammar()
+        grammar_info.result_graphs = {
+            f'Result {index}': graph for index, graph
+            in enumerate(grammar.apply(make_host_graph(), {'all': 3}))
+        }
+        grammar_info.global_vars = {}
+        grammar_info.subgrammars = []
+        grammar_info.options = {}
+        grammar_info.extra = {}
+        grammar_info.svg_preamble = {}
+        return grammar_info
+
+    def test_stream_round_trip(self, tmp_path):
+        path = str(tmp_path / 'grammar.yml')
+        save_grammar_info(self.make_grammar_info(), path)
+        loaded = load_grammar_info(path)
+        assert list(loaded.result_graphs) == ['Result 0', 'Result 1',
+                                              'Result 2']
+        assert [len(graph.vertices) for graph
+                in loaded.result_graphs.values()] == [2, 3, 4]
+        assert set(loaded.productions) == {'grow'}
+        assert len(load_grammar_info(path, False).result_graphs) == 0
+        subset = load_grammar_info(path, ['Result 1'])
+        assert list(subset.result_graphs) == ['Result 1']
+
+    @pytest.mark.parametrize('file_name', ['grammar.yml', 'grammar.npz'])
+    def test_lazy_graphs(self, tmp_path, file_name):
+        path = str(tmp_path / file_name)
+        save_grammar_info(self.make_grammar_info(), path)
+        loaded = load_grammar_info(path)
+        assert isinstance(loaded.result_graphs, LazyGraphMapping)
+        assert not any(loaded.result_graphs.is_loaded(name)
+                       for name in loaded.result_graphs)
+        assert not loaded.host_graphs.is_loaded('host')
+        assert len(loaded.result_graphs['Result 1'].vertices) == 3
+        assert loaded.result_graphs.is_loaded('Result 1')
+        assert not loaded.result_graphs.is_loaded('Result 2')
+        graph = Graph()
+        loaded.result_graphs['Result 2'] = graph
+        assert loaded.result_graphs['Result 2'] is graph
+        del loaded.result_graphs['Result 0']
+        assert list(loaded.result_graphs) == ['Result 1', 'Result 2']
+
+    def test_binary_round_trip(self, tmp_path):
+        path = str(tmp_path / 'grammar.npz')
+        save_grammar_info(self.make_grammar_info(), path)
+        loaded = load_grammar_info(path)
+        assert list(loaded.result_graphs) == ['Result 0', 'Result 1',
+                                              'Result 2']
+        assert [len(graph.vertices) for graph
+                in loaded.result_graphs.values()] == [2, 3, 4]
+        assert list(load_grammar_info(path, ['Result 1']).result_graphs) \
+            == ['Result 1']
+        grammar = loaded.create_grammar()
+        assert len(grammar.apply(loaded.host_graphs['host'],
+                                 {'all': 2})[-1].vertices) == 3
+
+    def test_cached_load(self, tmp_path, mocker):
+        path = str(tmp_path / 'grammar.yml')
+        cache_dir = str(tmp_path / 'cache')
+        save_grammar_info(self.make_grammar_info(), path)
+        loaded = load_grammar_info_cached(path, cache_dir)
+        assert not loaded.host_graphs.is_loaded('host')
+        assert not any(loaded.result_graphs.is_loaded(name)
+                       for name in loaded.result_graphs)
+        compiled = loaded.create_grammar().compile()
+        assert len(os.listdir(cache_dir)) == 1
+        spy = mocker.spy(cache, 'load_grammar_info')
+        mocker.patch.dict(compilation._compiled_grammars, clear=True)
+        cached = load_grammar_info_cached(path, cache_dir)
+        assert spy.call_count == 0
+        assert list(cached.result_graphs) == list(loaded.result_graphs)
+        assert not cached.result_graphs.is_loaded('Result 1')
+        assert len(cached.result_graphs['Result 1'].vertices) == 3
+        assert len(cached.host_graphs['host'].vertices) == 1
+        assert list(compilation._compiled_grammars) == [compiled.key]
+        assert (cached.create_grammar().compile()
+                is compilation._compiled_grammars[compiled.key])
+        with open(path, 'a') as stream:
+            stream.write('\n')
+        load_grammar_info_cached(path, cache_dir)
+        assert spy.call_count == 1
+        assert len(os.listdir(cache_dir)) == 2
+
+    def test_cached_load_binary(self, tmp_path, mocker):
+        path = str(tmp_path / 'grammar.npz')
+        cache_dir = str(tmp_path / 'cache')
+        save_grammar_info(self.make_grammar_info(), path)
+        load_grammar_info_cached(path, cache_dir)
+        spy = mocker.spy(cache, 'load_grammar_info')
+        cached = load_grammar_info_cached(path, cache_dir)
+        assert spy.call_count == 0
+        assert not cached.result_graphs.is_loaded('Result 2')
+        assert [len(graph.vertices) for graph
+                in cached.result_graphs.values()] == [2, 3, 4]
+
+    def test_invalid_cache_file(self, tmp_path, mocker):
+        path = str(tmp_path / 'grammar.yml')
+        cache_dir = str(tmp_path / 'cache')
+        save_grammar_info(self.make_grammar_info(), path)
+        load_grammar_info_cached(path, cache_dir)
+        mocker.patch('pickle.load', side_effect=ModuleNotFoundError)
+        loaded = load_grammar_info_cached(path, cache_dir)
+        assert set(loaded.productions) == {'grow'}
+
+    def test_prune_cache(self, tmp_path, mocker):
+        path = str(tmp_path / 'grammar.yml')
+        cache_dir = str(tmp_path / 'cache')
+        save_grammar_info(self.make_grammar_info(), path)
+        mocker.patch.dict(cache.opts, {'cache_max_files': 2})
+        for _ in range(3):
+            with open(path, 'a') as stream:
+                stream.write('\n')
+            load_grammar_info_cached(path, cache_dir)
+        with open(path, 'rb') as stream:
+            newest = cache.cache_key(stream.read())
+        assert len(os.listdir(cache_dir)) == 2
+        assert newest + cache.CACHE_EXTENSION in os.listdir(cache_dir)
+
+    def test_load_single_document(self, tmp_path):
+        path = str(tmp_path / 'grammar.yml')
+        with open(path, 'w') as stream:
+            yaml.safe_dump(to_yaml(self.make_grammar_info()), stream)
+        loaded = load_grammar_info(path, ['Result 2'])
+        assert list(loaded.result_graphs) == ['Result 2']
+        assert len(loaded.result_graphs['Result 2'].vertices) == 4
+
+
+class TestNegativeMatchCache:
+
+    @pytest.mark.parametrize('predicate,expected', [
+        ("attr == 'a'", ('a',)),
+        ("'a'==attr", ('a',)),
+        ('attr == 0', (0,)),
+        ("attr in ('a', 'b')", ('a', 'b')),
+        ('float(attr) >= 10', None),
+        ('not attr', None),
+        ('attr == other', None),
+    ])
+    def test_get_constant_values(self, predicate, expected):
+        assert get_constant_values(predicate) == expected
+
+    def test_revive_on_relevant_element(self):
+        production = make_relabel_production('b', 'c')
+        cache = NegativeMatchCache([production])
+        cache.mark_failed(production)
+        cache.update([make_vertex(label='a'), Edge()])
+        assert cache.is_dead(production)
+        cache.update([make_vertex(label='b')])
+        assert not cache.is_dead(production)
+
+
+class TestDependencyGraph:
+
+    def make_dependencies(self):
+        return DependencyGraph({
+            'grow': make_grow_production(),
+            'b_to_c': make_relabel_production('b', 'c'),
+            'c_to_d': make_relabel_production('c', 'd'),
+            'z_to_b': make_relabel_production('z', 'b'),
+        })
+
+    def test_successors(self):
+        dependencies = self.make_dependencies()
+        assert dependencies.successors['grow'] == {'grow', 'b_to_c'}
+        assert dependencies.successors['b_to_c'] == {'c_to_d'}
+        assert dependencies.successors['c_to_d'] == set()
+        assert dependencies.terminal_productions() == {'c_to_d'}
+        assert dependencies.terminal_values() == {('Vertex', 'label', 'd')}
+
+    def test_reachable(self):
+        dependencies = self.make_dependencies()
+        assert (dependencies.reachable(make_host_graph())
+                == {'grow', 'b_to_c', 'c_to_d'})
+        host_graph = Graph()
+        host_graph.add(make_vertex(label='c'))
+        assert dependencies.reachable(host_graph) == {'c_to_d'}
+
+    def test_topological_order(self):
+        order = self.make_dependencies().topological_order()
+        position = {name: index for index, group in enumerate(order)
+                    for name in group}
+        assert position['grow'] < position['b_to_c'] < position['c_to_d']
+        assert position['z_to_b'] < position['b_to_c']
@@ -1,6 +1,8 @@
 import pytest
 from model_gen import graph
-from model_gen.exceptions import ModelGenArgumentError
+from model_gen.binary import to_binary, from_binary
+from model_gen.exceptions import (ModelGenArgumentError,
+                                  ModelGenIncongruentGraphStateError)
 
 
 class TestGraphElement:
@@ -332,3 +334,126 @@ class TestEdge:
         with pytest.raises(ValueError):
             edge.replace_connection(func)
 
+
+class TestGenerations:
+
+    @staticmethod
+    def make_elements(generations):
+        elements = []
+        for generation in generations:
+            vertex = graph.Vertex()
+            vertex.attr = {'.generation': str(generation)}
+            elements.append(vertex)
+        return elements
+
+    @pytest.mark.parametrize('older,younger', [
+        ([0, 0], [0, 1]),
+        ([1, 1], [2, 0, 3]),
+        ([0, 2], [1, 1]),
+        ([0, 1, 5], [1, 2, 3]),
+    ])
+    def test_generation_key_order(self, older, younger):
+        older_key = graph.generation_key(self.make_elements(older))
+        younger_key = graph.generation_key(self.make_elements(younger))
+        assert older_key > younger_key
+
+    def test_generation_key_equality(self):
+        assert (graph.generation_key(self.make_elements([2, 0, 1]))
+                == graph.generation_key(self.make_elements([0, 1, 2])))
+        assert (hash(graph.generation_key(self.make_elements([2, 0, 1])))
+                == hash(graph.generation_key(self.make_elements([0, 1, 2]))))
+
+    def test_match_oldest_only(self):
+        host_graph = graph.Graph()
+        vertices = self.make_elements([3, 0, 2, 0, 1])
+        host_graph.add_elements(vertices)
+        mother_graph = graph.Graph()
+        mother_vertex = graph.Vertex()
+        mother_graph.add(mother_vertex)
+        mother_vertex.attr = {}
+        assert len(host_graph.match(mother_graph, eval_attrs=True)) == 5
+        matches = host_graph.match(mother_graph, eval_attrs=True,
+                                   oldest_only=True)
+        assert sorted(id(match[mother_vertex]) for match in matches) == \
+            sorted([id(vertices[1]), id(vertices[3])])
+
+    def test_match_oldest_only_same_average(self):
+        host_graph = graph.Graph()
+        for generations in ([0, 2, 2], [1, 1, 2]):
+            vertex1, vertex2 = self.make_elements(generations[1:])
+            edge = graph.Edge(vertex1, vertex2)
+            edge.attr = {'.generation': str(generations[0])}
+            host_graph.add_elements([vertex1, vertex2, edge])
+        mother_graph = graph.Graph()
+        mother_vertex1, mother_vertex2 = graph.Vertex(), graph.Vertex()
+        mother_graph.add_elements([mother_vertex1, mother_vertex2,
+                                   graph.Edge(mother_vertex1, mother_vertex2)])
+        assert len(host_graph.match(mother_graph)) == 4
+        matches = host_graph.match(mother_graph, oldest_only=True)
+        assert len(matches) == 2
+        assert all(match[mother_vertex1] in host_graph.vertices[:2]
+                   for match in matches)
+
+
+class TestFromElements:
+
+    def test_from_elements(self):
+        vertex1 = graph.Vertex()
+        vertex1.attr = {'.generation': '2'}
+        vertex2 = graph.Vertex()
+        edge = graph.Edge(vertex1, vertex2)
+        result = graph.Graph.from_elements([vertex1, vertex2], [edge])
+        assert result.vertices == [vertex1, vertex2]
+        assert result.edges == [edge]
+        assert vertex1.edges == {edge} and vertex2.edges == {edge}
+        assert vertex2.attr['.generation'] == 2
+        assert edge.attr['.generation'] == 2
+        assert graph.graph_is_consistent(result)
+
+    def test_from_elements_invalid(self):
+        vertex = graph.Vertex()
+        edge = graph.Edge(vertex, graph.Vertex())
+        with pytest.raises(ModelGenIncongruentGraphStateError):
+            graph.Graph.from_elements([vertex], [edge])
+        assert vertex.edges == set()
+        with pytest.raises(ModelGenIncongruentGraphStateError):
+            graph.Graph.from_elements([vertex, vertex], [])
+
+    def test_from_yaml(self):
+        host_graph = graph.Graph()
+        vertex1 = graph.Vertex()
+        vertex2 = graph.Vertex()
+        host_graph.add_elements([vertex1, vertex2,
+                                 graph.Edge(vertex1, vertex2)])
+        loaded = graph.Graph.from_yaml(host_graph.to_yaml(), {})
+        assert len(loaded.vertices) == 2
+        assert loaded.edges[0].vertex1 is loaded.vertices[0]
+        assert loaded.vertices[1].edges == {loaded.edges[0]}
+
+
+class TestBinary:
+
+    def test_graph_round_trip(self):
+        host_graph = graph.Graph()
+        vertex1 = graph.Vertex()
+        vertex1.attr = {'x': 1.5, 'y': -2.0, 'label': 'a', 'count': 3,
+                        'flag': True, 'none': None, 'list': [1, 'b'],
+                        'big': 2 ** 70}
+        vertex2 = graph.Vertex()
+        vertex2.attr = {'x': 0, 'y': '2 * x', 'label': 'b'}
+        edge1 = graph.Edge(vertex1, vertex2)
+        edge1.attr = {'label': 'a', 'weight': 0.25}
+        edge2 = graph.Edge(vertex2, None)
+        host_graph.add_elements([vertex1, vertex2, edge1, edge2])
+        loaded = from_binary(to_binary(host_graph))
+        assert [vertex.attr for vertex in loaded.vertices] == \
+            [vertex1.attr, vertex2.attr]
+        assert [edge.attr for edge in loaded.edges] == \
+            [edge1.attr, edge2.attr]
+        assert type(loaded.vertices[1].attr['x']) is int
+        loaded_edge1, loaded_edge2 = loaded.edges
+        assert loaded_edge1.vertex1 is loaded.vertices[0]
+        assert loaded_edge1.vertex2 is loaded.vertices[1]
+        assert loaded_edge2.vertex1 is loaded.vertices[1]
+        assert loaded_edge2.vertex2 is None
+        assert loaded.vertices[1].edges == {loaded_edge1, loaded_edge2}
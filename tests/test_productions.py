@@ -1,3 +1,4 @@
+import random
 import pytest
 import pytest_mock
 
@@ -193,3 +194,50 @@ class TestProduction:
         assert len(result.edges) == 1
         # Test if the vertex was removed from the edges connection field
         assert result.edges[0].vertex2 is None
+
+
+class TestSelectOption:
+    @staticmethod
+    def _production(weights):
+        mother_graph = Graph()
+        m_n1 = Vertex()
+        m_n1.attr.update({'x': 0, 'y': 0})
+        mother_graph.add(m_n1)
+        options = [ProductionOption(mother_graph, Mapping(), Graph(), weight)
+                   for weight in weights]
+        return Production(mother_graph, options)
+
+    def test_cumulative_weights(self):
+        production = self._production([1, 2.5, 0.5])
+        assert production.cumulative_weights == [1.0, 3.5, 4.0]
+        assert production.total_weight == 4.0
+
+    def test_zero_weight_never_selected(self):
+        production = self._production([0, 1, 0])
+        rng = random.Random(1)
+        for _ in range(200):
+            option = production.select_option(rng=rng)
+            assert option is production.production_options[1]
+
+    def test_float_weights_distribution(self):
+        production = self._production([0.25, 0.75])
+        rng = random.Random(4)
+        counts = [0, 0]
+        for _ in range(4000):
+            option = production.select_option(rng=rng)
+            counts[production.production_options.index(option)] += 1
+        assert 800 < counts[0] < 1200
+
+    def test_weight_override(self):
+        production = self._production([1, 1])
+        table = production.build_option_table({0: 0})
+        rng = random.Random(2)
+        for _ in range(100):
+            option = production.select_option(table, rng)
+            assert option is production.production_options[1]
+        assert production.weights == [1.0, 1.0]
+
+    def test_weight_override_wrong_length(self):
+        production = self._production([1, 1])
+        with pytest.raises(ValueError):
+            production.build_option_table([1, 2, 3])